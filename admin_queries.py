@@ -0,0 +1,144 @@
+"""Keyset-paginated admin listings (chat sessions, feedbacks).
+
+Pages are addressed by an opaque cursor holding the ``(created_at, id)`` of
+the row they continue from, so page 1 and page 10,000 cost the same: both
+are one index range scan of ``limit + 1`` rows. The matching composite
+indexes are in migrations/003_admin_listing_indexes.sql.
+"""
+import base64
+import os
+import time
+from datetime import datetime, timedelta
+
+ADMIN_PAGE_SIZE = int(os.getenv("ADMIN_PAGE_SIZE", "50"))
+
+SESSION_SELECT = """
+    SELECT cs.id,
+        CASE
+            WHEN cs.user_type = 'guest' THEN CONCAT('Guest_', cs.guest_id, ', ', cs.session_name)
+            ELSE CONCAT(s.full_name, ', ', cs.session_name)
+        END AS session_name,
+        cs.user_type,
+        cs.student_id,
+        cs.created_at
+    FROM chat_sessions cs
+    LEFT JOIN students s ON cs.student_id = s.id
+"""
+
+FEEDBACK_SELECT = "SELECT id, rating, comment, submitted_at FROM feedbacks"
+
+
+class TimedCursor:
+    """Cursor wrapper that records how many queries ran and how long they took."""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+        self.timings_ms = []
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def execute(self, sql, params=()):
+        started = time.perf_counter()
+        try:
+            return self._cursor.execute(sql, params)
+        finally:
+            self.timings_ms.append((time.perf_counter() - started) * 1000)
+
+    def summary(self):
+        return {"count": len(self.timings_ms), "ms": round(sum(self.timings_ms), 1)}
+
+
+def encode_cursor(created_at, row_id):
+    raw = f"{created_at.isoformat()}|{row_id}".encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(token):
+    """``(created_at, id)`` from a cursor token, or None if it is missing or malformed."""
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)).decode("utf-8")
+        created_at, row_id = raw.rsplit("|", 1)
+        return datetime.fromisoformat(created_at), int(row_id)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+def parse_date(value):
+    try:
+        return datetime.strptime(value, "%Y-%m-%d") if value else None
+    except ValueError:
+        return None
+
+
+def date_filters(column, date_from, date_to):
+    """Inclusive day range on ``column``: ``date_to`` covers the whole day."""
+    where, params = [], []
+    if date_from:
+        where.append(f"{column} >= %s")
+        params.append(date_from)
+    if date_to:
+        where.append(f"{column} < %s")
+        params.append(date_to + timedelta(days=1))
+    return where, params
+
+
+def keyset_page(cursor, select, where, params, time_col, id_col, time_key, after=None, before=None,
+                limit=ADMIN_PAGE_SIZE):
+    """One page, newest first, continuing after (or before) a cursor.
+
+    Returns ``{"rows", "next", "prev"}`` where ``next``/``prev`` are cursor
+    tokens for the neighbouring pages (None at either end).
+    """
+    where, params = list(where), list(params)
+    after, before = decode_cursor(after), decode_cursor(before)
+    backwards = before is not None and after is None
+    if after:
+        where.append(f"({time_col} < %s OR ({time_col} = %s AND {id_col} < %s))")
+        params += [after[0], after[0], after[1]]
+    elif backwards:
+        where.append(f"({time_col} > %s OR ({time_col} = %s AND {id_col} > %s))")
+        params += [before[0], before[0], before[1]]
+    direction = "ASC" if backwards else "DESC"
+    sql = (f"{select} WHERE {' AND '.join(where) or 'TRUE'} "
+           f"ORDER BY {time_col} {direction}, {id_col} {direction} LIMIT %s")
+    cursor.execute(sql, params + [limit + 1])
+    rows = cursor.fetchall()
+    more = len(rows) > limit
+    rows = rows[:limit]
+    if backwards:
+        rows.reverse()
+    has_next = True if backwards else more
+    has_prev = more if backwards else after is not None
+    return {
+        "rows": rows,
+        "next": encode_cursor(rows[-1][time_key], rows[-1]["id"]) if rows and has_next else None,
+        "prev": encode_cursor(rows[0][time_key], rows[0]["id"]) if rows and has_prev else None,
+    }
+
+
+def session_page(cursor, archived, user_type=None, student_id=None, date_from=None, date_to=None,
+                 after=None, before=None, limit=ADMIN_PAGE_SIZE):
+    where, params = ["cs.is_archived = %s"], [bool(archived)]
+    if user_type:
+        where.append("cs.user_type = %s")
+        params.append(user_type)
+    if student_id:
+        where.append("cs.student_id = %s")
+        params.append(student_id)
+    dates, date_params = date_filters("cs.created_at", date_from, date_to)
+    return keyset_page(cursor, SESSION_SELECT, where + dates, params + date_params,
+                       "cs.created_at", "cs.id", "created_at", after, before, limit)
+
+
+def feedback_page(cursor, rating=None, date_from=None, date_to=None, after=None, before=None,
+                  limit=ADMIN_PAGE_SIZE):
+    where, params = [], []
+    if rating:
+        where.append("rating = %s")
+        params.append(rating)
+    dates, date_params = date_filters("submitted_at", date_from, date_to)
+    return keyset_page(cursor, FEEDBACK_SELECT, where + dates, params + date_params,
+                       "submitted_at", "id", "submitted_at", after, before, limit)
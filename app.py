@@ -1,8 +1,27 @@
 import os
-from flask import Flask, request, jsonify, render_template, redirect, url_for, Response, session
+from flask import Flask, request, jsonify, render_template, redirect, url_for, Response, session, stream_with_context, g
 from flask_cors import CORS
-from chatbot import get_chatbot_response
-from db import get_db_connection
+from chatbot import get_chatbot_response, stream_chatbot_response, stream_stats
+from db import db_connection, pool as db_pool
+from memory_index import on_memory_added, on_memory_updated, on_memory_deleted
+from response_cache import response_cache
+from intent import ALLOWED_INTENTS, get_classifier
+from chat_pipeline import Stage, run_parallel, start, finish
+from chat_log import ChatLogWriter, make_sink
+from token_usage import RequestUsage, acreate_completion, create_completion, token_usage
+from metrics import REQUEST_SECONDS, metrics, time_stage
+from single_flight import intent_flights, reply_flights
+from resilience import openai_guard
+from fuzzy_match import fuzzy_matcher, key_text
+from conversations import conversation_store
+from qa_store import dataset_store, QA_PAGE_SIZE
+from feedback_stats import on_feedback_added, read_feedback_stats
+from admin_queries import TimedCursor, session_page, feedback_page, parse_date
+from session_store import (SESSION_MAX_APPEND, SESSION_PAGE_SIZE, SequenceConflict, append_messages,
+                           create_session, find_session, load_messages,
+                           delete_session as delete_owned_session)
+import exports
+import ingest
 import json
 import openai
 import re
@@ -10,9 +29,12 @@ import gspread
 from datetime import datetime
 from oauth2client.service_account import ServiceAccountCredentials
 from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.utils import secure_filename
 from dotenv import load_dotenv
 from utils.email_utils import send_signup_email
 import uuid
+import hmac
+import time
 
 load_dotenv()
 
@@ -22,6 +44,16 @@ CORS(app)
 app.secret_key = os.getenv("SECRET_KEY", "fallback_key_for_dev")
 openai.api_key = os.getenv("OPENAI_API_KEY")
 
+# Bearer token that lets a Prometheus scraper read /metrics without an admin session
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+
+# Per-stage deadlines for /chat (seconds)
+CHAT_REPLY_TIMEOUT = float(os.getenv("CHAT_REPLY_TIMEOUT", "60"))
+CHAT_INTENT_TIMEOUT = float(os.getenv("CHAT_INTENT_TIMEOUT", "5"))
+REPLY_TIMEOUT_MESSAGE = "Sorry, this is taking longer than expected. Please try again in a moment."
+# Appended to a logged /chat/stream reply that the client stopped reading
+PARTIAL_REPLY_MARK = " [partial: client disconnected]"
+
 # Use .env or fallback
 CREDENTIALS_PATH = os.getenv("GOOGLE_CREDENTIALS_PATH", "credentials.json")
 
@@ -37,10 +69,12 @@ def get_sheet():
     sheet = client.open("Chatbot_Logs").worksheet("Messages")  # adjust to match your sheet names
     return sheet
 
-# Log a row of chat data
+# Chat logs are queued and written in batches by a background thread
+chat_log_writer = ChatLogWriter(make_sink(get_sheet))
+
+# Log a row of chat data (non-blocking)
 def log_chat(user_id, user_msg, intent, fallback, latency_ms, bot_reply):
-    sheet = get_sheet()
-    sheet.append_row([
+    chat_log_writer.submit([
         datetime.utcnow().isoformat(),
         user_id,
         user_msg,
@@ -50,7 +84,49 @@ def log_chat(user_id, user_msg, intent, fallback, latency_ms, bot_reply):
         bot_reply
     ])
 
+# Below this confidence the local classifier defers to the LLM
+INTENT_CONFIDENCE_THRESHOLD = float(os.getenv("INTENT_CONFIDENCE_THRESHOLD", "0.5"))
+
+# Load (or train and save) the intent model now, not under a lock on the first /chat
+get_classifier()
+
 def detect_intent(message):
+    with time_stage("intent_detection"):
+        intent, confidence = get_classifier().predict(message)
+        if confidence >= INTENT_CONFIDENCE_THRESHOLD and intent in ALLOWED_INTENTS:
+            return intent
+        # Students at a registration peak send the same question within seconds: classify it once
+        try:
+            return intent_flights.do(key_text(message), detect_intent_llm, message)
+        except Exception as e:
+            return intent_unavailable(e)
+
+async def adetect_intent(message):
+    """``detect_intent`` for async_app; the local classifier is cheap enough for the event loop."""
+    with time_stage("intent_detection"):
+        intent, confidence = get_classifier().predict(message)
+        if confidence >= INTENT_CONFIDENCE_THRESHOLD and intent in ALLOWED_INTENTS:
+            return intent
+        try:
+            return await intent_flights.ado(key_text(message), adetect_intent_llm, message)
+        except Exception as e:
+            return intent_unavailable(e)
+
+# OpenAI failed (or its circuit is open): the chat goes on with an unknown intent
+def intent_unavailable(error):
+    app.logger.warning("Intent LLM failed (%s: %s); using 'unknown'", type(error).__name__, error)
+    openai_guard.degraded("intent")
+    return "unknown"
+
+def detect_intent_llm(message):
+    response = create_completion("intent", **intent_completion_args(message))
+    return parse_intent(response)
+
+async def adetect_intent_llm(message):
+    response = await acreate_completion("intent", **intent_completion_args(message))
+    return parse_intent(response)
+
+def intent_completion_args(message):
     prompt = (
     "You are an intent classifier for a university chatbot. Return only the intent label. "
     "Possible labels: admission_info, program_info, fees, hostel_info, contact, general_query, "
@@ -68,23 +144,39 @@ def detect_intent(message):
     "User: I want to speak to someone\nIntent: contact\n"
     f"User: {message}\nIntent:"
     )
+    return dict(model="gpt-3.5-turbo", messages=[{"role": "user", "content": prompt}], temperature=0)
 
+def parse_intent(response):
+    intent = response.choices[0].message['content'].strip().lower()
 
-    response = openai.ChatCompletion.create(
-        model="gpt-3.5-turbo",
-        messages=[{"role": "user", "content": prompt}],
-        temperature=0
-    )
+    return intent if intent in ALLOWED_INTENTS else "unknown"
 
-    intent = response.choices[0].message['content'].strip().lower()
 
-    allowed_intents = [
-        "admission_info", "program_info", "fees", "hostel_info", "contact",
-        "general_query", "application_deadline", "course_structure",
-        "location", "scholarship", "registration_help", "unknown"
-    ]
+# Random, so two guests arriving in the same second never share history or saved sessions
+def new_guest_id():
+    return f"guest_{uuid.uuid4().hex}"
 
-    return intent if intent in allowed_intents else "unknown"
+
+# Conversation key for the chatbot's per-user history (``sess`` defaults to Flask's session)
+def conversation_id(sess=None):
+    sess = session if sess is None else sess
+    if sess.get("student_id"):
+        return f"student:{sess['student_id']}"
+    if sess.get("guest_id"):
+        return f"guest:{sess['guest_id']}"
+    if 'conversation_id' not in sess:
+        sess['conversation_id'] = uuid.uuid4().hex
+    return f"anon:{sess['conversation_id']}"
+
+
+# Segment the caller's token usage is accounted under
+def user_type(sess=None):
+    sess = session if sess is None else sess
+    if sess.get("guest"):
+        return "guest"
+    if sess.get("student_id"):
+        return "student"
+    return "anonymous"
 
 
 @app.route('/')
@@ -99,12 +191,11 @@ def admin_login():
         email = request.form['email']
         password = request.form['password']
 
-        conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True)
-        cursor.execute("SELECT * FROM admins WHERE email = %s", (email,))
-        admin = cursor.fetchone()
-        cursor.close()
-        conn.close()
+        with db_connection() as conn:
+            cursor = conn.cursor(dictionary=True)
+            cursor.execute("SELECT * FROM admins WHERE email = %s", (email,))
+            admin = cursor.fetchone()
+            cursor.close()
 
         if admin and check_password_hash(admin['password_hash'], password):
             session['admin_id'] = admin['id']
@@ -122,6 +213,30 @@ def admin_logout():
     return redirect(url_for('admin_login'))
 
 
+# ✅ Request timing per route (registered first so redirects by the checks below are timed too)
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def record_request_time(response):
+    started = g.pop("request_started", None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        REQUEST_SECONDS.observe(time.perf_counter() - started, route, request.method, str(response.status_code))
+    return response
+
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """All workers' metrics in Prometheus text format; admin session or ``Authorization: Bearer $METRICS_TOKEN``."""
+    bearer = request.headers.get("Authorization", "")
+    if 'admin_id' not in session and not (METRICS_TOKEN and hmac.compare_digest(bearer, f"Bearer {METRICS_TOKEN}")):
+        return Response("Unauthorized\n", status=401, mimetype="text/plain")
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
 @app.before_request
 def restrict_admin_routes():
     admin_only = request.path.startswith('/admin') and not request.path.startswith('/admin/login')
@@ -131,7 +246,7 @@ def restrict_admin_routes():
 
 @app.route('/admin/dashboard')
 def admin_dashboard():
-    dataset_path = 'data/rmu_openai_chatbot_dataset.jsonl'
+    dataset_path = dataset_store.path
     sample_count = 0
     last_updated = "N/A"
     avg_rating = 0
@@ -139,41 +254,41 @@ def admin_dashboard():
 
 
     try:
-        with open(dataset_path, 'r') as f:
-            sample_count = sum(1 for _ in f)
-        last_modified = os.path.getmtime(dataset_path)
+        sample_count = len(dataset_store)
+        last_modified = max(os.path.getmtime(p) for p in (dataset_path, dataset_store.journal_path)
+                            if os.path.exists(p))
         last_updated = datetime.fromtimestamp(last_modified).strftime('%d %B %Y, %I:%M %p')
 
-    except FileNotFoundError:
+    except (FileNotFoundError, ValueError):
         pass
 
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('SELECT COUNT(*), AVG(rating) FROM feedbacks')
-    result = cursor.fetchone()
-    if result:
-        feedback_count = result[0]
-        avg_rating = round(result[1], 2) if result[1] else 0
-    conn.close()
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        feedback_count, avg_rating = read_feedback_stats(cursor)
+        usage = token_usage.summary(cursor, hours=min(max(request.args.get('hours', 24, type=int), 1), 168))
+        conn.commit()
 
     return render_template('admin/dashboard.html', 
                            sample_count=sample_count, 
                            last_updated=last_updated,
                            avg_rating=avg_rating,
-                           feedback_count=feedback_count)
+                           feedback_count=feedback_count,
+                           cache_stats=response_cache.stats(),
+                           db_stats=db_pool.stats(),
+                           stream_stats=stream_stats.summary(),
+                           flight_stats={"reply": reply_flights.stats(), "intent": intent_flights.stats()},
+                           openai_stats=openai_guard.stats(),
+                           fuzzy_stats=fuzzy_matcher.stats(),
+                           chat_log_stats=chat_log_writer.stats(),
+                           usage=usage)
 
 @app.route('/admin/view-qa')
 def view_qa():
-    qas = []
-    with open('data/rmu_openai_chatbot_dataset.jsonl', 'r') as file:
-        for line in file:
-            try:
-                item = json.loads(line.strip())
-                if 'messages' in item:
-                    qas.append(item)
-            except json.JSONDecodeError:
-                continue
-    return render_template('admin/view_qa.html', qas=qas)
+    page = max(request.args.get('page', 1, type=int), 1)
+    query = request.args.get('q', '').strip()
+    qas, total = dataset_store.page(page, QA_PAGE_SIZE, query or None)
+    pages = max((total + QA_PAGE_SIZE - 1) // QA_PAGE_SIZE, 1)
+    return render_template('admin/view_qa.html', qas=qas, page=page, pages=pages, total=total, query=query)
 
 
 @app.route('/admin/add-qa', methods=['GET', 'POST'])
@@ -182,16 +297,11 @@ def add_qa():
         user_msg = request.form['user']
         bot_msg = request.form['bot']
 
-        new_entry = {
-            "messages": [
+        try:
+            dataset_store.add([
                 {"role": "user", "content": user_msg},
                 {"role": "assistant", "content": bot_msg}
-            ]
-        }
-
-        try:
-            with open('data/rmu_openai_chatbot_dataset.jsonl', 'a') as file:
-                file.write(json.dumps(new_entry) + '\n')
+            ])
         except Exception as e:
             return f"Error: {e}"
 
@@ -201,53 +311,41 @@ def add_qa():
 
 @app.route('/admin/edit-qa/<int:qa_id>', methods=['GET', 'POST'])
 def edit_qa(qa_id):
-    dataset_path = 'data/rmu_openai_chatbot_dataset.jsonl'
-
-    # Read all existing lines
-    with open(dataset_path, 'r') as file:
-        lines = [json.loads(line.strip()) for line in file if line.strip()]
+    try:
+        current = dataset_store.get(qa_id)
+    except KeyError:
+        return "❌ Conversation not found.", 404
 
     if request.method == 'POST':
         user_msg = request.form['user']
         bot_msg = request.form['bot']
 
         # Replace the selected conversation
-        lines[qa_id] = {
-            "messages": [
+        try:
+            dataset_store.update(qa_id, [
                 {"role": "user", "content": user_msg},
                 {"role": "assistant", "content": bot_msg}
-            ]
-        }
+            ])
+        except KeyError:
+            return "❌ Conversation not found.", 404
 
-        # Overwrite the file
-        with open(dataset_path, 'w') as file:
-            for item in lines:
-                file.write(json.dumps(item) + '\n')
-
-        return redirect(url_for('view_qa'))
+        return redirect(url_for('view_qa', page=request.args.get('page', 1), q=request.args.get('q', '')))
 
     # Pre-fill the form with selected entry
-    current = lines[qa_id]["messages"]
-    return render_template('admin/edit_qa.html', qa_id=qa_id, user=current[0]["content"], bot=current[1]["content"])
+    user = next((m.get("content", "") for m in current if m.get("role") == "user"), "")
+    bot = next((m.get("content", "") for m in current if m.get("role") == "assistant"), "")
+    return render_template('admin/edit_qa.html', qa_id=qa_id, user=user, bot=bot)
 
 @app.route('/admin/delete-qa/<int:qa_id>')
 def delete_qa(qa_id):
-    dataset_path = 'data/rmu_openai_chatbot_dataset.jsonl'
-
     try:
-        with open(dataset_path, 'r') as file:
-            lines = [json.loads(line.strip()) for line in file if line.strip()]
-
-        if 0 <= qa_id < len(lines):
-            del lines[qa_id]
-
-            with open(dataset_path, 'w') as file:
-                for item in lines:
-                    file.write(json.dumps(item) + '\n')
+        dataset_store.delete(qa_id)
+    except KeyError:
+        pass   # already gone
     except Exception as e:
         return f"Error deleting conversation: {e}"
 
-    return redirect(url_for('view_qa'))
+    return redirect(url_for('view_qa', page=request.args.get('page', 1), q=request.args.get('q', '')))
 
 
 @app.route("/chat", methods=["POST"])
@@ -265,17 +363,26 @@ def chat():
     #         return jsonify({"response": "🚫 Guest limit reached. Please sign up to continue using the chatbot."})
 
     start_time = datetime.utcnow()
+    user_id = session.get("student_id", "guest")
 
-    bot_reply = get_chatbot_response(user_message)
-
-    latency_ms = (datetime.utcnow() - start_time).total_seconds() * 1000
-
-    intent = detect_intent(user_message)
+    # Reply and intent are independent round trips, so run them side by side
+    usage = RequestUsage(user_type())
+    with usage.active():
+        results, timings = run_parallel(
+            Stage("reply", get_chatbot_response, user_message, conversation_id(),
+                  timeout=CHAT_REPLY_TIMEOUT, fallback=REPLY_TIMEOUT_MESSAGE),
+            Stage("intent", detect_intent, user_message,
+                  timeout=CHAT_INTENT_TIMEOUT, fallback="unknown"),
+        )
+    bot_reply = results["reply"]
+    intent = results["intent"]
     fallback = (intent == "unknown")
+    usage.finish(intent)
 
-    user_id = session.get("student_id", "guest")
+    latency_ms = (datetime.utcnow() - start_time).total_seconds() * 1000
+    app.logger.debug("chat stages %s, total %.0f ms", timings, latency_ms)
 
-    # ✅ Log to Google Sheet
+    # ✅ Queue the log row; the background writer batches it to the sheet
     log_chat(
         user_id=user_id,
         user_msg=user_message,
@@ -286,122 +393,167 @@ def chat():
     )
 
     return jsonify({"response": bot_reply})
+@app.route("/chat/stream", methods=["POST"])
+def chat_stream():
+    """Same input as /chat, answered as Server-Sent Events.
+
+    Each ``message`` event carries ``{"delta": ...}``; a final ``done`` event
+    carries the full ``{"response": ...}``. Logging happens after the stream ends,
+    also when the client goes away mid-reply (the logged reply is then marked partial).
+    """
+    data = request.get_json()
+    user_message = data.get("message", "")
+
+    if not user_message:
+        return jsonify({"error": "No message provided"}), 400
+
+    start_time = datetime.utcnow()
+    user_id = session.get("student_id", "guest")
+    conv_id = conversation_id()
+    usage = RequestUsage(user_type())
+    with usage.active():
+        intent_stage = start(Stage("intent", detect_intent, user_message,
+                                   timeout=CHAT_INTENT_TIMEOUT, fallback="unknown"))
+
+    def events():
+        parts = []
+        complete = False
+        try:
+            with usage.active():
+                for delta in stream_chatbot_response(user_message, conv_id):
+                    parts.append(delta)
+                    yield f"data: {json.dumps({'delta': delta})}\n\n"
+            yield f"event: done\ndata: {json.dumps({'response': ''.join(parts)})}\n\n"
+            complete = True
+        finally:
+            # Runs on GeneratorExit too: the tokens were spent and the question was asked
+            bot_reply = "".join(parts)
+            intent, _ = finish(intent_stage)
+            usage.finish(intent)
+            log_chat(
+                user_id=user_id,
+                user_msg=user_message,
+                intent=intent,
+                fallback=(intent == "unknown"),
+                latency_ms=(datetime.utcnow() - start_time).total_seconds() * 1000,
+                bot_reply=bot_reply if complete else bot_reply + PARTIAL_REPLY_MARK
+            )
+
+    return Response(stream_with_context(events()), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
 @app.route("/reset", methods=["POST"])
 def reset_chat():
-    from chatbot import chat_history
     # if session.get("guest") and session.get("guest_queries", 0) >= 5:
     #    return jsonify({"message": "🚫 Guest limit reached. You cannot start a new chat."}), 403
 
-
-    chat_history.clear()
-    # Re-add system instruction after reset
-    chat_history.append({
-        "role": "system",
-        "content": "You are RMU’s official chatbot. Provide accurate, context-aware responses about the university."
-    })
+    # Only this user's conversation; the system prompt is added per request
+    conversation_store.reset(conversation_id())
     return jsonify({"message": "Chat history cleared."})
 
 
-@app.route("/save-session", methods=["POST"])
-def save_session():
-    from chatbot import chat_history
-    data = request.get_json()
-    messages = data.get("messages")
+# Who owns the caller's saved sessions: (student_id, guest_id), at most one set
+def session_owner(create_guest=False, sess=None):
+    sess = session if sess is None else sess
+    if sess.get("guest", False):
+        # Generate or reuse guest ID
+        if 'guest_id' not in sess and create_guest:
+            sess['guest_id'] = new_guest_id()
+        return None, sess.get('guest_id')
+    return sess.get("student_id"), None
 
-    # Detect if guest or student
-    is_guest = session.get("guest", False)
-    student_id = session.get("student_id") if not is_guest else None
-
-    # Generate or reuse guest ID
-    guest_id = None
-    if is_guest:
-        if 'guest_id' not in session:
-            session['guest_id'] = f"guest_{int(datetime.utcnow().timestamp())}"
-        guest_id = session['guest_id']
-
-    # 🔍 Generate session name based on last used chat number
-    conn = get_db_connection()
-    cursor = conn.cursor(dictionary=True)
-
-    if is_guest:
-        cursor.execute("""
-            SELECT session_name FROM chat_sessions
-            WHERE guest_id = %s AND session_name LIKE 'Chat %%'
-            ORDER BY created_at DESC LIMIT 1
-        """, (guest_id,))
-    else:
-        cursor.execute("""
-            SELECT session_name FROM chat_sessions
-            WHERE student_id = %s AND session_name LIKE 'Chat %%'
-            ORDER BY created_at DESC LIMIT 1
-        """, (student_id,))
 
-    result = cursor.fetchone()
-    if result and result["session_name"].startswith("Chat "):
+# Incremental save: {session_id?, base_seq, messages} where messages are only the ones
+# added since base_seq, the last sequence number this client got back from the server.
+@app.route("/save-session", methods=["POST"])
+def save_session():
+    body, status = save_session_messages(request.get_json(), *session_owner(create_guest=True))
+    return jsonify(body), status
+
+# The JSON bodies of /save-session, /sessions and /load-session, shared with async_app
+def save_session_messages(data, student_id, guest_id):
+    data = data or {}
+    messages = data.get("messages") or []
+    session_id = data.get("session_id")
+    base_seq = data.get("base_seq") or 0
+
+    if not student_id and not guest_id:
+        return {"message": "Log in to save chats."}, 401
+    if not isinstance(messages, list) or len(messages) > SESSION_MAX_APPEND:
+        return {"message": f"Send at most {SESSION_MAX_APPEND} new messages per save."}, 400
+
+    with db_connection() as conn:
+        cursor = conn.cursor()
         try:
-            last_number = int(result["session_name"].split(" ")[1])
-            session_name = f"Chat {last_number + 1}"
-        except (IndexError, ValueError):
-            session_name = "Chat 1"
-    else:
-        session_name = "Chat 1"
-
-    # ✅ Insert session
-    try:
-        cursor.execute(
-            """
-            INSERT INTO chat_sessions (session_name, messages, student_id, user_type, guest_id, created_at)
-            VALUES (%s, %s, %s, %s, %s, NOW())
-            """,
-            (
-                session_name,
-                json.dumps(messages),
-                student_id,
-                'guest' if is_guest else 'student',
-                guest_id
-            )
-        )
-        conn.commit()
-    except Exception as e:
-        conn.rollback()
-        print(f"❌ Session save error: {e}")
-        return jsonify({"message": "Failed to save session."}), 500
-    finally:
-        conn.close()
+            if session_id:
+                found = find_session(cursor, session_id, student_id, guest_id)
+                if found is None:
+                    return {"message": "Session not found."}, 404
+                session_name = found[0]
+            else:
+                # ✅ New session, named from the owner's counter
+                session_id, session_name = create_session(
+                    cursor, student_id, guest_id, 'guest' if guest_id else 'student')
+                base_seq = 0
+            seq = append_messages(cursor, session_id, base_seq, messages)
+            conn.commit()
+        except SequenceConflict as conflict:
+            conn.rollback()
+            return {"message": "Session changed elsewhere; resend from seq.",
+                    "session_id": session_id, "seq": conflict.current_seq}, 409
+        except Exception as e:
+            conn.rollback()
+            print(f"❌ Session save error: {e}")
+            return {"message": "Failed to save session."}, 500
 
-    return jsonify({"message": f"{session_name} saved successfully."})
+    return {"message": f"{session_name} saved successfully.", "session_id": session_id,
+            "session_name": session_name, "seq": seq}, 200
 
 @app.route("/sessions", methods=["GET"])
 def list_sessions():
-    conn = get_db_connection()
-    cursor = conn.cursor(dictionary=True)
+    return jsonify(saved_sessions(session))
 
-    is_guest = session.get("guest", False)
-    student_id = session.get("student_id") if not is_guest else None
-    guest_id = session.get("guest_id") if is_guest else None
+def saved_sessions(sess):
+    is_guest = sess.get("guest", False)
+    student_id = sess.get("student_id") if not is_guest else None
+    guest_id = sess.get("guest_id") if is_guest else None
 
-    if is_guest:
-        cursor.execute("SELECT id, session_name, created_at FROM chat_sessions WHERE guest_id = %s ORDER BY created_at DESC", (guest_id,))
-    else:
-        cursor.execute("SELECT id, session_name, created_at FROM chat_sessions WHERE student_id = %s ORDER BY created_at DESC", (student_id,))
+    with db_connection() as conn:
+        cursor = conn.cursor(dictionary=True)
+        if is_guest:
+            cursor.execute("SELECT id, session_name, created_at FROM chat_sessions WHERE guest_id = %s ORDER BY created_at DESC", (guest_id,))
+        else:
+            cursor.execute("SELECT id, session_name, created_at FROM chat_sessions WHERE student_id = %s ORDER BY created_at DESC", (student_id,))
 
-    sessions = cursor.fetchall()
-    cursor.close()
-    conn.close()
-    return jsonify(sessions)
+        sessions = cursor.fetchall()
+        cursor.close()
+    return sessions
 
+# Newest page first; ?before=<seq> pages further back for long chats
 @app.route("/load-session/<int:session_id>", methods=["GET"])
 def load_session(session_id):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT messages FROM chat_sessions WHERE id = %s", (session_id,))
-    result = cursor.fetchone()
-    conn.close()
+    body, status = session_messages(session_id, *session_owner(),
+                                    before=request.args.get('before', type=int),
+                                    limit=request.args.get('limit', SESSION_PAGE_SIZE, type=int))
+    return jsonify(body), status
+
+def session_messages(session_id, student_id, guest_id, before=None, limit=SESSION_PAGE_SIZE):
+    if not student_id and not guest_id:
+        return {"error": "Session not found"}, 404
+    limit = max(1, min(limit, SESSION_MAX_APPEND))
+
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        found = find_session(cursor, session_id, student_id, guest_id)
+        if found is None:
+            return {"error": "Session not found"}, 404
+        messages, has_more = load_messages(cursor, session_id, before, limit)
+        conn.commit()
+        cursor.close()
 
-    if result:
-        return jsonify(json.loads(result[0]))
-    else:
-        return jsonify({"error": "Session not found"}), 404
+    return {"session_id": session_id, "session_name": found[0], "seq": found[1],
+            "messages": messages, "has_more": has_more}, 200
 
 @app.route('/submit-feedback', methods=['POST'])
 def submit_feedback():
@@ -409,128 +561,115 @@ def submit_feedback():
     rating = data.get('rating')
     comment = data.get('comment')
 
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        "INSERT INTO feedbacks (rating, comment) VALUES (%s, %s)",
-        (rating, comment)
-    )
-    conn.commit()
-    cursor.close()
-    conn.close()
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "INSERT INTO feedbacks (rating, comment) VALUES (%s, %s)",
+            (rating, comment)
+        )
+        on_feedback_added(cursor, rating)
+        conn.commit()
+        cursor.close()
 
     return {'message': 'Feedback submitted successfully!'}, 200
 
 @app.route("/delete-session/<int:session_id>", methods=["POST"])
 def delete_session(session_id):
-    is_guest = session.get("guest", False)
-    student_id = session.get("student_id") if not is_guest else None
-    guest_id = session.get("guest_id") if is_guest else None
+    student_id, guest_id = session_owner()
+    if not student_id and not guest_id:
+        return jsonify({"message": "Session not found."}), 404
 
-    conn = get_db_connection()
-    cursor = conn.cursor()
-
-    if is_guest:
-        cursor.execute("DELETE FROM chat_sessions WHERE id = %s AND guest_id = %s", (session_id, guest_id))
-    else:
-        cursor.execute("DELETE FROM chat_sessions WHERE id = %s AND student_id = %s", (session_id, student_id))
-
-    conn.commit()
-    conn.close()
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        delete_owned_session(cursor, session_id, student_id, guest_id)
+        conn.commit()
 
     return jsonify({"message": "Chat deleted ✅"})
 
 
 @app.route('/admin/view-feedbacks')
 def view_feedbacks():
-    conn = get_db_connection()
-    cursor = conn.cursor(dictionary=True)
-    cursor.execute('SELECT * FROM feedbacks ORDER BY submitted_at DESC')
-    feedbacks = cursor.fetchall()
-    cursor.close()
-    conn.close()
-    
-    return render_template('admin/view_feedbacks.html', feedbacks=feedbacks)
+    filters = listing_filters()
+    with db_connection() as conn:
+        cursor = TimedCursor(conn.cursor(dictionary=True))
+        page = feedback_page(cursor, rating=request.args.get('rating', type=int),
+                             date_from=filters['date_from'], date_to=filters['date_to'],
+                             after=request.args.get('after'), before=request.args.get('before'))
+        cursor.close()
+
+    return render_template('admin/view_feedbacks.html', feedbacks=page['rows'], page=page,
+                           filters=request.args, queries=cursor.summary())
 
 
 @app.route('/admin/download-feedbacks')
 def download_feedbacks():
-    conn = get_db_connection()
-    cursor = conn.cursor(dictionary=True)
-    cursor.execute('SELECT * FROM feedbacks ORDER BY submitted_at DESC')
-    feedbacks = cursor.fetchall()
-    cursor.close()
-    conn.close()
-
-    # Convert datetime objects to strings
-    for item in feedbacks:
-        if isinstance(item['submitted_at'], (datetime, )):
-            item['submitted_at'] = item['submitted_at'].strftime('%Y-%m-%d %H:%M:%S')
-
+    return export_table('feedbacks')
+
+
+# Streamed export: /admin/export/<table>?format=ndjson|csv|json&date_from=&date_to=
+@app.route('/admin/export/<table>')
+def export_table(table):
+    if table not in exports.TABLES:
+        return "❌ Unknown table.", 404
+    fmt = request.args.get('format', 'json')
+    if fmt not in exports.FORMATS:
+        return "⚠️ Format must be one of: " + ", ".join(exports.FORMATS), 400
+
+    filters = {
+        'rating': request.args.get('rating', type=int),
+        'user_type': request.args.get('user_type') or None,
+        'student_id': request.args.get('student_id', type=int),
+    }
+    if request.args.get('archived') in ('0', '1'):
+        filters['is_archived'] = request.args.get('archived') == '1'
+
+    mimetype, extension = exports.FORMATS[fmt]
     today = datetime.now().strftime("%Y-%m-%d")
-    filename = f"feedbacks_{today}.json"
-
-    response = Response(
-        json.dumps(feedbacks, indent=2),
-        mimetype='application/json'
-    )
-    response.headers['Content-Disposition'] = f'attachment; filename={filename}'
+    body = exports.export(table, fmt, parse_date(request.args.get('date_from')),
+                          parse_date(request.args.get('date_to')), filters)
+    response = Response(stream_with_context(body), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename={table}_{today}.{extension}'
     return response
 
+# Filters shared by the paginated admin listings (?date_from=&date_to=&user_type=&student_id=)
+def listing_filters():
+    return {
+        'date_from': parse_date(request.args.get('date_from')),
+        'date_to': parse_date(request.args.get('date_to')),
+        'user_type': request.args.get('user_type') if request.args.get('user_type') in ('student', 'guest') else None,
+        'student_id': request.args.get('student_id', type=int),
+    }
+
+
+def session_listing(archived):
+    with db_connection() as conn:
+        cursor = TimedCursor(conn.cursor(dictionary=True))
+        page = session_page(cursor, archived, after=request.args.get('after'),
+                            before=request.args.get('before'), **listing_filters())
+        cursor.close()
+    return page, cursor.summary()
+
+
 @app.route('/admin/view-chat-history')
 def view_chat_history():
-    conn = get_db_connection()
-    cursor = conn.cursor(dictionary=True)
-    cursor.execute("""
-        SELECT cs.id,
-            CASE
-                WHEN cs.user_type = 'guest' THEN CONCAT('Guest_', cs.guest_id, ', ', cs.session_name)
-                ELSE CONCAT(s.full_name, ', ', cs.session_name)
-            END AS session_name,
-            cs.created_at
-        FROM chat_sessions cs
-        LEFT JOIN students s ON cs.student_id = s.id
-        WHERE cs.is_archived = FALSE
-        ORDER BY cs.created_at DESC
-    """)
-
-    sessions = cursor.fetchall()
-    cursor.close()
-    conn.close()
-    
-    return render_template('admin/view_chat_history.html', sessions=sessions)
+    page, queries = session_listing(archived=False)
+    return render_template('admin/view_chat_history.html', sessions=page['rows'], page=page,
+                           filters=request.args, queries=queries)
 
 
 @app.route('/admin/archive-session/<int:session_id>', methods=['POST'])
 def archive_session(session_id):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("UPDATE chat_sessions SET is_archived = TRUE WHERE id = %s", (session_id,))
-    conn.commit()
-    conn.close()
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("UPDATE chat_sessions SET is_archived = TRUE WHERE id = %s", (session_id,))
+        conn.commit()
     return redirect(url_for('view_chat_history'))
 
 @app.route('/admin/archived-sessions')
 def view_archived_sessions():
-    conn = get_db_connection()
-    cursor = conn.cursor(dictionary=True)
-    cursor.execute("""
-        SELECT cs.id,
-               CASE
-                   WHEN cs.user_type = 'guest' THEN CONCAT('Guest_', cs.guest_id, ', ', cs.session_name)
-                   ELSE CONCAT(s.full_name, ', ', cs.session_name)
-               END AS session_name,
-               cs.created_at
-        FROM chat_sessions cs
-        LEFT JOIN students s ON cs.student_id = s.id
-        WHERE cs.is_archived = TRUE
-        ORDER BY cs.created_at DESC
-    """)
-    sessions = cursor.fetchall()
-    cursor.close()
-    conn.close()
-
-    return render_template('admin/view_archived_sessions.html', sessions=sessions)
+    page, queries = session_listing(archived=True)
+    return render_template('admin/view_archived_sessions.html', sessions=page['rows'], page=page,
+                           filters=request.args, queries=queries)
 
 @app.route('/admin/uploaded-files')
 def view_uploaded_files():
@@ -552,30 +691,28 @@ def view_uploaded_files():
 
 @app.route('/admin/restore-session/<int:session_id>', methods=['POST'])
 def restore_session(session_id):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("UPDATE chat_sessions SET is_archived = FALSE WHERE id = %s", (session_id,))
-    conn.commit()
-    conn.close()
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("UPDATE chat_sessions SET is_archived = FALSE WHERE id = %s", (session_id,))
+        conn.commit()
     return redirect(url_for('view_archived_sessions'))
 
 @app.route('/admin/load-session/<int:session_id>')
 def admin_load_session(session_id):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('SELECT messages FROM chat_sessions WHERE id = %s', (session_id,))
-    result = cursor.fetchone()
-    cursor.close()
-    conn.close()
-
-    if result:
-        return jsonify(json.loads(result[0]))
-    else:
-        return jsonify({"error": "Session not found"}), 404
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        found = find_session(cursor, session_id)
+        if found is None:
+            return jsonify({"error": "Session not found"}), 404
+        messages, _ = load_messages(cursor, session_id, limit=max(found[1], 1))
+        conn.commit()
+        cursor.close()
+
+    return jsonify([{"role": m["role"], "content": m["content"]} for m in messages])
 
 @app.route('/admin/upload-dataset', methods=['GET', 'POST'])
 def upload_dataset():
-    upload_dir = 'uploads'
+    upload_dir = ingest.UPLOAD_DIR
     files = []
 
     # Always load current uploaded files
@@ -587,7 +724,8 @@ def upload_dataset():
                 files.append({
                     "filename": fname,
                     "size_kb": os.path.getsize(full_path) // 1024,
-                    "uploaded_at": uploaded_at
+                    "uploaded_at": uploaded_at,
+                    "report": ingest.read_report(full_path)
                 })
 
     # Upload logic
@@ -599,10 +737,13 @@ def upload_dataset():
         if file.filename == '':
             return "⚠️ No selected file", 400
 
-        if file and (file.filename.endswith('.jsonl') or file.filename.endswith('.json')):
-            upload_path = os.path.join(upload_dir, file.filename)
+        filename = secure_filename(file.filename)
+        if file and (filename.endswith('.jsonl') or filename.endswith('.json')):
+            upload_path = os.path.join(upload_dir, filename)
             os.makedirs(upload_dir, exist_ok=True)
             file.save(upload_path)
+            # ✅ Validate, dedupe and merge into the dataset in the background
+            ingest.start_ingest(upload_path)
             return redirect(url_for('upload_dataset'))  # Refresh with new list
 
         return "⚠️ Invalid file type. Only .jsonl or .json allowed.", 400
@@ -627,9 +768,43 @@ def view_uploaded_file(filename):
 
     return render_template('admin/view_file_preview.html', filename=filename, lines=lines)
 
+def uploaded_path(filename):
+    path = os.path.join(ingest.UPLOAD_DIR, secure_filename(filename))
+    return path if os.path.exists(path) else None
+
+
+# Re-run the ingest for a file that is already uploaded
+@app.route('/admin/ingest/<filename>', methods=['POST'])
+def ingest_upload(filename):
+    path = uploaded_path(filename)
+    if not path:
+        return f"❌ File {filename} not found.", 404
+    ingest.start_ingest(path)
+    return redirect(url_for('upload_dataset'))
+
+
+@app.route('/admin/ingest-status/<filename>')
+def ingest_status(filename):
+    path = uploaded_path(filename)
+    report = ingest.read_report(path) if path else None
+    if not report:
+        return jsonify({"error": "No ingest report for this file"}), 404
+    return jsonify(report)
+
+
+@app.route('/admin/ingest-report/<filename>')
+def ingest_report(filename):
+    path = uploaded_path(filename)
+    report = ingest.read_report(path) if path else None
+    if not report:
+        return f"❌ No ingest report for {filename}.", 404
+    return render_template('admin/ingest_report.html', filename=filename, report=report,
+                           threshold=ingest.INGEST_NEAR_DUP_THRESHOLD)
+
+
 @app.route('/admin/upload-success')
 def upload_dataset_success():
-    return "✅ Upload successful! (You can process this file later if needed.)"
+    return "✅ Upload successful! The file is being validated and merged into the dataset."
 
 @app.route('/signup', methods=['GET', 'POST'])
 def student_signup():
@@ -647,20 +822,19 @@ def student_signup():
 
         hashed_pw = generate_password_hash(password)
 
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        try:
-            cursor.execute(
-                "INSERT INTO students (full_name, email, password_hash) VALUES (%s, %s, %s)",
-                (full_name, email, hashed_pw)
-            )
-            conn.commit()
-        except Exception as e:
-            conn.rollback()
-            return f"❌ Error: {e}"
-        finally:
-            cursor.close()
-            conn.close()
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute(
+                    "INSERT INTO students (full_name, email, password_hash) VALUES (%s, %s, %s)",
+                    (full_name, email, hashed_pw)
+                )
+                conn.commit()
+            except Exception as e:
+                conn.rollback()
+                return f"❌ Error: {e}"
+            finally:
+                cursor.close()
 
         # ✅ Send email
         try:
@@ -678,12 +852,11 @@ def student_login():
         email = request.form['email']
         password = request.form['password']
 
-        conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True)
-        cursor.execute("SELECT * FROM students WHERE email = %s", (email,))
-        student = cursor.fetchone()
-        cursor.close()
-        conn.close()
+        with db_connection() as conn:
+            cursor = conn.cursor(dictionary=True)
+            cursor.execute("SELECT * FROM students WHERE email = %s", (email,))
+            student = cursor.fetchone()
+            cursor.close()
 
         if student and check_password_hash(student['password_hash'], password):
             session['student_id'] = student['id']
@@ -724,57 +897,57 @@ def guest_login():
 
     # 🔒 Generate and persist guest ID for this browser session
     if 'guest_id' not in session:
-        session['guest_id'] = f"guest_{int(datetime.utcnow().timestamp())}"
+        session['guest_id'] = new_guest_id()
 
     return redirect(url_for('chat_interface'))
 
 @app.route('/admin/view-memory')
 def view_memory():
-    conn = get_db_connection()
-    cursor = conn.cursor(dictionary=True)
-    cursor.execute("""
-        SELECT id, corrected_question, corrected_answer, created_at
-        FROM memory_corrections
-        ORDER BY created_at DESC
-    """)
-    corrections = cursor.fetchall()
-    cursor.close()
-    conn.close()
+    with db_connection() as conn:
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute("""
+            SELECT id, corrected_question, corrected_answer, created_at
+            FROM memory_corrections
+            ORDER BY created_at DESC
+        """)
+        corrections = cursor.fetchall()
+        cursor.close()
     
     # Format date as DD-MM-YYYY HH:MM
     for c in corrections:
         c['created_at'] = c['created_at'].strftime('%d-%m-%Y %H:%M:%S')
 
-    return render_template("admin/view_memory.html", corrections=corrections)
+    return render_template("admin/view_memory.html", corrections=corrections, filters=request.args)
 
 @app.route('/admin/edit-memory/<int:id>', methods=['GET', 'POST'])
 def edit_memory(id):
-    conn = get_db_connection()
-    cursor = conn.cursor(dictionary=True)
+    with db_connection() as conn:
+        cursor = conn.cursor(dictionary=True)
 
-    if request.method == 'POST':
-        question = request.form['question']
-        answer = request.form['answer']
-        cursor.execute(
-            "UPDATE memory_corrections SET corrected_question = %s, corrected_answer = %s WHERE id = %s",
-            (question, answer, id)
-        )
-        conn.commit()
-        conn.close()
-        return redirect(url_for('view_memory'))
+        if request.method == 'POST':
+            question = request.form['question']
+            answer = request.form['answer']
+            cursor.execute(
+                "UPDATE memory_corrections SET corrected_question = %s, corrected_answer = %s WHERE id = %s",
+                (question, answer, id)
+            )
+            apply_memory = on_memory_updated(cursor, id, question, answer)
+            conn.commit()
+            apply_memory()
+            return redirect(url_for('view_memory'))
 
-    cursor.execute("SELECT * FROM memory_corrections WHERE id = %s", (id,))
-    memory = cursor.fetchone()
-    conn.close()
+        cursor.execute("SELECT * FROM memory_corrections WHERE id = %s", (id,))
+        memory = cursor.fetchone()
     return render_template('admin/edit_memory.html', memory=memory)
 
 @app.route('/admin/delete-memory/<int:id>')
 def delete_memory(id):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("DELETE FROM memory_corrections WHERE id = %s", (id,))
-    conn.commit()
-    conn.close()
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM memory_corrections WHERE id = %s", (id,))
+        apply_memory = on_memory_deleted(cursor, id)
+        conn.commit()
+    apply_memory()
     return redirect(url_for('view_memory'))
 
 @app.route('/admin/add-memory', methods=['GET', 'POST'])
@@ -783,14 +956,15 @@ def add_memory():
         question = request.form['question']
         answer = request.form['answer']
 
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute(
-            "INSERT INTO memory_corrections (corrected_question, corrected_answer) VALUES (%s, %s)",
-            (question, answer)
-        )
-        conn.commit()
-        conn.close()
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "INSERT INTO memory_corrections (corrected_question, corrected_answer) VALUES (%s, %s)",
+                (question, answer)
+            )
+            apply_memory = on_memory_added(cursor, cursor.lastrowid, question, answer)
+            conn.commit()
+        apply_memory()
 
         return redirect(url_for('view_memory'))
 
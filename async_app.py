@@ -0,0 +1,207 @@
+"""Asyncio serving mode for /chat, /save-session, /sessions and /load-session.
+
+Same URLs, JSON bodies and session cookie as app.py, served by an aiohttp
+event loop instead of a thread per request: a /chat waiting on OpenAI is a
+suspended coroutine, so one process holds thousands of slow model calls.
+
+- Model calls go through ``openai.ChatCompletion.acreate`` on one shared
+  HTTP connection pool (``ASYNC_OPENAI_CONNECTIONS``).
+- Database work takes milliseconds and runs on ``ASYNC_DB_THREADS`` threads
+  (the MySQL pool size by default) with the existing pool and queries, so
+  it never blocks the loop.
+- Chat logs go to app.py's ChatLogWriter queue, which never blocks.
+
+Everything else stays on the Flask app. Route the four paths here at the
+proxy, e.g. with nginx:
+
+    location ~ ^/(chat|save-session|sessions|load-session/\\d+)$ { proxy_pass http://127.0.0.1:8081; }
+    location / { proxy_pass http://127.0.0.1:8000; }   # gunicorn app:app
+
+and run ``python async_app.py`` (ASYNC_HOST / ASYNC_PORT), or
+``gunicorn async_app:web_app --worker-class aiohttp.GunicornWebWorker``.
+"""
+import asyncio
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import aiohttp
+import openai
+from aiohttp import web
+from flask.sessions import SecureCookieSession
+from itsdangerous import BadSignature
+
+from app import (CHAT_INTENT_TIMEOUT, CHAT_REPLY_TIMEOUT, REPLY_TIMEOUT_MESSAGE, adetect_intent, app,
+                 conversation_id, log_chat, save_session_messages, saved_sessions, session_messages,
+                 session_owner, user_type)
+from chat_pipeline import Stage, arun_parallel
+from chatbot import aget_chatbot_response
+from db import DB_POOL_SIZE
+from metrics import REQUEST_SECONDS
+from session_store import SESSION_PAGE_SIZE
+from token_usage import RequestUsage
+
+logger = logging.getLogger(__name__)
+
+ASYNC_HOST = os.getenv("ASYNC_HOST", "127.0.0.1")
+ASYNC_PORT = int(os.getenv("ASYNC_PORT", "8081"))
+ASYNC_DB_THREADS = int(os.getenv("ASYNC_DB_THREADS", str(DB_POOL_SIZE)))
+ASYNC_OPENAI_CONNECTIONS = int(os.getenv("ASYNC_OPENAI_CONNECTIONS", "1000"))
+
+db_executor = ThreadPoolExecutor(max_workers=ASYNC_DB_THREADS, thread_name_prefix="async-db")
+
+
+async def run_db(fn, *args, **kwargs):
+    return await asyncio.get_running_loop().run_in_executor(db_executor, lambda: fn(*args, **kwargs))
+
+
+# ✅ Flask's signed session cookie, read and written here too
+_serializer = app.session_interface.get_signing_serializer(app)
+
+
+def load_session_cookie(request):
+    value = request.cookies.get(app.config["SESSION_COOKIE_NAME"])
+    if value:
+        try:
+            max_age = int(app.permanent_session_lifetime.total_seconds())
+            return SecureCookieSession(_serializer.loads(value, max_age=max_age))
+        except BadSignature:
+            pass
+    return SecureCookieSession()
+
+
+def save_session_cookie(response, sess):
+    if not sess.modified:
+        return
+    response.set_cookie(
+        app.config["SESSION_COOKIE_NAME"], _serializer.dumps(dict(sess)),
+        max_age=int(app.permanent_session_lifetime.total_seconds()) if sess.permanent else None,
+        domain=app.config["SESSION_COOKIE_DOMAIN"] or None,
+        path=app.config["SESSION_COOKIE_PATH"] or app.config["APPLICATION_ROOT"] or "/",
+        secure=app.config["SESSION_COOKIE_SECURE"],
+        httponly=app.config["SESSION_COOKIE_HTTPONLY"],
+        samesite=app.config["SESSION_COOKIE_SAMESITE"])
+
+
+def json_response(body, status=200):
+    # Flask's encoder, so dates and key order match app.py's responses
+    return web.json_response(body, status=status, dumps=app.json.dumps)
+
+
+async def read_json(request):
+    try:
+        return await request.json()
+    except ValueError:
+        raise web.HTTPBadRequest(text="Invalid JSON body")
+
+
+def int_arg(request, name, default=None):
+    try:
+        return int(request.query[name])
+    except (KeyError, ValueError):
+        return default
+
+
+# ✅ Routes
+routes = web.RouteTableDef()
+
+
+@routes.post("/chat")
+async def chat(request):
+    sess = request["session"]
+    data = await read_json(request)
+    user_message = (data or {}).get("message", "")
+
+    if not user_message:
+        return json_response({"error": "No message provided"}, 400)
+
+    start_time = datetime.utcnow()
+    user_id = sess.get("student_id", "guest")
+
+    usage = RequestUsage(user_type(sess))
+    with usage.active():
+        results, timings = await arun_parallel(
+            Stage("reply", aget_chatbot_response, user_message, conversation_id(sess), db_executor,
+                  timeout=CHAT_REPLY_TIMEOUT, fallback=REPLY_TIMEOUT_MESSAGE),
+            Stage("intent", adetect_intent, user_message,
+                  timeout=CHAT_INTENT_TIMEOUT, fallback="unknown"),
+        )
+    bot_reply = results["reply"]
+    intent = results["intent"]
+    usage.finish(intent)
+
+    latency_ms = (datetime.utcnow() - start_time).total_seconds() * 1000
+    logger.debug("chat stages %s, total %.0f ms", timings, latency_ms)
+    log_chat(user_id=user_id, user_msg=user_message, intent=intent, fallback=(intent == "unknown"),
+             latency_ms=latency_ms, bot_reply=bot_reply)
+
+    return json_response({"response": bot_reply})
+
+
+@routes.post("/save-session")
+async def save_session(request):
+    sess = request["session"]
+    data = await read_json(request)
+    body, status = await run_db(save_session_messages, data, *session_owner(create_guest=True, sess=sess))
+    return json_response(body, status)
+
+
+@routes.get("/sessions")
+async def list_sessions(request):
+    return json_response(await run_db(saved_sessions, request["session"]))
+
+
+@routes.get(r"/load-session/{session_id:\d+}")
+async def load_session(request):
+    body, status = await run_db(session_messages, int(request.match_info["session_id"]),
+                                *session_owner(sess=request["session"]),
+                                before=int_arg(request, "before"),
+                                limit=int_arg(request, "limit", SESSION_PAGE_SIZE))
+    return json_response(body, status)
+
+
+# Same route labels as the Flask app, so both modes share one series per endpoint
+FLASK_RULES = {"/load-session/{session_id}": "/load-session/<int:session_id>"}
+
+
+@web.middleware
+async def request_context(request, handler):
+    started = time.perf_counter()
+    request["session"] = load_session_cookie(request)
+    openai.aiosession.set(request.app["openai_session"])
+    status = 500
+    try:
+        response = await handler(request)
+        status = response.status
+        save_session_cookie(response, request["session"])
+        return response
+    except web.HTTPException as e:
+        status = e.status
+        raise
+    finally:
+        route = request.match_info.route.resource
+        rule = route.canonical if route is not None else "unmatched"
+        REQUEST_SECONDS.observe(time.perf_counter() - started, FLASK_RULES.get(rule, rule),
+                                request.method, str(status))
+
+
+async def open_openai_session(web_app):
+    web_app["openai_session"] = aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=ASYNC_OPENAI_CONNECTIONS))
+    yield
+    await web_app["openai_session"].close()
+
+
+def create_app():
+    web_app = web.Application(middlewares=[request_context])
+    web_app.add_routes(routes)
+    web_app.cleanup_ctx.append(open_openai_session)
+    return web_app
+
+
+web_app = create_app()
+
+if __name__ == "__main__":
+    web.run_app(web_app, host=ASYNC_HOST, port=ASYNC_PORT)
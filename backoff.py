@@ -0,0 +1,8 @@
+"""Jittered exponential backoff, shared by the fine-tune poller and the OpenAI retry guard."""
+import random
+
+
+def backoff(attempt, base, cap, rng=random):
+    """Seconds to wait before try ``attempt`` (0-based): half fixed, half random."""
+    delay = min(cap, base * 2 ** attempt)
+    return delay / 2 + rng.uniform(0, delay / 2)
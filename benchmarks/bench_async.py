@@ -0,0 +1,212 @@
+"""Load comparison of /chat on the sync Flask app and on async_app.
+
+Each mode runs in its own server process against the local stand-ins
+(fakes.py) with a slow OpenAI, and receives bursts of concurrent /chat
+requests with questions that all reach the model. The sync server models
+``gunicorn -k gthread --threads N``: one process, N request threads, the
+rest of the connections queued. The async server is async_app as deployed.
+
+Run from the repo root:
+
+    python -m benchmarks.bench_async                                   # JSON on stdout
+    python -m benchmarks.bench_async --concurrency 100 1000 3000 --openai-latency-ms 2000
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer
+
+from benchmarks import fakes
+from benchmarks.bench_hot_paths import (DATASET_PATH, NOVEL_QUESTIONS, REPO_ROOT, SOURCE_DATASET, git_revision,
+                                        synthetic_dataset)
+
+CONCURRENCY = [100, 1000]
+MODES = ["sync", "async"]
+
+
+# ✅ Servers (run in a child process: --serve MODE)
+class _QuietHandler(WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+class PooledWSGIServer(WSGIServer):
+    """Accepts every connection and hands it to a fixed pool of request threads, like gthread."""
+    request_queue_size = 2048
+
+    def __init__(self, address, threads):
+        super().__init__(address, _QuietHandler)
+        self._pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="request")
+
+    def process_request(self, request, client_address):
+        self._pool.submit(self._handle, request, client_address)
+
+    def _handle(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+
+def serve(mode, port, threads, openai_latency):
+    completion, database, worksheet = fakes.install(openai_latency=openai_latency)
+    import app as app_module
+    from chat_log import SheetsSink
+    app_module.chat_log_writer.sink = SheetsSink(lambda: worksheet)
+
+    if mode == "sync":
+        server = PooledWSGIServer(("127.0.0.1", port), threads)
+        server.set_app(app_module.app)
+        server.serve_forever()
+    else:
+        from aiohttp import web
+        import async_app
+        web.run_app(async_app.web_app, host="127.0.0.1", port=port, print=None, access_log=None, backlog=2048)
+
+
+# ✅ Load generator
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_for_port(port, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"server on port {port} did not start")
+
+
+async def burst(port, concurrency, label):
+    """``concurrency`` simultaneous /chat requests; per-request latency in ms, plus failures."""
+    import aiohttp
+
+    url = f"http://127.0.0.1:{port}/chat"
+    timeout = aiohttp.ClientTimeout(total=900)
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0), timeout=timeout) as session:
+        async def one(i):
+            question = f"{NOVEL_QUESTIONS[i % len(NOVEL_QUESTIONS)]} ({label}-{i})"
+            started = time.perf_counter()
+            try:
+                async with session.post(url, json={"message": question}) as response:
+                    body = await response.json()
+                    ok = response.status == 200 and "response" in body
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+                ok = False
+            return (time.perf_counter() - started) * 1000, ok
+
+        return await asyncio.gather(*(one(i) for i in range(concurrency)))
+
+
+def summarize(samples, wall_s):
+    latencies = sorted(ms for ms, ok in samples if ok)
+
+    def pct(p):
+        return round(latencies[min(len(latencies) - 1, int(len(latencies) * p))], 1) if latencies else None
+    return {
+        "requests": len(samples),
+        "failed": sum(1 for _, ok in samples if not ok),
+        "wall_s": round(wall_s, 2),
+        "throughput_rps": round(len(latencies) / wall_s, 1) if wall_s else None,
+        "p50_ms": pct(0.5),
+        "p95_ms": pct(0.95),
+        "max_ms": pct(1.0),
+    }
+
+
+def run_mode(mode, args, workdir):
+    port = free_port()
+    command = [sys.executable, "-m", "benchmarks.bench_async", "--serve", mode, "--port", str(port),
+               "--threads", str(args.threads), "--openai-latency-ms", str(args.openai_latency_ms)]
+    env = dict(os.environ, PYTHONPATH=REPO_ROOT + os.pathsep + os.environ.get("PYTHONPATH", ""))
+    server = subprocess.Popen(command, cwd=workdir, env=env)
+    rows = []
+    try:
+        wait_for_port(port)
+        asyncio.run(burst(port, 4, "warmup"))
+        for concurrency in args.concurrency:
+            started = time.perf_counter()
+            samples = asyncio.run(burst(port, concurrency, f"{mode}-{concurrency}"))
+            row = {"mode": mode, "concurrency": concurrency, **summarize(samples, time.perf_counter() - started)}
+            rows.append(row)
+            print(f"{mode:<6} concurrency {concurrency:>5}  {row['throughput_rps']:>8} req/s  "
+                  f"p50 {row['p50_ms']:>9} ms  p95 {row['p95_ms']:>9} ms  failed {row['failed']}", file=sys.stderr)
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+    return rows
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Compare /chat under load: sync Flask vs async_app")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=CONCURRENCY,
+                        help="simultaneous requests per burst")
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=MODES)
+    parser.add_argument("--threads", type=int, default=32, help="request threads of the sync server")
+    parser.add_argument("--openai-latency-ms", type=float, default=1000.0)
+    parser.add_argument("--dataset-lines", type=int, default=2000)
+    parser.add_argument("--output", "-o", default="-", help="JSON results file (default: stdout)")
+    parser.add_argument("--serve", choices=MODES, help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.serve:
+        serve(args.serve, args.port, args.threads, args.openai_latency_ms / 1000)
+        return 0
+
+    from intent import bootstrap_labels, write_labels
+
+    workdir = tempfile.mkdtemp(prefix="rmu-bench-async-")
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        os.makedirs("data", exist_ok=True)
+        write_labels(bootstrap_labels([SOURCE_DATASET]))
+        synthetic_dataset(DATASET_PATH, args.dataset_lines)
+        results = [row for mode in args.modes for row in run_mode(mode, args, workdir)]
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "meta": {
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "openai_latency_ms": args.openai_latency_ms,
+            "sync_threads": args.threads,
+            "dataset_lines": args.dataset_lines,
+        },
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output == "-":
+        print(text)
+    else:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,177 @@
+"""Fault drill: get_chatbot_response against a fake OpenAI that fails on purpose.
+
+Scenarios, each with fresh breaker and latency state:
+
+- healthy:  no faults (the baseline)
+- flaky:    a share of calls fail with rate limits, 5xx, timeouts and resets
+- slow_tail: a few calls are many times slower, with and without hedging
+- outage:   every call fails for a while, then OpenAI recovers
+
+For each, the share of model answers vs local (degraded) answers, reply
+latency percentiles and the guard's counters (retries, hedges, fast
+failures, breaker openings) are reported.
+
+Run from the repo root:
+
+    python -m benchmarks.bench_faults                    # JSON on stdout
+    python -m benchmarks.bench_faults --requests 500 --error-rate 0.3
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks import fakes
+from benchmarks.bench_hot_paths import DATASET_PATH, NOVEL_QUESTIONS, SOURCE_DATASET, git_revision, synthetic_dataset
+
+
+class Drill:
+    def __init__(self, args):
+        self.args = args
+        self.completion, self.database, self.worksheet = fakes.install(openai_latency=args.openai_latency_ms / 1000)
+        import chatbot
+        import resilience
+        self.chatbot = chatbot
+        self.resilience = resilience
+        self.guard = resilience.openai_guard
+        self.asked = 0
+
+    def reset(self, hedge=False):
+        """Fresh breaker, latency window and counters; no faults."""
+        resilience = self.resilience
+        self.guard.breaker = resilience.CircuitBreaker(failures=self.args.breaker_failures,
+                                                       cooldown=self.args.breaker_cooldown)
+        self.guard.latency = resilience.LatencyWindow()
+        self.guard.hedge = hedge
+        self.guard.counts = dict.fromkeys(self.guard.counts, 0)
+        completion = self.completion
+        completion.error_rate, completion.slow_rate, completion.down = 0.0, 0.0, False
+        completion.calls = completion.failures = 0
+
+    def ask(self, count):
+        """``count`` novel questions over ``--concurrency`` threads; ``[(ms, outcome)]``."""
+        def one(i):
+            question = f"{NOVEL_QUESTIONS[i % len(NOVEL_QUESTIONS)]} (drill {i})"
+            started = time.perf_counter()
+            reply = self.chatbot.get_chatbot_response(question, f"drill:{i}")
+            if reply.startswith(self.chatbot.DEGRADED_PREFIX) or reply == self.chatbot.DEGRADED_MESSAGE:
+                outcome = "degraded"
+            elif reply.startswith("Sorry"):
+                outcome = "error"
+            else:
+                outcome = "model"
+            return (time.perf_counter() - started) * 1000, outcome
+
+        first = self.asked
+        self.asked += count
+        with ThreadPoolExecutor(max_workers=self.args.concurrency) as pool:
+            return list(pool.map(one, range(first, first + count)))
+
+    def record(self, name, samples, **params):
+        latencies = sorted(ms for ms, _ in samples)
+
+        def pct(p):
+            return round(latencies[min(len(latencies) - 1, int(len(latencies) * p))], 1)
+        stats = self.guard.stats()
+        row = {
+            "scenario": name, **params,
+            "requests": len(samples),
+            "model_answers": sum(1 for _, o in samples if o == "model"),
+            "degraded_answers": sum(1 for _, o in samples if o == "degraded"),
+            "error_answers": sum(1 for _, o in samples if o == "error"),
+            "p50_ms": pct(0.5), "p95_ms": pct(0.95), "p99_ms": pct(0.99),
+            "upstream_calls": self.completion.calls, "upstream_failures": self.completion.failures,
+            **{k: stats[k] for k in ("retries", "hedges", "hedges_won", "rejected", "opened", "state")},
+        }
+        print(f"{name:<10} {json.dumps(params):<28} model {row['model_answers']:>4}  degraded "
+              f"{row['degraded_answers']:>4}  p95 {row['p95_ms']:>8} ms  p99 {row['p99_ms']:>8} ms  "
+              f"retries {row['retries']:>3}  hedges {row['hedges']:>3}  rejected {row['rejected']:>3}",
+              file=sys.stderr)
+        return row
+
+    def run(self):
+        args = self.args
+        results = []
+
+        self.reset()
+        results.append(self.record("healthy", self.ask(args.requests)))
+
+        self.reset()
+        self.completion.error_rate = args.error_rate
+        results.append(self.record("flaky", self.ask(args.requests), error_rate=args.error_rate))
+
+        for hedge in (False, True):
+            self.reset(hedge=hedge)
+            self.ask(self.resilience.OPENAI_HEDGE_MIN_SAMPLES)   # latency history for the p95
+            self.completion.slow_rate = args.slow_rate
+            self.completion.slow_latency = args.openai_latency_ms * args.slow_factor / 1000
+            results.append(self.record("slow_tail", self.ask(args.requests), slow_rate=args.slow_rate, hedge=hedge))
+
+        # Outage, then recovery: the breaker should open, fail fast, and close again after a probe
+        self.reset()
+        self.completion.down = True
+        down = self.ask(args.requests)
+        self.completion.down = False
+        time.sleep(args.breaker_cooldown)
+        recovered = self.ask(args.requests // 4)
+        results.append(self.record("outage", down + recovered, recovered_model_answers=sum(
+            1 for _, o in recovered if o == "model")))
+        return results
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Drill the OpenAI resilience layer with injected faults")
+    parser.add_argument("--requests", type=int, default=200, help="questions per scenario")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--openai-latency-ms", type=float, default=50.0)
+    parser.add_argument("--error-rate", type=float, default=0.2, help="failing calls in the flaky scenario")
+    parser.add_argument("--slow-rate", type=float, default=0.05, help="slow calls in the slow_tail scenario")
+    parser.add_argument("--slow-factor", type=float, default=20.0, help="how much slower a slow call is")
+    parser.add_argument("--breaker-failures", type=int, default=5)
+    parser.add_argument("--breaker-cooldown", type=float, default=1.0)
+    parser.add_argument("--output", "-o", default="-", help="JSON results file (default: stdout)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    from intent import bootstrap_labels, write_labels
+
+    workdir = tempfile.mkdtemp(prefix="rmu-bench-faults-")
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        os.makedirs("data", exist_ok=True)
+        write_labels(bootstrap_labels([SOURCE_DATASET]))
+        synthetic_dataset(DATASET_PATH, 2000)
+        results = Drill(args).run()
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "meta": {
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            **{k: v for k, v in vars(args).items() if k != "output"},
+        },
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output == "-":
+        print(text)
+    else:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
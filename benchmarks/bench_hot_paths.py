@@ -0,0 +1,411 @@
+"""Request-path benchmarks against local stand-ins for OpenAI, MySQL and Sheets.
+
+Covers get_correction_from_memory, get_chatbot_response, detect_intent,
+log_chat and the JSONL admin pages at several dataset sizes, with the memory
+table pre-filled. Everything runs in a scratch directory with a synthetic
+dataset built from the real one, so data/ is never touched.
+
+Run from the repo root:
+
+    python -m benchmarks.bench_hot_paths                       # JSON on stdout
+    python -m benchmarks.bench_hot_paths -o bench.json --sizes 2000 20000
+    python -m benchmarks.bench_hot_paths --baseline bench.json # exit 1 on regressions
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks import fakes
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SOURCE_DATASET = os.path.join(REPO_ROOT, "data", "rmu_openai_chatbot_dataset.jsonl")
+DATASET_PATH = "data/rmu_openai_chatbot_dataset.jsonl"   # relative to the scratch directory
+
+SIZES = [2_000, 20_000, 200_000]
+MEMORY_CORRECTIONS = 100_000
+
+# Questions that reach the model (no dataset, fuzzy or memory hit)
+NOVEL_QUESTIONS = [
+    "Could you compare the marine engineering and port management tracks for a mature student?",
+    "I am moving from Kumasi next month, what should I pack for the first semester?",
+    "Which clubs would suit someone who likes sailing and robotics?",
+    "Is there a quiet place to study late at night near the library?",
+]
+INTENT_QUESTIONS = [
+    "How much is the tuition for nautical science?",
+    "Where is the school located?",
+    "Do you offer any scholarships?",
+    "Tell me about the Nautical Science program.",
+    "hmm ok",
+    "What time does the cafeteria open on weekends?",
+]
+
+
+# ✅ Synthetic data
+def synthetic_dataset(path, size, seed=0):
+    """Write ``size`` chat-format lines: real pairs, reworded with deterministic filler words."""
+    from retrieval import load_qa_pairs
+
+    rng = random.Random(seed)
+    pairs = load_qa_pairs(SOURCE_DATASET)
+    filler = ["campus", "semester", "student", "programme", "level", "option", "intake", "rmu", "year", "course"]
+    with open(path, "w", encoding="utf-8") as f:
+        for i in range(size):
+            question, answer = pairs[i % len(pairs)]
+            if i >= len(pairs):
+                question = f"{question} {' '.join(rng.sample(filler, 3))} {i}"
+            f.write(json.dumps({"messages": [
+                {"role": "user", "content": question},
+                {"role": "assistant", "content": answer},
+            ]}) + "\n")
+    return pairs
+
+
+def synthetic_corrections(count, seed=1):
+    rng = random.Random(seed)
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    rows = []
+    for i in range(count):
+        words = ["".join(rng.choices(letters, k=rng.randint(4, 9))) for _ in range(rng.randint(3, 7))]
+        rows.append((" ".join(words), f"Corrected answer {i}"))
+    return rows
+
+
+# ✅ Timing
+def measure(fn, repeat, budget, warmup=1):
+    """Call ``fn`` up to ``repeat`` times or until ``budget`` seconds pass (at least 3 runs)."""
+    for _ in range(warmup):
+        fn()
+    samples = []
+    deadline = time.perf_counter() + budget
+    while len(samples) < repeat and (len(samples) < 3 or time.perf_counter() < deadline):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1e6)
+    samples.sort()
+    return {
+        "runs": len(samples),
+        "mean_us": round(sum(samples) / len(samples), 2),
+        "p50_us": round(samples[len(samples) // 2], 2),
+        "p95_us": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 2),
+        "min_us": round(samples[0], 2),
+    }
+
+
+def timed_once(fn):
+    start = time.perf_counter()
+    fn()
+    us = (time.perf_counter() - start) * 1e6
+    return {"runs": 1, "mean_us": round(us, 2), "p50_us": round(us, 2), "p95_us": round(us, 2), "min_us": round(us, 2)}
+
+
+def _cycle(items):
+    state = {"i": 0}
+
+    def next_item():
+        state["i"] += 1
+        return items[state["i"] % len(items)]
+    return next_item
+
+
+# ✅ Benchmarks
+class Suite:
+    def __init__(self, args):
+        self.args = args
+        self.results = []
+        self.completion, self.database, self.worksheet = fakes.install(
+            openai_latency=args.openai_latency_ms / 1000,
+            db_latency=args.db_latency_ms / 1000,
+            sheets_latency=args.sheets_latency_ms / 1000,
+        )
+
+    def record(self, name, stats, **params):
+        row = {"name": name, **params, **stats}
+        self.results.append(row)
+        label = " ".join(f"{k}={v}" for k, v in params.items())
+        print(f"{name:<28} {label:<34} mean {stats['mean_us']:>12.1f} µs  p95 {stats['p95_us']:>12.1f} µs  "
+              f"({stats['runs']} runs)", file=sys.stderr)
+
+    def run(self):
+        from intent import bootstrap_labels, write_labels
+
+        # Same labels the real deployment would bootstrap, independent of the synthetic size
+        os.makedirs("data", exist_ok=True)
+        write_labels(bootstrap_labels([SOURCE_DATASET]))
+        self.pairs = synthetic_dataset(DATASET_PATH, self.args.sizes[0])
+
+        import app as app_module
+        from chat_log import SheetsSink
+        self.app = app_module
+        app_module.chat_log_writer.sink = SheetsSink(lambda: self.worksheet)
+
+        self.bench_memory()
+        self.bench_intent()
+        self.bench_log_chat()
+        self.bench_sessions()
+        for size in self.args.sizes:
+            self.bench_dataset(size)
+        return self.results
+
+    def bench_memory(self):
+        from chatbot import get_correction_from_memory
+
+        n = self.args.corrections
+        rows = synthetic_corrections(n)
+        self.database.seed_memory_corrections(rows)
+        self.record("memory_index_load", timed_once(lambda: get_correction_from_memory("warm up")), corrections=n)
+        hits = _cycle([f"please tell me {q} right now" for q, _ in rows[:: max(1, n // 100)]])
+        self.record("get_correction_from_memory", measure(
+            lambda: get_correction_from_memory(hits()), self.args.repeat, self.args.budget),
+            corrections=n, outcome="hit")
+        misses = _cycle(NOVEL_QUESTIONS)
+        self.record("get_correction_from_memory", measure(
+            lambda: get_correction_from_memory(misses()), self.args.repeat, self.args.budget),
+            corrections=n, outcome="miss")
+
+    def bench_intent(self):
+        from intent import get_classifier
+
+        self.record("intent_model_load", timed_once(get_classifier))
+        question = _cycle(INTENT_QUESTIONS)
+        calls_before = self.completion.calls
+        stats = measure(lambda: self.app.detect_intent(question()), self.args.repeat, self.args.budget)
+        stats["llm_fallback_ratio"] = round((self.completion.calls - calls_before) / (stats["runs"] + 1), 3)
+        self.record("detect_intent", stats)
+
+    def bench_log_chat(self):
+        writer = self.app.chat_log_writer
+        written_before = writer.written
+        stats = measure(lambda: self.app.log_chat("bench", "question", "fees", False, 12.5, "answer"),
+                        self.args.repeat, self.args.budget)
+        self.record("log_chat", stats, sheets_latency_ms=self.args.sheets_latency_ms)
+
+        # Background drain: close() returns once every queued row reached the (fake) sheet
+        stats = timed_once(writer.close)
+        stats.update(rows=writer.written - written_before, sheet_calls=self.worksheet.calls)
+        self.record("log_chat_drain", stats, sheets_latency_ms=self.args.sheets_latency_ms)
+
+    def bench_sessions(self):
+        client = self.app.app.test_client()
+        with client.session_transaction() as sess:
+            sess["student_id"] = 1
+        length = self.args.session_messages
+        history = [{"role": "user" if i % 2 == 0 else "assistant", "content": f"message {i}"} for i in range(length)]
+        state = {"id": None, "seq": 0}
+
+        def save(messages):
+            response = client.post("/save-session", json={
+                "session_id": state["id"], "base_seq": state["seq"], "messages": messages})
+            assert response.status_code == 200, response.status_code
+            body = response.get_json()
+            state.update(id=body["session_id"], seq=body["seq"])
+
+        for start in range(0, length, 500):
+            save(history[start:start + 500])
+        turn = [{"role": "user", "content": "one more question"}, {"role": "assistant", "content": "one more answer"}]
+        self.record("save_session_append", measure(lambda: save(turn), self.args.repeat, self.args.budget),
+                    session_messages=length)
+        self.record("load_session_page", measure(
+            lambda: client.get(f"/load-session/{state['id']}").get_json(), self.args.repeat, self.args.budget),
+            session_messages=length)
+
+    def bench_dataset(self, size):
+        from chatbot import get_chatbot_response
+        from retrieval import retrieval_engine
+        from fuzzy_match import fuzzy_matcher
+
+        synthetic_dataset(DATASET_PATH, size)
+
+        def reload():
+            retrieval_engine.refresh_if_changed()
+            fuzzy_matcher.match("warm up")
+        self.record("dataset_reload", timed_once(reload), dataset_lines=size)
+
+        conversation = _cycle([f"bench:{i}" for i in range(1000)])
+        known = _cycle([q for q, _ in self.pairs])
+        self.record("get_chatbot_response", measure(
+            lambda: get_chatbot_response(known(), conversation()), self.args.repeat, self.args.budget),
+            dataset_lines=size, path="dataset")
+
+        novel_count = {"n": 0}
+
+        def novel():
+            novel_count["n"] += 1
+            question = f"{NOVEL_QUESTIONS[novel_count['n'] % len(NOVEL_QUESTIONS)]} ({size}-{novel_count['n']})"
+            return get_chatbot_response(question, conversation())
+        self.record("get_chatbot_response", measure(novel, self.args.repeat, self.args.budget),
+                    dataset_lines=size, path="model", openai_latency_ms=self.args.openai_latency_ms)
+
+        cached = _cycle(NOVEL_QUESTIONS)
+        for q in NOVEL_QUESTIONS:
+            get_chatbot_response(q, "bench:prime")
+            self.app.conversation_store.reset("bench:prime")
+        self.record("get_chatbot_response", measure(
+            lambda: get_chatbot_response(cached(), f"bench:fresh:{time.perf_counter_ns()}"),
+            self.args.repeat, self.args.budget), dataset_lines=size, path="cache")
+
+        self.bench_admin(size)
+        self.bench_ingest(size)
+
+    def bench_admin(self, size):
+        client = self.app.app.test_client()
+        with client.session_transaction() as sess:
+            sess["admin_id"] = 1
+        # Whole-file pages are slow at scale; cap them by time rather than count
+        repeat, budget = self.args.repeat, self.args.budget
+
+        def ok(response):
+            assert response.status_code in (200, 302), response.status_code
+
+        self.record("admin_dashboard", measure(lambda: ok(client.get("/admin/dashboard")), repeat, budget),
+                    dataset_lines=size)
+        self.record("admin_view_qa", measure(lambda: ok(client.get("/admin/view-qa")), repeat, budget, warmup=0),
+                    dataset_lines=size)
+        row = _cycle(list(range(1, 11)))   # stable row ids start at 1
+        self.record("admin_edit_qa_get", measure(
+            lambda: ok(client.get(f"/admin/edit-qa/{row()}")), repeat, budget, warmup=0), dataset_lines=size)
+        self.record("admin_edit_qa_post", measure(
+            lambda: ok(client.post(f"/admin/edit-qa/{row()}", data={"user": "Edited question?", "bot": "Edited."})),
+            repeat, budget, warmup=0), dataset_lines=size)
+        self.record("admin_add_qa", measure(
+            lambda: ok(client.post("/admin/add-qa", data={"user": "New question?", "bot": "New answer."})),
+            repeat, budget, warmup=0), dataset_lines=size)
+        self.record("admin_delete_qa", measure(
+            lambda: ok(client.get(f"/admin/delete-qa/{size // 2}")), repeat, budget, warmup=0),
+            dataset_lines=size)
+
+
+    def bench_ingest(self, size):
+        import ingest
+        from fuzzy_match import fuzzy_matcher
+        from qa_store import dataset_store
+        from retrieval import retrieval_engine
+
+        # Upload: half new rows, a quarter already in the dataset, a quarter reworded by one character
+        rows = self.args.upload_rows
+        os.makedirs(ingest.UPLOAD_DIR, exist_ok=True)
+        path = os.path.join(ingest.UPLOAD_DIR, f"bench_{size}.jsonl")
+        with open(path, "w", encoding="utf-8") as f:
+            for i in range(rows):
+                question, answer = self.pairs[i % len(self.pairs)]
+                if i % 4 == 2:
+                    question = question + "!"
+                elif i % 4 != 3:
+                    question, answer = f"Uploaded question {size}-{i} about {question}", answer
+                f.write(json.dumps({"messages": [{"role": "user", "content": question},
+                                                 {"role": "assistant", "content": answer}]}) + "\n")
+        report = {}
+        stats = timed_once(lambda: report.update(ingest.ingest_file(path)))
+        stats.update(added=report["added"], **{f"{phase}_us": ms * 1000 for phase, ms in report["timings_ms"].items()})
+        self.record("ingest_upload", stats, dataset_lines=size, upload_rows=rows)
+
+        # An admin edit followed by the next lookup: both indexes update just that row
+        row = _cycle(list(range(1, 11)))
+
+        def edit_and_search():
+            dataset_store.update(row(), [{"role": "user", "content": f"Edited question {time.perf_counter_ns()}?"},
+                                         {"role": "assistant", "content": "Edited."}])
+            retrieval_engine.search("edited question")
+            fuzzy_matcher.match("edited question")
+        self.record("index_refresh_after_edit", measure(edit_and_search, self.args.repeat, self.args.budget, warmup=0),
+                    dataset_lines=size)
+
+
+# ✅ Output
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, capture_output=True,
+                              text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def result_key(row):
+    return json.dumps({k: v for k, v in row.items() if not k.endswith("_us") and k not in (
+        "runs", "rows", "sheet_calls", "llm_fallback_ratio", "added")}, sort_keys=True)
+
+
+def compare(results, baseline_path, tolerance):
+    """Rows whose mean grew by more than ``tolerance`` (0.2 = 20%) against the baseline file."""
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = {result_key(r): r for r in json.load(f)["results"]}
+    regressions = []
+    for row in results:
+        old = baseline.get(result_key(row))
+        if old and old["runs"] > 1 and row["mean_us"] > old["mean_us"] * (1 + tolerance):
+            regressions.append({"benchmark": json.loads(result_key(row)),
+                                "baseline_mean_us": old["mean_us"], "mean_us": row["mean_us"],
+                                "change": round(row["mean_us"] / old["mean_us"] - 1, 3)})
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the chatbot request path with local fakes")
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES, help="dataset sizes (Q&A lines)")
+    parser.add_argument("--corrections", type=int, default=MEMORY_CORRECTIONS, help="memory_corrections rows")
+    parser.add_argument("--upload-rows", type=int, default=10_000, help="rows in the ingest benchmark's upload")
+    parser.add_argument("--session-messages", type=int, default=5000, help="messages in the saved-session benchmark")
+    parser.add_argument("--repeat", type=int, default=200, help="max runs per benchmark")
+    parser.add_argument("--budget", type=float, default=2.0, help="time budget per benchmark (s)")
+    parser.add_argument("--openai-latency-ms", type=float, default=0.0)
+    parser.add_argument("--db-latency-ms", type=float, default=0.0)
+    parser.add_argument("--sheets-latency-ms", type=float, default=0.0)
+    parser.add_argument("--output", "-o", default="-", help="JSON results file (default: stdout)")
+    parser.add_argument("--baseline", help="earlier results file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown vs baseline (0.25 = 25%%)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if REPO_ROOT not in sys.path:
+        sys.path.insert(0, REPO_ROOT)
+    workdir = tempfile.mkdtemp(prefix="rmu-bench-")
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        results = Suite(args).run()
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "meta": {
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "sizes": args.sizes,
+            "corrections": args.corrections,
+            "openai_latency_ms": args.openai_latency_ms,
+            "db_latency_ms": args.db_latency_ms,
+            "sheets_latency_ms": args.sheets_latency_ms,
+        },
+        "results": results,
+    }
+    if args.baseline:
+        report["regressions"] = compare(results, args.baseline, args.tolerance)
+
+    text = json.dumps(report, indent=2)
+    if args.output == "-":
+        print(text)
+    else:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+
+    if report.get("regressions"):
+        for r in report["regressions"]:
+            print(f"REGRESSION {r['benchmark']}: {r['baseline_mean_us']} -> {r['mean_us']} µs", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,70 @@
+"""Lookup time of the memory-correction index as the table grows.
+
+Two cases per size: steady-state lookups, and the first lookup right after
+a new correction is added (what the next /chat sees while the automaton is
+rebuilt in the background), plus how long that rebuild takes.
+
+Run from the repo root:  python -m benchmarks.bench_memory_index
+"""
+import random
+import string
+import time
+
+from memory_index import MemoryIndex
+
+SIZES = [100, 1_000, 10_000, 100_000]
+QUERIES = [
+    "What are the school fees for nautical science?",
+    "Hello, where is the hostel located and how much does it cost per semester?",
+    "Can you tell me the admission requirements for the BSc Computer Science programme at RMU?",
+]
+
+
+def _random_question(rng):
+    words = ["".join(rng.choices(string.ascii_lowercase, k=rng.randint(3, 9))) for _ in range(rng.randint(3, 8))]
+    return " ".join(words)
+
+
+def run(repeat=2000):
+    rng = random.Random(42)
+    index = MemoryIndex()
+    rows = [{"id": 0, "corrected_question": "school fees", "corrected_answer": "Fees answer"}]   # at least one hit
+    results = []
+    for size in SIZES:
+        while len(rows) < size:
+            rows.append({"id": len(rows), "corrected_question": _random_question(rng), "corrected_answer": "answer"})
+        index.load(rows, None)   # what a worker does at startup
+        next_id = len(rows)
+
+        start = time.perf_counter()
+        for i in range(repeat):
+            index.best_match(QUERIES[i % len(QUERIES)])
+        per_lookup_us = (time.perf_counter() - start) / repeat * 1e6
+
+        # A correction arrives, and the very next lookup must already see it
+        start = time.perf_counter()
+        index.add(next_id, "hostel located", "Hostel answer")
+        answer = index.best_match(QUERIES[1])
+        after_insert_us = (time.perf_counter() - start) * 1e6
+        assert answer == "Hostel answer", answer
+        rebuild_ms = wait_built(index)
+
+        results.append({"rows": size, "lookup_us": round(per_lookup_us, 2),
+                        "add_then_lookup_us": round(after_insert_us, 2), "background_build_ms": round(rebuild_ms, 1)})
+        print(f"{size:>8} rows  {per_lookup_us:8.2f} µs/lookup  {after_insert_us:8.2f} µs add+lookup  "
+              f"(background build {rebuild_ms:8.1f} ms)")
+    return results
+
+
+def wait_built(index):
+    """Milliseconds until the background build has taken in every pending insert."""
+    start = time.perf_counter()
+    while True:
+        with index._lock:
+            if not index._pending and not index._building:
+                return (time.perf_counter() - start) * 1000
+        time.sleep(0.001)
+
+
+if __name__ == "__main__":
+    run()
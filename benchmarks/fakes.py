@@ -0,0 +1,403 @@
+"""Deterministic local stand-ins for OpenAI (chat and fine-tuning), Google Sheets and MySQL.
+
+Each fake sleeps for a configurable latency so benchmarks can model a slow
+upstream, or use 0 to measure only our own overhead. ``install()`` patches
+them into the already-imported modules; nothing here talks to the network.
+"""
+import asyncio
+import hashlib
+import random
+import re
+import sqlite3
+import sys
+import threading
+import time
+import types
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS memory_corrections (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, corrected_question TEXT, original_answer TEXT,
+    corrected_answer TEXT, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP);
+CREATE TABLE IF NOT EXISTS cache_versions (name TEXT PRIMARY KEY, version INTEGER NOT NULL DEFAULT 0);
+CREATE TABLE IF NOT EXISTS feedbacks (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, rating INTEGER, comment TEXT,
+    submitted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP);
+CREATE TABLE IF NOT EXISTS feedback_stats (
+    id INTEGER PRIMARY KEY, total INTEGER NOT NULL DEFAULT 0, rated INTEGER NOT NULL DEFAULT 0,
+    rating_sum INTEGER NOT NULL DEFAULT 0);
+INSERT OR IGNORE INTO feedback_stats (id) VALUES (1);
+CREATE TABLE IF NOT EXISTS students (id INTEGER PRIMARY KEY AUTOINCREMENT, full_name TEXT, email TEXT, password_hash TEXT);
+CREATE TABLE IF NOT EXISTS admins (id INTEGER PRIMARY KEY AUTOINCREMENT, full_name TEXT, email TEXT, password_hash TEXT);
+CREATE TABLE IF NOT EXISTS chat_sessions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, session_name TEXT, messages TEXT, student_id INTEGER,
+    user_type TEXT, guest_id TEXT, is_archived BOOLEAN DEFAULT 0, message_count INTEGER NOT NULL DEFAULT 0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP);
+CREATE TABLE IF NOT EXISTS chat_session_messages (
+    session_id INTEGER NOT NULL, seq INTEGER NOT NULL, role TEXT, content TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, PRIMARY KEY (session_id, seq));
+CREATE TABLE IF NOT EXISTS chat_session_counters (owner TEXT PRIMARY KEY, last_number INTEGER NOT NULL DEFAULT 0);
+CREATE TABLE IF NOT EXISTS token_usage_hourly (
+    hour TIMESTAMP NOT NULL, user_type TEXT NOT NULL, intent TEXT NOT NULL, purpose TEXT NOT NULL,
+    calls INTEGER NOT NULL DEFAULT 0, errors INTEGER NOT NULL DEFAULT 0, estimated_calls INTEGER NOT NULL DEFAULT 0,
+    prompt_tokens INTEGER NOT NULL DEFAULT 0, completion_tokens INTEGER NOT NULL DEFAULT 0,
+    estimated_prompt_tokens INTEGER NOT NULL DEFAULT 0, cost_micro_usd INTEGER NOT NULL DEFAULT 0,
+    latency_ms INTEGER NOT NULL DEFAULT 0, PRIMARY KEY (hour, user_type, intent, purpose));
+CREATE TABLE IF NOT EXISTS token_usage_buckets (
+    hour TIMESTAMP NOT NULL, user_type TEXT NOT NULL, intent TEXT NOT NULL, purpose TEXT NOT NULL,
+    metric TEXT NOT NULL, bucket INTEGER NOT NULL, count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (hour, user_type, intent, purpose, metric, bucket));
+"""
+
+
+class _Obj(dict):
+    """dict with attribute access, like the openai<1.0 response objects."""
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+
+# ✅ OpenAI
+class FakeChatCompletion:
+    """Stand-in for ``openai.ChatCompletion``; the answer is a hash of the prompt.
+
+    Fault injection, for exercising resilience.py: each call fails with
+    probability ``error_rate`` (an error of a kind from ``error_kinds``) and
+    takes ``slow_latency`` instead of ``latency`` with probability
+    ``slow_rate``; ``fail_next(n, kind)`` scripts the next failures and
+    ``down = True`` fails every call. Like the real client, a call slower
+    than its ``request_timeout`` raises ``openai.error.Timeout`` at the timeout.
+    """
+
+    ERROR_KINDS = ("rate_limit", "server_error", "unavailable", "timeout", "connection")
+
+    def __init__(self, latency=0.0, first_token_latency=None, tokens=20, intent="general_query",
+                 error_rate=0.0, error_kinds=ERROR_KINDS, slow_rate=0.0, slow_latency=0.0, seed=0):
+        self.latency = latency
+        self.first_token_latency = latency if first_token_latency is None else first_token_latency
+        self.tokens = tokens
+        self.intent = intent
+        self.error_rate = error_rate
+        self.error_kinds = error_kinds
+        self.slow_rate = slow_rate
+        self.slow_latency = slow_latency
+        self.down = False
+        self.calls = 0
+        self.failures = 0
+        self._scripted = []
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def fail_next(self, n=1, kind="unavailable"):
+        with self._lock:
+            self._scripted.extend([kind] * n)
+
+    def create(self, model=None, messages=None, stream=False, request_timeout=None, **kwargs):
+        content, usage = self._answer(model, messages)
+        error, latency = self._fault(request_timeout)
+        if stream:
+            if error:
+                time.sleep(latency)
+                raise error
+            return self._stream(content)
+        time.sleep(latency)
+        if error:
+            raise error
+        return self._response(model, content, usage)
+
+    async def acreate(self, model=None, messages=None, request_timeout=None, **kwargs):
+        """``openai.ChatCompletion.acreate``; waits without holding a thread (no streaming)."""
+        content, usage = self._answer(model, messages)
+        error, latency = self._fault(request_timeout)
+        await asyncio.sleep(latency)
+        if error:
+            raise error
+        return self._response(model, content, usage)
+
+    def _fault(self, request_timeout):
+        """``(error or None, seconds before answering or failing)`` for one call."""
+        with self._lock:
+            kind = self._scripted.pop(0) if self._scripted else None
+            if kind is None and (self.down or self._rng.random() < self.error_rate):
+                kind = self._rng.choice(self.error_kinds)
+            latency = self.slow_latency if self._rng.random() < self.slow_rate else self.latency
+            if kind is None and request_timeout is not None and latency > request_timeout:
+                kind, latency = "timeout", request_timeout
+            if kind is not None:
+                self.failures += 1
+        if kind is None:
+            return None, latency
+        # Errors come back fast, except timeouts
+        return fault_error(kind), latency if kind == "timeout" else min(latency, 0.01)
+
+    def _answer(self, model, messages):
+        with self._lock:
+            self.calls += 1
+        prompt = messages[-1]["content"] if messages else ""
+        if model == "gpt-3.5-turbo" and "Intent:" in prompt:
+            content = self.intent
+        else:
+            digest = hashlib.sha1(prompt.encode("utf-8")).hexdigest()
+            content = " ".join(digest[i:i + 4] for i in range(0, 4 * self.tokens, 4))
+        usage = _Obj(prompt_tokens=sum(len(m["content"]) // 4 for m in messages or []),
+                     completion_tokens=self.tokens)
+        usage["total_tokens"] = usage.prompt_tokens + usage.completion_tokens
+        return content, usage
+
+    def _response(self, model, content, usage):
+        message = _Obj(role="assistant", content=content)
+        return _Obj(choices=[_Obj(message=message, finish_reason="stop")], usage=usage, model=model)
+
+    def _stream(self, content):
+        time.sleep(self.first_token_latency)
+        per_token = max(self.latency - self.first_token_latency, 0) / max(self.tokens, 1)
+        for word in content.split(" "):
+            yield _Obj(choices=[_Obj(delta=_Obj(content=word + " "), finish_reason=None)])
+            time.sleep(per_token)
+        yield _Obj(choices=[_Obj(delta=_Obj(), finish_reason="stop")])
+
+
+def fault_error(kind):
+    """The ``openai.error`` exception the real client raises for a failure ``kind``."""
+    import openai
+
+    if kind == "rate_limit":
+        return openai.error.RateLimitError("Rate limit reached (fake)", http_status=429,
+                                           headers={"retry-after": "0.1"})
+    if kind == "server_error":
+        return openai.error.APIError("The server had an error (fake)", http_status=500)
+    if kind == "unavailable":
+        return openai.error.ServiceUnavailableError("The server is overloaded (fake)", http_status=503)
+    if kind == "timeout":
+        return openai.error.Timeout("Request timed out (fake)")
+    if kind == "connection":
+        return openai.error.APIConnectionError("Connection reset (fake)")
+    if kind == "bad_request":
+        return openai.error.InvalidRequestError("Invalid request (fake)", param=None, http_status=400)
+    raise ValueError(f"unknown fault kind {kind!r}")
+
+
+class FakeFineTuneAPI:
+    """Stand-in for ``fine_tune_jobs.OpenAIFineTuneAPI``.
+
+    Each retrieve moves a job one step along ``statuses``; jobs whose suffix
+    is in ``failing`` end as ``failed``. ``error_every`` makes every nth call
+    raise, to exercise the orchestrator's backoff.
+    """
+
+    def __init__(self, statuses=("validating_files", "queued", "running", "succeeded"), failing=(),
+                 error_every=0, latency=0.0):
+        self.statuses = statuses
+        self.failing = set(failing)
+        self.error_every = error_every
+        self.latency = latency
+        self.uploads = {}
+        self.jobs = {}
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def _call(self):
+        time.sleep(self.latency)
+        with self._lock:
+            self.calls += 1
+            if self.error_every and self.calls % self.error_every == 0:
+                raise ConnectionError("fake fine-tuning API is unavailable")
+
+    def upload(self, paths):
+        self._call()
+        with self._lock:
+            file_id = f"file-{len(self.uploads) + 1}"
+            self.uploads[file_id] = list(paths)
+        return file_id
+
+    def create(self, training_file, validation_file, model, suffix):
+        self._call()
+        with self._lock:
+            job_id = f"ftjob-{len(self.jobs) + 1}"
+            self.jobs[job_id] = {"training_file": training_file, "suffix": suffix, "step": 0, "cancelled": False}
+        return self._view(job_id)
+
+    def retrieve(self, job_id):
+        self._call()
+        with self._lock:
+            job = self.jobs[job_id]
+            job["step"] = min(job["step"] + 1, len(self.statuses) - 1)
+        return self._view(job_id)
+
+    def cancel(self, job_id):
+        self._call()
+        self.jobs[job_id]["cancelled"] = True
+        return self._view(job_id)
+
+    def find(self, training_file):
+        self._call()
+        for job_id, job in reversed(list(self.jobs.items())):
+            if job["training_file"] == training_file:
+                return self._view(job_id)
+        return None
+
+    def _view(self, job_id):
+        job = self.jobs[job_id]
+        status = "cancelled" if job["cancelled"] else self.statuses[job["step"]]
+        if status == "succeeded" and job["suffix"] in self.failing:
+            status = "failed"
+        return {
+            "id": job_id,
+            "status": status,
+            "fine_tuned_model": f"ft:gpt-3.5-turbo-0125:fake:{job['suffix']}:{job_id}" if status == "succeeded" else None,
+            "trained_tokens": 1000 if status == "succeeded" else None,
+            "error": "training failed" if status == "failed" else None,
+        }
+
+
+# ✅ Google Sheets
+class FakeWorksheet:
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.rows = []
+        self.calls = 0
+
+    def append_row(self, row, **kwargs):
+        self.append_rows([row])
+
+    def append_rows(self, rows, **kwargs):
+        time.sleep(self.latency)
+        self.calls += 1
+        self.rows.extend(rows)
+
+
+# ✅ MySQL (SQLite underneath, MySQL dialect translated on the fly)
+def _translate(sql):
+    sql = sql.replace("%%", "%").replace("%s", "?").replace("NOW()", "CURRENT_TIMESTAMP")
+    sql = sql.replace("ON DUPLICATE KEY UPDATE", "ON CONFLICT DO UPDATE SET")
+    sql = sql.replace("INSERT IGNORE", "INSERT OR IGNORE")
+    sql = re.sub(r"\bTRUE\b", "1", sql)
+    sql = re.sub(r"\bFALSE\b", "0", sql)
+    return sql
+
+
+class FakeCursor:
+    def __init__(self, db, dictionary=False, **kwargs):
+        self._db = db
+        self._cursor = db.conn.cursor()
+        self.dictionary = dictionary
+        self.lastrowid = None
+        self.rowcount = -1
+
+    def execute(self, sql, params=()):
+        time.sleep(self._db.latency)
+        with self._db.lock:
+            self._cursor.execute(_translate(sql), params)
+        self.lastrowid = self._cursor.lastrowid
+        self.rowcount = self._cursor.rowcount
+
+    def executemany(self, sql, rows):
+        time.sleep(self._db.latency)
+        with self._db.lock:
+            self._cursor.executemany(_translate(sql), rows)
+        self.rowcount = self._cursor.rowcount
+
+    def _row(self, row):
+        if row is None or not self.dictionary:
+            return row
+        return {d[0]: v for d, v in zip(self._cursor.description, row)}
+
+    def fetchone(self):
+        return self._row(self._cursor.fetchone())
+
+    def fetchall(self):
+        return [self._row(r) for r in self._cursor.fetchall()]
+
+    def fetchmany(self, size=1):
+        return [self._row(r) for r in self._cursor.fetchmany(size)]
+
+    def __iter__(self):
+        for row in self._cursor:
+            yield self._row(row)
+
+    def close(self):
+        self._cursor.close()
+
+
+class FakeConnection:
+    in_transaction = False
+    unread_result = False
+
+    def __init__(self, db):
+        self._db = db
+        self.conn = db.conn
+        self.lock = db.lock
+        self.latency = db.latency
+
+    def cursor(self, **kwargs):
+        return FakeCursor(self, **kwargs)
+
+    def commit(self):
+        with self.lock:
+            self.conn.commit()
+
+    def rollback(self):
+        with self.lock:
+            self.conn.rollback()
+
+    def is_connected(self):
+        return True
+
+    def close(self):
+        pass
+
+
+class FakeDatabase:
+    """One shared SQLite database; ``connect`` is a factory for ``db.ConnectionPool``."""
+
+    def __init__(self, path=":memory:", latency=0.0, connect_latency=0.0):
+        self.latency = latency
+        self.connect_latency = connect_latency
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, detect_types=sqlite3.PARSE_DECLTYPES)
+        self.conn.executescript(SCHEMA)
+        self.conn.create_function("CONCAT", -1, lambda *parts: None if None in parts else "".join(map(str, parts)))
+        self.connections = 0
+
+    def connect(self):
+        time.sleep(self.connect_latency)
+        self.connections += 1
+        return FakeConnection(self)
+
+    def seed_memory_corrections(self, rows):
+        with self.lock:
+            self.conn.executemany(
+                "INSERT INTO memory_corrections (corrected_question, corrected_answer) VALUES (?, ?)", rows)
+            self.conn.execute(
+                "INSERT INTO cache_versions (name, version) VALUES ('memory_corrections', 1) "
+                "ON CONFLICT(name) DO UPDATE SET version = version + 1")
+            self.conn.commit()
+
+
+def install(openai_latency=0.0, db_latency=0.0, sheets_latency=0.0):
+    """Patch the fakes into openai, db and the chat-log sink. Returns them for inspection."""
+    import openai
+    import db
+
+    completion = FakeChatCompletion(latency=openai_latency)
+    openai.ChatCompletion.create = completion.create
+    openai.ChatCompletion.acreate = completion.acreate
+    database = FakeDatabase(latency=db_latency)
+    db.pool.close_all()
+    db.pool._connect = database.connect
+    worksheet = FakeWorksheet(latency=sheets_latency)
+
+    # Signup e-mail is never on a benchmarked path; only provide it if the real helper is absent
+    try:
+        import utils.email_utils  # noqa: F401
+    except ImportError:
+        utils = types.ModuleType("utils")
+        email_utils = types.ModuleType("utils.email_utils")
+        email_utils.send_signup_email = lambda full_name, email: None
+        utils.email_utils = email_utils
+        sys.modules.setdefault("utils", utils)
+        sys.modules.setdefault("utils.email_utils", email_utils)
+
+    return completion, database, worksheet
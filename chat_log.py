@@ -0,0 +1,191 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+from metrics import metrics, time_stage
+
+logger = logging.getLogger(__name__)
+
+CHAT_LOG_SINK = os.getenv("CHAT_LOG_SINK", "sheets")            # sheets | file | sqlite
+CHAT_LOG_PATH = os.getenv("CHAT_LOG_PATH", "")                  # file / sqlite sinks only
+CHAT_LOG_QUEUE_SIZE = int(os.getenv("CHAT_LOG_QUEUE_SIZE", "10000"))
+CHAT_LOG_BATCH_SIZE = int(os.getenv("CHAT_LOG_BATCH_SIZE", "100"))
+CHAT_LOG_FLUSH_INTERVAL = float(os.getenv("CHAT_LOG_FLUSH_INTERVAL", "5"))
+CHAT_LOG_MAX_RETRIES = int(os.getenv("CHAT_LOG_MAX_RETRIES", "3"))
+
+CHAT_LOG_ROWS = metrics.counter(
+    "chatbot_chat_log_rows_total",
+    "Chat log rows by outcome: written, queue_full (dropped on submit), gave_up (dropped after retries).",
+    ("outcome",))
+CHAT_LOG_FAILED_BATCHES = metrics.counter(
+    "chatbot_chat_log_failed_batches_total", "Chat log batches the sink failed to write (each retry counts).")
+
+_WAKE = object()   # wakes the writer thread on close
+
+COLUMNS = ["timestamp", "user_id", "user_msg", "intent", "fallback", "latency_ms", "bot_reply"]
+
+
+# ✅ Sinks: anything with write_rows(rows)
+class SheetsSink:
+    """Appends to the Google Sheet, keeping one authorised worksheet handle."""
+
+    def __init__(self, open_worksheet):
+        self._open_worksheet = open_worksheet
+        self._worksheet = None
+
+    def write_rows(self, rows):
+        if self._worksheet is None:
+            self._worksheet = self._open_worksheet()
+        try:
+            self._worksheet.append_rows(rows, value_input_option="RAW")
+        except Exception:
+            self._worksheet = None   # token expired or sheet moved: re-authorise next time
+            raise
+
+
+class JsonlFileSink:
+    def __init__(self, path="chat_logs.jsonl"):
+        self.path = path
+
+    def write_rows(self, rows):
+        with open(self.path, "a", encoding="utf-8") as f:
+            for row in rows:
+                f.write(json.dumps(dict(zip(COLUMNS, row))) + "\n")
+
+
+class SqliteSink:
+    def __init__(self, path="chat_logs.sqlite3"):
+        self.path = path
+        with sqlite3.connect(self.path) as conn:
+            conn.execute(f"CREATE TABLE IF NOT EXISTS chat_logs ({', '.join(COLUMNS)})")
+
+    def write_rows(self, rows):
+        with sqlite3.connect(self.path) as conn:
+            conn.executemany(f"INSERT INTO chat_logs VALUES ({', '.join('?' * len(COLUMNS))})", rows)
+
+
+class ChatLogWriter:
+    """Bounded queue drained by one background thread in batches.
+
+    ``submit`` never blocks the request: when the queue is full the row is
+    dropped and counted. Batches go out when ``batch_size`` rows are waiting
+    or ``flush_interval`` seconds after the first one arrived; failed batches
+    are retried a few times before being dropped. Pending rows are flushed
+    at interpreter exit.
+    """
+
+    def __init__(self, sink, max_queue=CHAT_LOG_QUEUE_SIZE, batch_size=CHAT_LOG_BATCH_SIZE,
+                 flush_interval=CHAT_LOG_FLUSH_INTERVAL, max_retries=CHAT_LOG_MAX_RETRIES):
+        self.sink = sink
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self.submitted = 0
+        self.written = 0
+        self.dropped = 0
+        self.failed_batches = 0
+        self._thread = threading.Thread(target=self._run, name="chat-log-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def submit(self, row):
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            CHAT_LOG_ROWS.inc("queue_full")
+            return False
+        with self._lock:
+            self.submitted += 1
+        return True
+
+    def _run(self):
+        batch, first_at, attempts = [], None, 0
+        while True:
+            if self._stop.is_set():
+                timeout = 0
+            elif first_at is None:
+                timeout = self.flush_interval
+            else:
+                timeout = max(first_at + self.flush_interval - time.monotonic(), 0)
+            try:
+                row = self._queue.get(timeout=timeout) if timeout else self._queue.get_nowait()
+                if row is not _WAKE:
+                    batch.append(row)
+                    if first_at is None:
+                        first_at = time.monotonic()
+                if len(batch) < self.batch_size or attempts:
+                    continue   # while retrying, wait out the interval instead
+            except queue.Empty:
+                if self._stop.is_set():
+                    break
+                if not batch:
+                    continue
+
+            if self._flush(batch):
+                batch, first_at, attempts = [], None, 0
+            else:
+                attempts += 1
+                if attempts >= self.max_retries:
+                    with self._lock:
+                        self.dropped += len(batch)
+                    CHAT_LOG_ROWS.inc("gave_up", amount=len(batch))
+                    batch, first_at, attempts = [], None, 0
+                else:
+                    first_at = time.monotonic()   # back off one interval before retrying
+
+        if batch:
+            self._flush(batch)
+
+    def _flush(self, batch):
+        try:
+            with time_stage("chat_log_write"):
+                self.sink.write_rows(batch)
+        except Exception:
+            logger.exception("Chat log flush of %d rows failed", len(batch))
+            with self._lock:
+                self.failed_batches += 1
+            CHAT_LOG_FAILED_BATCHES.inc()
+            return False
+        with self._lock:
+            self.written += len(batch)
+        CHAT_LOG_ROWS.inc("written", amount=len(batch))
+        return True
+
+    def close(self, timeout=10):
+        """Flush whatever is queued and stop the writer thread."""
+        if self._stop.is_set():
+            return
+        self._stop.set()
+        try:
+            self._queue.put_nowait(_WAKE)
+        except queue.Full:
+            pass   # the writer is busy draining anyway
+        self._thread.join(timeout)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "queued": self._queue.qsize(),
+                "submitted": self.submitted,
+                "written": self.written,
+                "dropped": self.dropped,
+                "failed_batches": self.failed_batches,
+            }
+
+
+def make_sink(open_worksheet):
+    if CHAT_LOG_SINK == "file":
+        return JsonlFileSink(CHAT_LOG_PATH or "chat_logs.jsonl")
+    if CHAT_LOG_SINK == "sqlite":
+        return SqliteSink(CHAT_LOG_PATH or "chat_logs.sqlite3")
+    return SheetsSink(open_worksheet)
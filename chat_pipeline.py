@@ -0,0 +1,110 @@
+import asyncio
+import contextvars
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+logger = logging.getLogger(__name__)
+
+CHAT_PIPELINE_WORKERS = int(os.getenv("CHAT_PIPELINE_WORKERS", "32"))
+
+_executor = ThreadPoolExecutor(max_workers=CHAT_PIPELINE_WORKERS, thread_name_prefix="chat-pipeline")
+
+
+class Stage:
+    """One independent step of a request: ``fn(*args)`` with its own deadline.
+
+    If the stage raises or misses its timeout the pipeline uses ``fallback``
+    instead, so a slow side call (e.g. intent detection) never blocks the reply.
+    """
+
+    def __init__(self, name, fn, *args, timeout=30.0, fallback=None):
+        self.name = name
+        self.fn = fn
+        self.args = args
+        self.timeout = timeout
+        self.fallback = fallback
+
+
+def run_parallel(*stages):
+    """Run stages concurrently on the shared pool.
+
+    Returns ``(results, timings)``: results by stage name, and per-stage
+    wall time in ms (the timeout value when a stage was abandoned). A
+    stage's timeout bounds its whole wait, queueing included; a stage
+    still queued at its deadline is cancelled, never started late.
+    """
+    handles = [start(stage) for stage in stages]
+    results, timings = {}, {}
+    for handle in handles:
+        name = handle[0].name
+        results[name], timings[name] = finish(handle)
+    return results, timings
+
+
+def start(stage):
+    """Submit a stage now; collect it later with ``finish``.
+
+    The stage runs in a copy of the caller's context, so context variables
+    (e.g. the request's token accounting) follow it onto the pool thread.
+    """
+    return stage, time.perf_counter(), _executor.submit(contextvars.copy_context().run, _run_stage, stage)
+
+
+def finish(handle):
+    """Wait for a started stage within its deadline, counted from submit; returns ``(result, ms)``."""
+    stage, started, future = handle
+    remaining = stage.timeout - (time.perf_counter() - started)
+    try:
+        return future.result(timeout=max(remaining, 0))
+    except TimeoutError:
+        # Still queued: make sure it never runs for a request that has moved on
+        state = "still queued" if future.cancel() else "timed out"
+        logger.warning("Stage %s %s after %.1fs", stage.name, state, stage.timeout)
+        return stage.fallback, stage.timeout * 1000
+    except Exception:
+        logger.exception("Stage %s failed", stage.name)
+        return stage.fallback, (time.perf_counter() - started) * 1000
+
+
+def _run_stage(stage):
+    started = time.perf_counter()
+    value = stage.fn(*stage.args)
+    return value, (time.perf_counter() - started) * 1000
+
+
+async def arun_parallel(*stages):
+    """``run_parallel`` for coroutine stages (``fn`` is an ``async def``), on the running loop.
+
+    Each stage is a task with a copy of the caller's context. Unlike the
+    thread version, a stage that misses its deadline is cancelled.
+    """
+    outcomes = await asyncio.gather(*(_arun_stage(stage) for stage in stages))
+    results, timings = {}, {}
+    for stage, (value, ms) in zip(stages, outcomes):
+        results[stage.name], timings[stage.name] = value, ms
+    return results, timings
+
+
+async def _arun_stage(stage):
+    started = time.perf_counter()
+    try:
+        value = await asyncio.wait_for(stage.fn(*stage.args), stage.timeout)
+    except asyncio.TimeoutError:
+        logger.warning("Stage %s timed out after %.1fs", stage.name, stage.timeout)
+        return stage.fallback, stage.timeout * 1000
+    except Exception:
+        logger.exception("Stage %s failed", stage.name)
+        return stage.fallback, (time.perf_counter() - started) * 1000
+    return value, (time.perf_counter() - started) * 1000
+
+
+def run_background(fn, *args, **kwargs):
+    """Fire-and-forget work that must not delay the response (e.g. logging)."""
+    def task():
+        try:
+            fn(*args, **kwargs)
+        except Exception:
+            logger.exception("Background task %s failed", getattr(fn, "__name__", fn))
+    return _executor.submit(task)
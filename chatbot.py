@@ -1,97 +1,301 @@
 import os
+import re
 import json
+import asyncio
 from fuzzywuzzy import fuzz
 from dotenv import load_dotenv
 import openai
 import time
-from db import get_db_connection
+import logging
+import threading
+from collections import deque
+from db import db_connection
+from memory_index import memory_index, on_memory_added
+from retrieval import retrieval_engine
+from fuzzy_match import fuzzy_matcher
+from response_cache import response_cache, cache_key
+from conversations import conversation_store
+from model_registry import model_registry
+from token_usage import acreate_completion, create_completion
+from metrics import time_stage
+from single_flight import FlightAbandoned, reply_flights
+from resilience import openai_guard
 
 
+logger = logging.getLogger(__name__)
+
 # Load environment variables
 load_dotenv()
 
 # Initialize OpenAI client
 openai.api_key = os.getenv("OPENAI_API_KEY")
 
-# Load Q&A dataset (optional if no longer used)
-with open("data/rmu_openai_chatbot_dataset.jsonl", "r") as f:
-    qa_dataset = [json.loads(line) for line in f if line.strip()]
-
-# System prompt
-chat_history = [
-    {
-        "role": "system",
-        "content": (
-            "You are RMU’s official chatbot. Be very interactive with the users. Provide detailed, accurate, and context-rich answers "
-            "about programs, departments, hostels, student life, and fees. Avoid referring users back to the website. "
-            "Explain as much as possible.\n\n"
-            "Important note: RMU accepts both Ghana Cedis and US Dollars for academic fees. A fixed exchange rate is usually announced each semester "
-            "for those paying in Ghana Cedis. Always mention this if asked about currency, fees, or payment methods."
-        )
-    }
-]
+# Phrases that mark a message as a correction of the previous answer (whole words, so "know" is not "no")
+CORRECTION_RE = re.compile(r"\b(?:no|not correct|it's|its|the correct|that's wrong)\b", re.IGNORECASE)
 
+# Q&A dataset retrieval: answer directly above this score, otherwise ground the model with the top hits
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "3"))
+RETRIEVAL_ANSWER_THRESHOLD = float(os.getenv("RETRIEVAL_ANSWER_THRESHOLD", "0.85"))
+# While OpenAI fails, the closest dataset answer above this score is given instead
+DEGRADED_ANSWER_THRESHOLD = float(os.getenv("DEGRADED_ANSWER_THRESHOLD", "0.3"))
+DEGRADED_PREFIX = "I can't reach my full knowledge right now, so here is the closest answer I have:\n\n"
+DEGRADED_MESSAGE = "Sorry, I can't answer that right now. Please try again in a few minutes."
+retrieval_engine.refresh_if_changed()
 
 # ✅ Memory checker
 def get_correction_from_memory(user_input):
-    conn = get_db_connection()
-    cursor = conn.cursor(dictionary=True)
-    cursor.execute(
-        "SELECT corrected_answer FROM memory_corrections WHERE %s LIKE CONCAT('%', corrected_question, '%') LIMIT 1",
-        (user_input,)
-    )
-    result = cursor.fetchone()
-    conn.close()
-    return result['corrected_answer'] if result else None
+    with time_stage("memory_lookup"):
+        memory_index.refresh_if_stale()
+        return memory_index.best_match(user_input)
+
+# ✅ Retrieved Q&A pairs passed to the model as reference (not kept in the conversation)
+def grounding_messages(hits):
+    if not hits:
+        return []
+    reference = "\n\n".join(f"Q: {h['question']}\nA: {h['answer']}" for h in hits)
+    return [{
+        "role": "system",
+        "content": "Relevant entries from the RMU knowledge base. Use them if they answer the question:\n\n" + reference
+    }]
+
+# Model settings shared by the blocking and streaming paths. The model ID is looked up per request:
+# fine_tune_jobs publishes each new fine-tune as "chat"; CHAT_MODEL is used until one is published.
+CHAT_MODEL = os.getenv("CHAT_MODEL", "ft:gpt-3.5-turbo-0125:personal:rmu-v2:Be3kCokl")  # or "gpt-3.5-turbo"
+CHAT_TEMPERATURE = 0.5
+CHAT_MAX_TOKENS = 2000
+
+
+def chat_model():
+    return model_registry.get("chat", CHAT_MODEL)
+
+
+class StreamStats:
+    """Time-to-first-token and total stream time over the last ``window`` streamed replies."""
+
+    def __init__(self, window=1000):
+        self._lock = threading.Lock()
+        self._ttft = deque(maxlen=window)
+        self._total = deque(maxlen=window)
+        self.count = 0
+
+    def record(self, ttft_ms, total_ms):
+        with self._lock:
+            self._ttft.append(ttft_ms)
+            self._total.append(total_ms)
+            self.count += 1
+
+    def summary(self):
+        with self._lock:
+            ttft, total = sorted(self._ttft), sorted(self._total)
+        return {
+            "streams": self.count,
+            "ttft_p50_ms": _percentile(ttft, 50),
+            "ttft_p95_ms": _percentile(ttft, 95),
+            "total_p50_ms": _percentile(total, 50),
+        }
+
+
+def _percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0
+    return round(sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * pct / 100))])
+
+
+stream_stats = StreamStats()
+
+
+# ✅ Everything before the model call: memory, corrections, dataset, cache
+def _prepare_reply(user_input, conversation_id):
+    """Return ``(reply, None)`` when answered locally, else ``(None, request)`` for the model."""
+    # Earlier turns of this conversation only (not other users')
+    previous = conversation_store.recent(conversation_id)
 
-# ✅ Chatbot response logic
-def get_chatbot_response(user_input):
     # 1. Check memory
     correction = get_correction_from_memory(user_input)
     if correction:
-        chat_history.append({"role": "user", "content": user_input})
-        chat_history.append({"role": "assistant", "content": correction})
-        return correction
+        conversation_store.append(conversation_id, "user", user_input)
+        return correction, None
 
     # 2. Add user input
-    chat_history.append({"role": "user", "content": user_input})
+    conversation_store.append(conversation_id, "user", user_input)
 
     # 3. Check if this is a correction statement
-    correction_keywords = ["no", "not correct", "it's", "its", "the correct", "that's wrong"]
-    if any(kw in user_input.lower() for kw in correction_keywords):
+    if CORRECTION_RE.search(user_input):
         last_user_input = ""
         last_bot_reply = ""
-        for i in range(len(chat_history) - 2, -1, -1):  # Skip current message, look backwards
-            if chat_history[i]["role"] == "user":
-                last_user_input = chat_history[i]["content"]
-            elif chat_history[i]["role"] == "assistant" and last_user_input:
-                last_bot_reply = chat_history[i]["content"]
+        for message in reversed(previous):  # Look backwards from the previous turn
+            if message["role"] == "user":
+                last_user_input = message["content"]
+            elif message["role"] == "assistant" and last_user_input:
+                last_bot_reply = message["content"]
                 break
 
         if last_user_input and last_bot_reply:
-            conn = get_db_connection()
-            cursor = conn.cursor()
-            cursor.execute(
-                "INSERT INTO memory_corrections (corrected_question, original_answer, corrected_answer) VALUES (%s, %s, %s)",
-                (last_user_input, last_bot_reply, user_input)
-            )
-            conn.commit()
-            conn.close()
+            with db_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(
+                    "INSERT INTO memory_corrections (corrected_question, original_answer, corrected_answer) VALUES (%s, %s, %s)",
+                    (last_user_input, last_bot_reply, user_input)
+                )
+                apply_memory = on_memory_added(cursor, cursor.lastrowid, last_user_input, user_input)
+                conn.commit()
+            apply_memory()
+
+
+    # 4. Check the local Q&A dataset
+    with time_stage("retrieval"):
+        hits = retrieval_engine.search(user_input, k=RETRIEVAL_TOP_K)
+    if hits and hits[0]["score"] >= RETRIEVAL_ANSWER_THRESHOLD:
+        return hits[0]["answer"], None
+
+    # 5. Near-duplicate of a known question (typos, punctuation)
+    with time_stage("fuzzy_match"):
+        fuzzy_hit = fuzzy_matcher.match(user_input)
+    if fuzzy_hit:
+        return fuzzy_hit[0], None
+
+    # 6. Reuse a cached reply for the same question in the same context
+    key = cache_key(user_input, previous)
+    cached = response_cache.get(key)
+    if cached:
+        return cached, None
 
+    # 7. Needs the model, grounded with the closest dataset entries
+    messages = conversation_store.messages_for_model(conversation_id) + grounding_messages(hits)
+    return None, {"messages": messages, "cache_key": key, "hits": hits}
 
-    # 4. Send to OpenAI
+
+# ✅ Answer from local data when the model call failed (never cached)
+def degraded_reply(model_request, error):
+    logger.warning("OpenAI reply failed (%s: %s); answering from the dataset", type(error).__name__, error)
+    openai_guard.degraded("reply")
+    hits = model_request.get("hits")
+    if hits and hits[0]["score"] >= DEGRADED_ANSWER_THRESHOLD:
+        return DEGRADED_PREFIX + hits[0]["answer"]
+    return DEGRADED_MESSAGE
+
+
+# ✅ Chatbot response logic
+def get_chatbot_response(user_input, conversation_id="default"):
+    reply, model_request = _prepare_reply(user_input, conversation_id)
+    if reply is not None:
+        conversation_store.append(conversation_id, "assistant", reply)
+        return reply
+
+    # Identical questions asked while this one is with the model share its reply
+    model = chat_model()
     try:
-        response = openai.ChatCompletion.create(
-        model="ft:gpt-3.5-turbo-0125:personal:rmu-v2:Be3kCokl",  # or use "gpt-3.5-turbo" if not fine-tuned
-        messages=chat_history,
-        temperature=0.5,
-        max_tokens=2000
-    )
+        bot_reply = reply_flights.do(flight_key(model, model_request), _complete, model, model_request)
+    except Exception as e:
+        bot_reply = degraded_reply(model_request, e)
+
+    conversation_store.append(conversation_id, "assistant", bot_reply)
+    return bot_reply
+
+
+def flight_key(model, model_request):
+    return f"{model}|{model_request['cache_key']}"
+
+
+def completion_args(model, model_request, **extra):
+    return dict(model=model, messages=model_request["messages"], temperature=CHAT_TEMPERATURE,
+                max_tokens=CHAT_MAX_TOKENS, **extra)
+
 
+def _complete(model, model_request):
+    started = time.time()
+    response = create_completion("reply", **completion_args(model, model_request))
+    bot_reply = response.choices[0].message.content
+    response_cache.put(model_request["cache_key"], bot_reply, (time.time() - started) * 1000)
+    return bot_reply
 
-        bot_reply = response.choices[0].message.content
-        chat_history.append({"role": "assistant", "content": bot_reply})
-        return bot_reply
 
+# ✅ Asyncio variant for async_app; the blocking local steps run on ``executor``
+async def aget_chatbot_response(user_input, conversation_id="default", executor=None):
+    loop = asyncio.get_running_loop()
+    reply, model_request = await loop.run_in_executor(executor, _prepare_reply, user_input, conversation_id)
+    if reply is None:
+        model = chat_model()
+        try:
+            reply = await reply_flights.ado(flight_key(model, model_request), _acomplete, model, model_request)
+        except Exception as e:
+            reply = degraded_reply(model_request, e)
+
+    await loop.run_in_executor(executor, conversation_store.append, conversation_id, "assistant", reply)
+    return reply
+
+
+async def _acomplete(model, model_request):
+    started = time.time()
+    response = await acreate_completion("reply", **completion_args(model, model_request))
+    bot_reply = response.choices[0].message.content
+    response_cache.put(model_request["cache_key"], bot_reply, (time.time() - started) * 1000)
+    return bot_reply
+
+
+# ✅ Streaming variant: yields text chunks as they arrive
+def stream_chatbot_response(user_input, conversation_id="default"):
+    """Local answers come out as one chunk; model answers token by token.
+
+    The conversation and the response cache are only updated once the
+    stream has finished, so an aborted stream leaves no half answer behind.
+    While the same question is already with the model (streamed or not),
+    the reply is waited for and sent as one chunk.
+    """
+    started = time.time()
+    reply, model_request = _prepare_reply(user_input, conversation_id)
+    if reply is not None:
+        conversation_store.append(conversation_id, "assistant", reply)
+        yield reply
+        return
+
+    model = chat_model()
+    key = flight_key(model, model_request)
+    flight, leader = reply_flights.join(key)
+    if not leader:
+        try:
+            bot_reply = reply_flights.wait(flight)
+        except Exception as e:
+            bot_reply = degraded_reply(model_request, e)
+        conversation_store.append(conversation_id, "assistant", bot_reply)
+        yield bot_reply
+        return
+
+    parts = []
+    try:
+        bot_reply = yield from _stream_completion(model, model_request, started, parts)
+        reply_flights.land(key, flight, bot_reply)
     except Exception as e:
-        return f"Sorry, an error occurred: {e}"
+        reply_flights.land(key, flight, error=e)
+        if parts:
+            # Cut off mid-answer: too late to switch to another one
+            yield f"Sorry, an error occurred: {e}"
+            return
+        bot_reply = degraded_reply(model_request, e)
+        conversation_store.append(conversation_id, "assistant", bot_reply)
+        yield bot_reply
+        return
+    finally:
+        if not flight.done.is_set():
+            # Client went away mid-stream: followers get an error, not a half answer
+            reply_flights.land(key, flight, error=FlightAbandoned("reply stream aborted"))
+    conversation_store.append(conversation_id, "assistant", bot_reply)
+
+
+def _stream_completion(model, model_request, started, parts):
+    """Yield the reply's deltas (also collected in ``parts``); return the whole reply at the end."""
+    first_token_at = None
+    for chunk in create_completion("reply", **completion_args(model, model_request, stream=True)):
+        delta = chunk.choices[0].get("delta", {}).get("content")
+        if not delta:
+            continue
+        if first_token_at is None:
+            first_token_at = time.time()
+        parts.append(delta)
+        yield delta
+
+    bot_reply = "".join(parts)
+    finished = time.time()
+    stream_stats.record(((first_token_at or finished) - started) * 1000, (finished - started) * 1000)
+    response_cache.put(model_request["cache_key"], bot_reply, (finished - started) * 1000)
+    return bot_reply
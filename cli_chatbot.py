@@ -1,6 +1,8 @@
-import time
+import argparse
+import json
 import sys
-from chatbot import get_chatbot_response
+from chatbot import get_chatbot_response, stream_chatbot_response
+from conversations import conversation_store
 from colorama import init, Fore, Style
 
 # Initialize colorama for Windows terminal compatibility
@@ -9,14 +11,66 @@ init(autoreset=True)
 # Optional: keep a simple in-memory chat log for session
 chat_log = []
 
-def type_effect(text, delay=0.02):
-    for char in text:
-        sys.stdout.write(char)
-        sys.stdout.flush()
-        time.sleep(delay)
-    print()
+CLI_CONVERSATION = "cli"
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="RMU Chatbot CLI")
+    parser.add_argument("--batch", "--no-stream", dest="batch", action="store_true",
+                        help="answer questions non-interactively instead of chatting")
+    parser.add_argument("--input", "-i", default="-",
+                        help="batch input: one question per line, or JSONL with 'question' or 'messages' (default: stdin)")
+    parser.add_argument("--output", "-o", default="-",
+                        help="batch output as JSONL {question, answer} (default: stdout)")
+    return parser.parse_args(argv)
+
+
+def read_questions(stream):
+    for line in stream:
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith("{"):
+            try:
+                item = json.loads(line)
+            except json.JSONDecodeError:
+                yield line
+                continue
+            question = item.get("question") or next(
+                (m.get("content") for m in item.get("messages", []) if m.get("role") == "user"), None)
+            if question:
+                yield question
+        else:
+            yield line
+
+
+def run_batch(args):
+    source = sys.stdin if args.input == "-" else open(args.input, "r", encoding="utf-8")
+    sink = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+    count = 0
+    try:
+        for question in read_questions(source):
+            # Every question is answered on its own, without earlier batch context
+            conversation_id = f"batch:{count}"
+            answer = get_chatbot_response(question, conversation_id)
+            conversation_store.reset(conversation_id)
+            sink.write(json.dumps({"question": question, "answer": answer}) + "\n")
+            sink.flush()
+            count += 1
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if sink is not sys.stdout:
+            sink.close()
+    print(f"Answered {count} questions.", file=sys.stderr)
+
 
 def main():
+    args = parse_args()
+    if args.batch:
+        run_batch(args)
+        return
+
     print(Fore.CYAN + Style.BRIGHT + "\n🎓 Welcome to the RMU Chatbot CLI 🎓")
     print(Fore.YELLOW + "Type 'exit' to quit. Type 'history' to show the current session.\n")
 
@@ -33,8 +87,13 @@ def main():
             continue
 
         print(Fore.BLUE + "Bot: ", end="")
-        bot_reply = get_chatbot_response(user_input)
-        type_effect(bot_reply, delay=0.02)
+        parts = []
+        for chunk in stream_chatbot_response(user_input, CLI_CONVERSATION):
+            parts.append(chunk)
+            sys.stdout.write(chunk)
+            sys.stdout.flush()
+        print()
+        bot_reply = "".join(parts)
 
         # Save to history log
         chat_log.append({
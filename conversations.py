@@ -0,0 +1,170 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+from itertools import islice
+
+SYSTEM_PROMPT = (
+    "You are RMU’s official chatbot. Be very interactive with the users. Provide detailed, accurate, and context-rich answers "
+    "about programs, departments, hostels, student life, and fees. Avoid referring users back to the website. "
+    "Explain as much as possible.\n\n"
+    "Important note: RMU accepts both Ghana Cedis and US Dollars for academic fees. A fixed exchange rate is usually announced each semester "
+    "for those paying in Ghana Cedis. Always mention this if asked about currency, fees, or payment methods."
+)
+
+# Messages kept per conversation, and how many of them are sent to the model
+CONVERSATION_MAX_MESSAGES = int(os.getenv("CONVERSATION_MAX_MESSAGES", "50"))
+CONVERSATION_CONTEXT_MESSAGES = int(os.getenv("CONVERSATION_CONTEXT_MESSAGES", "10"))
+CONVERSATION_STORE_SIZE = int(os.getenv("CONVERSATION_STORE_SIZE", "10000"))
+CONVERSATION_IDLE_TTL = float(os.getenv("CONVERSATION_IDLE_TTL", str(2 * 3600)))
+# Optional SQLite file shared by all workers on the host (in-process only when unset)
+CONVERSATION_STORE_DB = os.getenv("CONVERSATION_STORE_DB", "")
+
+
+class MemoryBackend:
+    """Bounded per-process store: one deque per conversation, LRU over conversations."""
+
+    def __init__(self, max_conversations=CONVERSATION_STORE_SIZE, max_messages=CONVERSATION_MAX_MESSAGES,
+                 idle_ttl=CONVERSATION_IDLE_TTL):
+        self.max_conversations = max_conversations
+        self.max_messages = max_messages
+        self.idle_ttl = idle_ttl
+        self._lock = threading.Lock()
+        self._conversations = OrderedDict()   # id -> (deque of messages, last_used)
+
+    def append(self, conversation_id, role, content):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._conversations.pop(conversation_id, None)
+            messages = entry[0] if entry else deque(maxlen=self.max_messages)
+            messages.append({"role": role, "content": content})
+            self._conversations[conversation_id] = (messages, now)
+            self._evict(now)
+
+    def recent(self, conversation_id, n):
+        with self._lock:
+            entry = self._conversations.get(conversation_id)
+            if not entry or n <= 0:
+                return []
+            self._conversations.move_to_end(conversation_id)
+            self._conversations[conversation_id] = (entry[0], time.monotonic())
+            tail = list(islice(reversed(entry[0]), n))
+        tail.reverse()
+        return tail
+
+    def reset(self, conversation_id):
+        with self._lock:
+            self._conversations.pop(conversation_id, None)
+
+    def __len__(self):
+        return len(self._conversations)
+
+    def _evict(self, now):
+        while len(self._conversations) > self.max_conversations:
+            self._conversations.popitem(last=False)
+        # Oldest entries sit at the front, so stop at the first one still in use
+        while self._conversations:
+            oldest_id, (_, last_used) = next(iter(self._conversations.items()))
+            if now - last_used <= self.idle_ttl:
+                break
+            del self._conversations[oldest_id]
+
+
+class SqliteBackend:
+    """Shared store for several workers: one row per message, indexed by (conversation, seq)."""
+
+    def __init__(self, path, max_messages=CONVERSATION_MAX_MESSAGES, idle_ttl=CONVERSATION_IDLE_TTL):
+        self.path = path
+        self.max_messages = max_messages
+        self.idle_ttl = idle_ttl
+        self._local = threading.local()
+        self._last_prune = 0.0
+        self._conn().executescript("""
+            CREATE TABLE IF NOT EXISTS conversation_messages (
+                conversation_id TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                role TEXT NOT NULL,
+                content TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (conversation_id, seq)
+            );
+            CREATE INDEX IF NOT EXISTS idx_conversation_messages_created ON conversation_messages (created_at);
+        """)
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def append(self, conversation_id, role, content):
+        conn = self._conn()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT MAX(seq) FROM conversation_messages WHERE conversation_id = ?", (conversation_id,)
+            ).fetchone()
+            seq = (row[0] or 0) + 1
+            conn.execute(
+                "INSERT INTO conversation_messages (conversation_id, seq, role, content, created_at) VALUES (?, ?, ?, ?, ?)",
+                (conversation_id, seq, role, content, now)
+            )
+            conn.execute(
+                "DELETE FROM conversation_messages WHERE conversation_id = ? AND seq <= ?",
+                (conversation_id, seq - self.max_messages)
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        if now - self._last_prune > 60:
+            self._last_prune = now
+            self._prune_idle(now)
+
+    def recent(self, conversation_id, n):
+        if n <= 0:
+            return []
+        rows = self._conn().execute(
+            "SELECT role, content FROM conversation_messages WHERE conversation_id = ? ORDER BY seq DESC LIMIT ?",
+            (conversation_id, n)
+        ).fetchall()
+        return [{"role": role, "content": content} for role, content in reversed(rows)]
+
+    def reset(self, conversation_id):
+        self._conn().execute("DELETE FROM conversation_messages WHERE conversation_id = ?", (conversation_id,))
+
+    def _prune_idle(self, now):
+        self._conn().execute(
+            "DELETE FROM conversation_messages WHERE conversation_id IN ("
+            " SELECT conversation_id FROM conversation_messages"
+            " GROUP BY conversation_id HAVING MAX(created_at) < ?)",
+            (now - self.idle_ttl,)
+        )
+
+
+class ConversationStore:
+    """Per-user chat history. Only the system prompt plus the last few turns go to the model."""
+
+    def __init__(self, backend=None):
+        if backend is None:
+            backend = SqliteBackend(CONVERSATION_STORE_DB) if CONVERSATION_STORE_DB else MemoryBackend()
+        self.backend = backend
+
+    def append(self, conversation_id, role, content):
+        self.backend.append(conversation_id, role, content)
+
+    def recent(self, conversation_id, n=CONVERSATION_CONTEXT_MESSAGES):
+        return self.backend.recent(conversation_id, n)
+
+    def messages_for_model(self, conversation_id, n=CONVERSATION_CONTEXT_MESSAGES):
+        return [{"role": "system", "content": SYSTEM_PROMPT}] + self.recent(conversation_id, n)
+
+    def reset(self, conversation_id):
+        self.backend.reset(conversation_id)
+
+
+conversation_store = ConversationStore()
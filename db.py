@@ -1,13 +1,274 @@
 import mysql.connector
 import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
 from dotenv import load_dotenv
 
+from metrics import DB_QUERY_SECONDS, STAGE_SECONDS, query_label
+
 load_dotenv()
 
-def get_db_connection():
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "5"))        # max wait for a free connection (s)
+DB_POOL_RECYCLE = float(os.getenv("DB_POOL_RECYCLE", "3600"))     # replace connections older than this (s)
+DB_POOL_PING_AFTER = float(os.getenv("DB_POOL_PING_AFTER", "30")) # ping connections idle longer than this (s)
+
+
+def _connect():
     return mysql.connector.connect(
         host=os.getenv("DB_HOST"),
         user=os.getenv("DB_USER"),
         password=os.getenv("DB_PASSWORD"),
         database=os.getenv("DB_NAME")  # Ensure DB_NAME is set to "rmu_chatbot"
     )
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class MeteredCursor:
+    """Cursor wrapper that records every statement in ``chatbot_db_query_duration_seconds``."""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def execute(self, sql, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return self._cursor.execute(sql, *args, **kwargs)
+        finally:
+            DB_QUERY_SECONDS.observe(time.perf_counter() - started, query_label(sql))
+
+    def executemany(self, sql, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return self._cursor.executemany(sql, *args, **kwargs)
+        finally:
+            DB_QUERY_SECONDS.observe(time.perf_counter() - started, query_label(sql))
+
+
+class PooledConnection:
+    """Wraps a raw connection; ``close()`` hands it back to the pool instead of closing it."""
+
+    def __init__(self, pool, raw, created_at):
+        self._pool = pool
+        self.raw = raw
+        self.created_at = created_at
+        self.last_used = time.monotonic()
+        self._checked_out = False
+
+    def __getattr__(self, name):
+        return getattr(self.raw, name)
+
+    def cursor(self, *args, **kwargs):
+        return MeteredCursor(self.raw.cursor(*args, **kwargs))
+
+    def close(self):
+        if self._checked_out:
+            self._checked_out = False
+            self._pool.release(self)
+
+    def discard(self):
+        """Drop the connection instead of returning it, e.g. with a result set left half read."""
+        if self._checked_out:
+            self._checked_out = False
+            self._pool.discard(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class ConnectionPool:
+    """Fixed-size, thread-safe pool of database connections.
+
+    Connections are opened lazily up to ``size``. Checkout waits at most
+    ``timeout`` seconds for a free one. Connections older than ``recycle`` are
+    replaced, and ones idle longer than ``ping_after`` are pinged (and replaced
+    if dead) before being handed out. ``connect`` is any zero-argument factory,
+    so tests can run the pool against a local stand-in database.
+    """
+
+    def __init__(self, connect=_connect, size=DB_POOL_SIZE, timeout=DB_POOL_TIMEOUT,
+                 recycle=DB_POOL_RECYCLE, ping_after=DB_POOL_PING_AFTER):
+        self._connect = connect
+        self.size = size
+        self.timeout = timeout
+        self.recycle = recycle
+        self.ping_after = ping_after
+        self._cond = threading.Condition()
+        self._idle = deque()
+        self._open = 0
+        self._in_use = 0
+        self.checkouts = 0
+        self.waits = 0
+        self.wait_time = 0.0
+        self.timeouts = 0
+        self.created = 0
+        self.recycled = 0
+
+    def acquire(self):
+        started = time.perf_counter()
+        try:
+            return self._acquire()
+        finally:
+            STAGE_SECONDS.observe(time.perf_counter() - started, "db_checkout")
+
+    def _acquire(self):
+        deadline = time.monotonic() + self.timeout
+        waited_from = None
+        with self._cond:
+            while not self._idle and self._open >= self.size:
+                if waited_from is None:
+                    waited_from = time.monotonic()
+                    self.waits += 1
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.timeouts += 1
+                    self.wait_time += time.monotonic() - waited_from
+                    raise PoolTimeout(f"No database connection free after {self.timeout}s")
+                self._cond.wait(remaining)
+            if waited_from is not None:
+                self.wait_time += time.monotonic() - waited_from
+            conn = self._idle.pop() if self._idle else None
+            if conn is None:
+                self._open += 1
+            self._in_use += 1
+            self.checkouts += 1
+
+        try:
+            conn = self._checked(conn) if conn is not None else self._new()
+        except Exception:
+            with self._cond:
+                self._open -= 1
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+        conn._checked_out = True
+        return conn
+
+    def _new(self):
+        conn = PooledConnection(self, self._connect(), time.monotonic())
+        with self._cond:
+            self.created += 1
+        return conn
+
+    def _checked(self, conn):
+        now = time.monotonic()
+        stale = now - conn.created_at > self.recycle
+        if not stale and now - conn.last_used > self.ping_after:
+            stale = not _is_alive(conn.raw)
+        if not stale:
+            return conn
+        _quiet_close(conn.raw)
+        with self._cond:
+            self.recycled += 1
+        return self._new()
+
+    def release(self, conn):
+        healthy = _reset(conn.raw)
+        conn.last_used = time.monotonic()
+        with self._cond:
+            self._in_use -= 1
+            if healthy:
+                self._idle.append(conn)
+            else:
+                self._open -= 1
+            self._cond.notify()
+        if not healthy:
+            _quiet_close(conn.raw)
+
+    def discard(self, conn):
+        with self._cond:
+            self._in_use -= 1
+            self._open -= 1
+            self._cond.notify()
+        _abort(conn.raw)
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def stats(self):
+        with self._cond:
+            return {
+                "size": self.size,
+                "open": self._open,
+                "in_use": self._in_use,
+                "idle": len(self._idle),
+                "checkouts": self.checkouts,
+                "waits": self.waits,
+                "wait_time_ms": round(self.wait_time * 1000, 1),
+                "timeouts": self.timeouts,
+                "created": self.created,
+                "recycled": self.recycled,
+            }
+
+    def close_all(self):
+        with self._cond:
+            idle, self._idle = list(self._idle), deque()
+            self._open -= len(idle)
+        for conn in idle:
+            _quiet_close(conn.raw)
+
+
+def _is_alive(raw):
+    try:
+        return raw.is_connected()
+    except Exception:
+        return False
+
+
+def _reset(raw):
+    """Drop unread results and roll back anything left uncommitted; False if the connection is broken."""
+    try:
+        if getattr(raw, "unread_result", False):
+            raw.consume_results()
+        if getattr(raw, "in_transaction", False):
+            raw.rollback()
+        return True
+    except Exception:
+        return False
+
+
+def _quiet_close(raw):
+    try:
+        raw.close()
+    except Exception:
+        pass
+
+
+def _abort(raw):
+    # shutdown() drops the socket as is; close() would first read any unread result to the end
+    try:
+        getattr(raw, "shutdown", raw.close)()
+    except Exception:
+        pass
+
+
+pool = ConnectionPool()
+
+
+def get_db_connection():
+    """Check a connection out of the pool; ``conn.close()`` returns it."""
+    return pool.acquire()
+
+
+def db_connection():
+    """``with db_connection() as conn:`` -- the connection always goes back to the pool."""
+    return pool.connection()
@@ -0,0 +1,121 @@
+"""Streaming table exports (NDJSON, CSV, JSON array) for the admin panel.
+
+Rows are read through an unbuffered (server-side) cursor ``EXPORT_CHUNK_SIZE``
+at a time and encoded chunk by chunk, so memory stays flat however large
+the table is.
+"""
+import csv
+import io
+import json
+import os
+from datetime import date, datetime
+
+from admin_queries import date_filters
+from db import db_connection
+
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", "1000"))
+
+FORMATS = {
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    "csv": ("text/csv", "csv"),
+    "json": ("application/json", "json"),
+}
+
+# table -> (columns, time column)
+TABLES = {
+    "feedbacks": (["id", "rating", "comment", "submitted_at"], "submitted_at"),
+    "chat_sessions": (["id", "session_name", "user_type", "student_id", "guest_id", "is_archived",
+                       "created_at", "message_count"], "created_at"),
+    "chat_session_messages": (["session_id", "seq", "role", "content", "created_at"], "created_at"),
+    "memory_corrections": (["id", "corrected_question", "original_answer", "corrected_answer", "created_at"],
+                           "created_at"),
+}
+
+# Tie-breaker after the time column, for tables without an ``id``
+ORDER_KEYS = {"chat_session_messages": ("session_id", "seq")}
+# Exported newest first, as /admin/download-feedbacks always has been; the rest oldest first
+NEWEST_FIRST = {"feedbacks"}
+
+
+def _plain(value):
+    if isinstance(value, (datetime, date)):
+        return value.strftime("%Y-%m-%d %H:%M:%S")
+    if isinstance(value, (bytes, bytearray)):
+        return value.decode("utf-8", "replace")
+    return value
+
+
+def export_query(table, date_from=None, date_to=None, filters=None):
+    """SQL and params for ``table`` in export order; ``filters`` are extra equality conditions."""
+    columns, time_col = TABLES[table]
+    where, params = date_filters(time_col, date_from, date_to)
+    for column, value in (filters or {}).items():
+        if column in columns and value is not None:
+            where.append(f"{column} = %s")
+            params.append(value)
+    sql = f"SELECT {', '.join(columns)} FROM {table}"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    direction = " DESC" if table in NEWEST_FIRST else ""
+    order = ", ".join(key + direction for key in (time_col,) + ORDER_KEYS.get(table, ("id",)))
+    return sql + f" ORDER BY {order}", params
+
+
+def iter_rows(table, date_from=None, date_to=None, filters=None, chunk_size=EXPORT_CHUNK_SIZE):
+    """Yield lists of row dicts, ``chunk_size`` rows at a time, from a server-side cursor."""
+    sql, params = export_query(table, date_from, date_to, filters)
+    with db_connection() as conn:
+        cursor = conn.cursor(dictionary=True, buffered=False)
+        finished = False
+        try:
+            cursor.execute(sql, params)
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield rows
+            finished = True
+        finally:
+            if finished:
+                cursor.close()
+            else:
+                # Stopped mid-result (e.g. the download was cancelled): handing the connection
+                # back would read the rest of the table just to throw it away
+                conn.discard()
+
+
+def encode(chunks, fmt, columns):
+    """Turn row chunks into text pieces of the given format."""
+    if fmt == "csv":
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(columns)
+        yield buffer.getvalue()
+        for rows in chunks:
+            buffer.seek(0)
+            buffer.truncate()
+            writer.writerows([_plain(row[c]) for c in columns] for row in rows)
+            yield buffer.getvalue()
+        return
+
+    def record(row):
+        return json.dumps({c: _plain(row[c]) for c in columns}, ensure_ascii=False)
+
+    if fmt == "ndjson":
+        for rows in chunks:
+            yield "".join(record(row) + "\n" for row in rows)
+        return
+
+    # Streamed JSON array: "[", rows separated by ",\n", "]"
+    yield "["
+    first = True
+    for rows in chunks:
+        piece = ",\n".join(record(row) for row in rows)
+        yield ("\n" if first else ",\n") + piece
+        first = False
+    yield "\n]\n"
+
+
+def export(table, fmt, date_from=None, date_to=None, filters=None, chunk_size=EXPORT_CHUNK_SIZE):
+    columns, _ = TABLES[table]
+    return encode(iter_rows(table, date_from, date_to, filters, chunk_size), fmt, columns)
@@ -0,0 +1,32 @@
+"""Running feedback totals, so the dashboard never scans the feedbacks table.
+
+``on_feedback_added`` must run inside the transaction that inserts the
+feedback row; the single ``feedback_stats`` row then always matches the
+table (see migrations/002_feedback_stats.sql).
+"""
+STATS_ROW = 1
+
+
+def on_feedback_added(cursor, rating):
+    cursor.execute(
+        "UPDATE feedback_stats SET total = total + 1, rated = rated + (%s IS NOT NULL), "
+        "rating_sum = rating_sum + COALESCE(%s, 0) WHERE id = %s",
+        (rating, rating, STATS_ROW)
+    )
+
+
+def read_feedback_stats(cursor):
+    """``(feedback_count, avg_rating)`` from the running totals."""
+    cursor.execute("SELECT total, rated, rating_sum FROM feedback_stats WHERE id = %s", (STATS_ROW,))
+    row = cursor.fetchone()
+    if row is None:
+        # Migration not applied yet: seed the row once from the table
+        cursor.execute(
+            "INSERT IGNORE INTO feedback_stats (id, total, rated, rating_sum) "
+            "SELECT %s, COUNT(*), COUNT(rating), COALESCE(SUM(rating), 0) FROM feedbacks",
+            (STATS_ROW,)
+        )
+        cursor.execute("SELECT total, rated, rating_sum FROM feedback_stats WHERE id = %s", (STATS_ROW,))
+        row = cursor.fetchone()
+    total, rated, rating_sum = row
+    return int(total), round(float(rating_sum) / rated, 2) if rated else 0
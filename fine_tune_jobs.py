@@ -0,0 +1,344 @@
+"""Fine-tune jobs that survive restarts.
+
+Each job is a small state machine kept in ``FINE_TUNE_STATE_PATH`` (JSON,
+rewritten atomically after every transition)::
+
+    pending -> uploaded -> creating -> running -> succeeded | failed | cancelled
+
+Every step is either idempotent or recorded before the next one starts:
+file IDs are saved as soon as the upload returns, and a job left in
+``creating`` by a crash is looked up by its training file before another
+one is created. Running jobs are polled with exponential backoff and
+jitter (the interval grows while the remote status stays the same); API
+errors back off the same way until ``FINE_TUNE_MAX_ERRORS`` in a row fail
+the job. Due jobs are advanced concurrently. A succeeded model is published
+to the model registry, where ``chatbot`` picks it up::
+
+    python fine_tune_jobs.py submit --compile --publish-as chat
+    python fine_tune_jobs.py run
+    python fine_tune_jobs.py status
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+
+import openai
+
+from backoff import backoff
+from model_registry import model_registry
+
+try:
+    import fcntl
+except ImportError:   # Windows: only in-process locking
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+FINE_TUNE_STATE_PATH = os.getenv("FINE_TUNE_STATE_PATH", "data/fine_tune_jobs.json")
+FINE_TUNE_BASE_MODEL = os.getenv("FINE_TUNE_BASE_MODEL", "gpt-3.5-turbo")
+FINE_TUNE_SUFFIX = os.getenv("FINE_TUNE_SUFFIX", "rmu-v2")
+# Poll interval: FINE_TUNE_POLL_MIN doubling up to FINE_TUNE_POLL_MAX seconds, with jitter
+FINE_TUNE_POLL_MIN = float(os.getenv("FINE_TUNE_POLL_MIN", "15"))
+FINE_TUNE_POLL_MAX = float(os.getenv("FINE_TUNE_POLL_MAX", "600"))
+FINE_TUNE_MAX_ERRORS = int(os.getenv("FINE_TUNE_MAX_ERRORS", "8"))
+FINE_TUNE_CONCURRENCY = int(os.getenv("FINE_TUNE_CONCURRENCY", "4"))
+
+TERMINAL = ("succeeded", "failed", "cancelled")
+
+
+def _now_text():
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+# ✅ OpenAI fine-tuning API
+class OpenAIFineTuneAPI:
+    """The calls the orchestrator needs; jobs come back as plain dicts."""
+
+    def upload(self, paths):
+        """Upload one file made of ``paths`` (shards are joined); returns the file ID."""
+        if len(paths) == 1:
+            with open(paths[0], "rb") as f:
+                return openai.File.create(file=f, purpose="fine-tune").id
+        with tempfile.NamedTemporaryFile(suffix=".jsonl") as joined:
+            for path in paths:
+                with open(path, "rb") as shard:
+                    shutil.copyfileobj(shard, joined)
+            joined.flush()
+            joined.seek(0)
+            return openai.File.create(file=joined, purpose="fine-tune").id
+
+    def create(self, training_file, validation_file, model, suffix):
+        return _job(openai.FineTuningJob.create(training_file=training_file, validation_file=validation_file,
+                                                model=model, suffix=suffix))
+
+    def retrieve(self, job_id):
+        return _job(openai.FineTuningJob.retrieve(job_id))
+
+    def cancel(self, job_id):
+        return _job(openai.FineTuningJob.cancel(job_id))
+
+    def find(self, training_file):
+        """The most recent job trained on ``training_file``, if any."""
+        for job in openai.FineTuningJob.list(limit=50).data:
+            if job.get("training_file") == training_file:
+                return _job(job)
+        return None
+
+
+def _job(job):
+    error = job.get("error")
+    return {
+        "id": job["id"],
+        "status": job["status"],
+        "fine_tuned_model": job.get("fine_tuned_model"),
+        "trained_tokens": job.get("trained_tokens"),
+        "error": (error.get("message") if hasattr(error, "get") else str(error)) if error else None,
+    }
+
+
+# ✅ Persisted jobs
+class JobStore:
+    """Jobs by local ID in one JSON file; each change is a locked read-modify-write."""
+
+    def __init__(self, path=FINE_TUNE_STATE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f)["jobs"]
+        except FileNotFoundError:
+            return {}
+
+    def get(self, job_id):
+        return self.load()[job_id]
+
+    def add(self, job):
+        with self._locked() as jobs:
+            jobs[job["id"]] = job
+        return job
+
+    def update(self, job_id, **changes):
+        with self._locked() as jobs:
+            job = jobs[job_id]
+            job.update(changes, updated_at=_now_text())
+        return job
+
+    @contextmanager
+    def _locked(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._lock, open(self.path + ".lock", "a") as lock:
+            if fcntl:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            jobs = self.load()
+            yield jobs
+            tmp = self.path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"jobs": jobs}, f, indent=2)
+            os.replace(tmp, self.path)
+
+
+# ✅ Orchestrator
+class FineTuneOrchestrator:
+    def __init__(self, api=None, store=None, registry=model_registry, clock=time.time, sleep=time.sleep,
+                 rng=random, concurrency=FINE_TUNE_CONCURRENCY):
+        self.api = api or OpenAIFineTuneAPI()
+        self.store = store or JobStore()
+        self.registry = registry
+        self.clock = clock
+        self.sleep = sleep
+        self.rng = rng
+        self.concurrency = concurrency
+
+    def submit(self, training_paths, validation_paths=(), model=FINE_TUNE_BASE_MODEL, suffix=FINE_TUNE_SUFFIX,
+               publish_as=None, manifest=None):
+        """Queue a job; ``run``/``tick`` take it from there. Returns the job record."""
+        return self.store.add({
+            "id": uuid.uuid4().hex[:12],
+            "state": "pending",
+            "training_paths": list(training_paths),
+            "validation_paths": list(validation_paths),
+            "model": model,
+            "suffix": suffix,
+            "publish_as": publish_as,
+            "manifest": manifest,
+            "training_file_id": None,
+            "validation_file_id": None,
+            "remote_id": None,
+            "remote_status": None,
+            "fine_tuned_model": None,
+            "polls": 0,
+            "errors": 0,
+            "error": None,
+            "next_at": 0,
+            "created_at": _now_text(),
+            "updated_at": _now_text(),
+        })
+
+    def cancel(self, job_id):
+        job = self.store.get(job_id)
+        if job["state"] in TERMINAL:
+            return job
+        if job["remote_id"]:
+            self.api.cancel(job["remote_id"])
+        return self.store.update(job_id, state="cancelled")
+
+    def tick(self):
+        """Advance every due job once, concurrently; returns all jobs."""
+        now = self.clock()
+        due = [job for job in self.store.load().values() if job["state"] not in TERMINAL and job["next_at"] <= now]
+        if len(due) == 1 or self.concurrency <= 1:
+            for job in due:
+                self._advance(job)
+        elif due:
+            with ThreadPoolExecutor(max_workers=min(self.concurrency, len(due))) as pool:
+                list(pool.map(self._advance, due))
+        return self.store.load()
+
+    def run(self, until_idle=True, stop=None):
+        """Drive jobs until none is active (or ``stop`` is set); one runner per state file."""
+        with self._runner():
+            while not (stop and stop.is_set()):
+                jobs = self.tick()
+                active = [job for job in jobs.values() if job["state"] not in TERMINAL]
+                if not active and until_idle:
+                    return jobs
+                wait = min(job["next_at"] for job in active) - self.clock() if active else FINE_TUNE_POLL_MIN
+                self.sleep(min(max(wait, 0), FINE_TUNE_POLL_MAX))
+            return self.store.load()
+
+    def _advance(self, job):
+        try:
+            changes = self._step(job)
+            changes.setdefault("errors", 0)
+            changes.setdefault("error", None)
+        except Exception as e:
+            errors = job["errors"] + 1
+            logger.warning("Fine-tune job %s (%s) failed a step: %s", job["id"], job["state"], e)
+            changes = {"errors": errors, "error": f"{type(e).__name__}: {e}",
+                       "next_at": self.clock() + backoff(errors - 1, FINE_TUNE_POLL_MIN, FINE_TUNE_POLL_MAX, self.rng)}
+            if errors >= FINE_TUNE_MAX_ERRORS:
+                changes["state"] = "failed"
+        updated = self.store.update(job["id"], **changes)
+        if updated["state"] != job["state"]:
+            logger.info("Fine-tune job %s: %s -> %s", job["id"], job["state"], updated["state"])
+        return updated
+
+    def _step(self, job):
+        state = job["state"]
+        if state == "pending":
+            if not job["training_file_id"]:
+                job = self.store.update(job["id"], training_file_id=self.api.upload(job["training_paths"]))
+            if job["validation_paths"] and not job["validation_file_id"]:
+                job = self.store.update(job["id"], validation_file_id=self.api.upload(job["validation_paths"]))
+            return {"state": "uploaded", "next_at": 0}
+
+        if state == "creating":
+            # A crash between create and saving its ID: adopt that job rather than pay twice
+            remote = self.api.find(job["training_file_id"])
+            if remote is None:
+                return {"state": "uploaded", "next_at": 0}
+            return self._running(job, remote)
+
+        if state == "uploaded":
+            self.store.update(job["id"], state="creating")
+            remote = self.api.create(job["training_file_id"], job["validation_file_id"], job["model"], job["suffix"])
+            return self._running(job, remote)
+
+        if state == "running":
+            return self._running(job, self.api.retrieve(job["remote_id"]))
+        raise ValueError(f"unknown state {state!r}")
+
+    def _running(self, job, remote):
+        status = remote["status"]
+        changes = {"remote_id": remote["id"], "remote_status": status}
+        if status == "succeeded":
+            model = remote["fine_tuned_model"]
+            if job["publish_as"]:
+                self.registry.publish(job["publish_as"], model, job=job["id"], remote_job=remote["id"],
+                                      base_model=job["model"], trained_tokens=remote.get("trained_tokens"))
+            return dict(changes, state="succeeded", fine_tuned_model=model, finished_at=_now_text())
+        if status in ("failed", "cancelled"):
+            return dict(changes, state=status, error=remote.get("error"), finished_at=_now_text())
+        polls = job["polls"] + 1 if status == job["remote_status"] else 0
+        next_at = self.clock() + backoff(polls, FINE_TUNE_POLL_MIN, FINE_TUNE_POLL_MAX, self.rng)
+        return dict(changes, state="running", polls=polls, next_at=next_at)
+
+    @contextmanager
+    def _runner(self):
+        if not fcntl:
+            yield
+            return
+        directory = os.path.dirname(self.store.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.store.path + ".runner", "a") as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                raise RuntimeError(f"another orchestrator is already running on {self.store.path}")
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def main(argv=None):
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    parser = argparse.ArgumentParser(description="Submit, drive and inspect fine-tune jobs")
+    commands = parser.add_subparsers(dest="command", required=True)
+    submit = commands.add_parser("submit", help="queue a job")
+    submit.add_argument("--compile", action="store_true", help="compile the training set and use its shards")
+    submit.add_argument("--train", nargs="*", default=[], help="training JSONL files (joined into one upload)")
+    submit.add_argument("--validation", nargs="*", default=[])
+    submit.add_argument("--model", default=FINE_TUNE_BASE_MODEL)
+    submit.add_argument("--suffix", default=FINE_TUNE_SUFFIX)
+    submit.add_argument("--publish-as", default=None, help="registry name to publish the model under, e.g. chat")
+    submit.add_argument("--wait", action="store_true", help="run until the job has finished")
+    run = commands.add_parser("run", help="drive queued and running jobs")
+    run.add_argument("--forever", action="store_true", help="keep waiting for new jobs")
+    commands.add_parser("status")
+    cancel = commands.add_parser("cancel")
+    cancel.add_argument("job_id")
+    args = parser.parse_args(argv)
+
+    orchestrator = FineTuneOrchestrator()
+    if args.command == "submit":
+        train, validation, manifest = args.train, args.validation, None
+        if args.compile:
+            from training_set import TRAINING_DIR, compile_training_set, shard_paths
+            compiled = compile_training_set(TRAINING_DIR)
+            train = shard_paths(TRAINING_DIR, "train", compiled)
+            validation = shard_paths(TRAINING_DIR, "validation", compiled)
+            manifest = os.path.join(TRAINING_DIR, "manifest.json")
+        if not train:
+            parser.error("nothing to train on: pass --train or --compile")
+        job = orchestrator.submit(train, validation, args.model, args.suffix, args.publish_as, manifest)
+        print(f"Queued job {job['id']}")
+        if args.wait:
+            orchestrator.run()
+    elif args.command == "run":
+        orchestrator.run(until_idle=not args.forever)
+    elif args.command == "cancel":
+        orchestrator.cancel(args.job_id)
+
+    for job in orchestrator.store.load().values():
+        print(f"{job['id']}  {job['state']:<10} {job['remote_status'] or '-':<18} "
+              f"{job['fine_tuned_model'] or job['error'] or ''}")
+
+
+if __name__ == "__main__":
+    main()
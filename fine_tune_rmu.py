@@ -1,39 +1,32 @@
 import os
-import time
 from dotenv import load_dotenv
 import openai
 
+from fine_tune_jobs import FineTuneOrchestrator
+from training_set import TRAINING_DIR, compile_training_set, shard_paths
+
 load_dotenv()
 openai.api_key = os.getenv("OPENAI_API_KEY")
 
-print("Uploading dataset2.jsonl for fine-tuning…")
-upload_resp = openai.File.create(
-    file=open("dataset2.jsonl", "rb"),
-    purpose="fine-tune"
-)
-file_id = upload_resp.id
-print(f" ➜ Uploaded. File ID = {file_id}")
-
-print("Starting fine-tune job on gpt-3.5-turbo…")
-ft_job = openai.FineTuningJob.create(
-    training_file=file_id,
-    model="gpt-3.5-turbo",
-    suffix="rmu-v2"
-)
-job_id = ft_job.id
-print(f" ➜ Job created. ID = {job_id}")
+# Compile, queue and follow one fine-tune. The job is persisted: if this script stops, resume it
+# with `python fine_tune_jobs.py run`. On success the model is published as "chat" and the chatbot
+# switches to it without a restart.
+print(f"Compiling the training set into {TRAINING_DIR}…")
+manifest = compile_training_set(TRAINING_DIR)
+train, validation = manifest["splits"]["train"], manifest["splits"]["validation"]
+print(f" ➜ {train['examples']} training examples ({train['tokens']} tokens), "
+      f"{validation['examples']} validation examples; dropped {manifest['dropped']}")
+if not train["examples"]:
+    raise SystemExit("No training examples left; nothing to fine-tune.")
 
-print("Polling status every 30 seconds…")
-while True:
-    status_resp = openai.FineTuningJob.retrieve(job_id)
-    status = status_resp.status
-    print(f"    Status: {status}")
-    if status in ("succeeded", "failed"):
-        break
-    time.sleep(30)
+orchestrator = FineTuneOrchestrator()
+job = orchestrator.submit(shard_paths(TRAINING_DIR, "train", manifest),
+                          shard_paths(TRAINING_DIR, "validation", manifest),
+                          publish_as="chat", manifest=os.path.join(TRAINING_DIR, "manifest.json"))
+print(f" ➜ Queued job {job['id']}; uploading and polling with backoff…")
 
-if status == "succeeded":
-    new_model = status_resp.fine_tuned_model
-    print(f"\n🎉 Fine-tune succeeded! New model: {new_model}")
+job = orchestrator.run()[job["id"]]
+if job["state"] == "succeeded":
+    print(f"\n🎉 Fine-tune succeeded! New model: {job['fine_tuned_model']} (published as \"chat\")")
 else:
-    print("\n❌ Fine-tune failed. Check logs in the OpenAI dashboard.")
+    print(f"\n❌ Fine-tune {job['state']}: {job['error']}. Check logs in the OpenAI dashboard.")
@@ -0,0 +1,225 @@
+import os
+import re
+import threading
+from difflib import SequenceMatcher
+
+import numpy as np
+from fuzzywuzzy import fuzz
+from scipy import sparse
+
+from memory_index import memory_index
+from metrics import metrics
+from retrieval import retrieval_engine
+
+# Minimum fuzz.ratio (0-100) for a near-duplicate question to be answered locally
+FUZZY_MATCH_THRESHOLD = int(os.getenv("FUZZY_MATCH_THRESHOLD", "90"))
+# How many n-gram candidates are re-scored with fuzz.ratio
+FUZZY_CANDIDATES = int(os.getenv("FUZZY_CANDIDATES", "5"))
+# Rarest trigrams of a question whose rows are probed by ``closest`` (bulk duplicate checks)
+FUZZY_PROBE_GRAMS = int(os.getenv("FUZZY_PROBE_GRAMS", "8"))
+
+FUZZY_LOOKUPS = metrics.counter(
+    "chatbot_fuzzy_match_lookups_total",
+    "Fuzzy question lookups: hits by source (dataset, memory) and misses (source none).",
+    ("outcome", "source"))
+
+_PUNCT_RE = re.compile(r"[^a-z0-9 ]+")
+_SPACE_RE = re.compile(r"\s+")
+
+
+def normalize(text):
+    text = _PUNCT_RE.sub(" ", (text or "").lower())
+    return _SPACE_RE.sub(" ", text).strip()
+
+
+def key_text(text):
+    """``normalize(text)`` for keying, or the casefolded text when that leaves nothing.
+
+    ``normalize`` keeps only ``[a-z0-9 ]``, so every question in a non-Latin
+    script would otherwise share the empty key.
+    """
+    return normalize(text) or _SPACE_RE.sub(" ", (text or "").casefold()).strip()
+
+
+def char_ngrams(text, n=3):
+    padded = f" {text} "
+    return {padded[i:i + n] for i in range(max(len(padded) - n + 1, 1))}
+
+
+class _GramIndex:
+    """Binary question x character-trigram matrix for one source.
+
+    ``alive`` masks out rows whose pair was removed; ``extended`` adds rows
+    without re-reading the existing ones.
+    """
+
+    def __init__(self, pairs, n=3, alive=None, base=None):
+        self.n = n
+        self.pairs = pairs
+        start = len(base.pairs) if base else 0
+        new = [normalize(q) for q, _ in pairs[start:]]
+        self.normalized = (base.normalized if base else []) + new
+        self.vocab = dict(base.vocab) if base else {}
+        rows, cols = [], []
+        sizes = np.zeros(len(new))
+        for row, text in enumerate(new):
+            grams = char_ngrams(text, n)
+            sizes[row] = len(grams)
+            for gram in grams:
+                rows.append(row)
+                cols.append(self.vocab.setdefault(gram, len(self.vocab)))
+        matrix = sparse.csc_matrix((np.ones(len(rows)), (rows, cols)), shape=(len(new), len(self.vocab)))
+        if base:
+            old = base.matrix.copy()
+            old.resize((old.shape[0], len(self.vocab)))
+            matrix = sparse.vstack([old, matrix], format="csc")
+            sizes = np.concatenate((base.sizes, sizes))
+        self.sizes = sizes
+        self.matrix = matrix
+        self.alive = alive
+
+    def extended(self, pairs, alive=None):
+        """Index over ``pairs``, which must start with this index's pairs."""
+        if len(pairs) == len(self.pairs):
+            index = _GramIndex.__new__(_GramIndex)
+            index.__dict__.update(self.__dict__, pairs=pairs, alive=alive)
+            return index
+        return _GramIndex(pairs, self.n, alive, base=self)
+
+    def candidates(self, grams, k):
+        cols = [self.vocab[g] for g in grams if g in self.vocab]
+        if not cols or not self.pairs:
+            return []
+        shared = np.asarray(self.matrix[:, cols].sum(axis=1)).ravel()
+        dice = 2 * shared / (self.sizes + len(grams))
+        if self.alive is not None:
+            dice = dice * self.alive
+        k = min(k, len(dice))
+        top = np.argpartition(-dice, k - 1)[:k]
+        return [i for i in top if dice[i] > 0]
+
+    def probe(self, grams, k, probe=FUZZY_PROBE_GRAMS):
+        """Rows sharing the most of the query's ``probe`` rarest trigrams.
+
+        Only those trigrams' postings are read, so a lookup costs the same
+        however many rows share the query's common trigrams.
+        """
+        cols = np.array([self.vocab[g] for g in grams if g in self.vocab], dtype=np.int64)
+        if not len(cols):
+            return []
+        indptr, indices = self.matrix.indptr, self.matrix.indices
+        rare = cols[np.argsort(indptr[cols + 1] - indptr[cols], kind="stable")[:probe]]
+        rows = np.concatenate([indices[indptr[c]:indptr[c + 1]] for c in rare])
+        if self.alive is not None:
+            rows = rows[self.alive[rows]]
+        if not len(rows):
+            return []
+        found, shared = np.unique(rows, return_counts=True)
+        return found[np.argsort(-shared, kind="stable")[:k]].tolist()
+
+
+class FuzzyMatcher:
+    """Near-duplicate question matcher over the Q&A dataset and memory corrections.
+
+    Character-trigram overlap (one sparse mat-vec per source) narrows each
+    lookup to a handful of candidates, which are then re-scored with
+    ``fuzz.ratio``. Each source is re-indexed only when it changes.
+    """
+
+    def __init__(self, threshold=FUZZY_MATCH_THRESHOLD, candidates=FUZZY_CANDIDATES):
+        self.threshold = threshold
+        self.candidates = candidates
+        self._lock = threading.Lock()
+        self._dataset = _GramIndex([])
+        self._dataset_generation = None
+        self._memory = _GramIndex([])
+        self._memory_version = None
+        self.hits = 0
+        self.misses = 0
+        self.hits_by_source = {"dataset": 0, "memory": 0}
+        self.score_buckets = [0] * 11   # best score per lookup, in steps of 10
+
+    def _refresh(self):
+        retrieval_engine.refresh_if_changed()
+        generation, pairs, alive = retrieval_engine.dataset_view()
+        if generation != self._dataset_generation:
+            self._dataset = _GramIndex(pairs, alive=alive)
+            self._dataset_generation = generation
+        elif pairs is not self._dataset.pairs:
+            # Same generation: the engine only appended rows or switched some off
+            self._dataset = self._dataset.extended(pairs, alive)
+        if memory_index.version != self._memory_version:
+            self._memory = _GramIndex(memory_index.items())
+            self._memory_version = memory_index.version
+
+    def match(self, text):
+        """Return ``(answer, score, source)`` for the best match above the threshold, else None."""
+        with self._lock:
+            self._refresh()
+            dataset, memory = self._dataset, self._memory
+        query = normalize(text)
+        if not query:
+            return None
+        grams = char_ngrams(query)
+
+        best = (None, 0, None)
+        for source, index in (("memory", memory), ("dataset", dataset)):
+            for i in index.candidates(grams, self.candidates):
+                score = fuzz.ratio(query, index.normalized[i])
+                if score > best[1]:
+                    best = (index.pairs[i][1], score, source)
+
+        answer, score, source = best
+        hit = answer is not None and score >= self.threshold
+        with self._lock:
+            self.score_buckets[score // 10] += 1
+            if hit:
+                self.hits += 1
+                self.hits_by_source[source] += 1
+            else:
+                self.misses += 1
+        FUZZY_LOOKUPS.inc("hit" if hit else "miss", source if hit else "none")
+        return best if hit else None
+
+    def closest(self, texts, min_score=0, k=10):
+        """Nearest dataset pair scoring at least ``min_score`` for each text, as ``(pair, score)``.
+
+        ``(None, 0)`` when nothing is that close. For bulk duplicate checks:
+        probes rare trigrams only, skips candidates whose cheap upper bounds
+        (length, character overlap) already rule them out, and leaves the hit
+        counters alone.
+        """
+        with self._lock:
+            self._refresh()
+            dataset = self._dataset
+        floor = (min_score - 0.5) / 100   # fuzz.ratio rounds to the nearest integer
+        results = []
+        for text in texts:
+            query = normalize(text)
+            best = (None, 0)
+            for i in dataset.probe(char_ngrams(query), k) if query else []:
+                candidate = dataset.normalized[i]
+                if 2 * min(len(query), len(candidate)) < floor * (len(query) + len(candidate)):
+                    continue
+                if floor > 0 and SequenceMatcher(None, query, candidate).quick_ratio() < floor:
+                    continue
+                score = fuzz.ratio(query, candidate)
+                if score > best[1] and score >= min_score:
+                    best = (dataset.pairs[i], score)
+            results.append(best)
+        return results
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "threshold": self.threshold,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / total, 3) if total else 0,
+                "hits_by_source": dict(self.hits_by_source),
+                "score_buckets": list(self.score_buckets),
+            }
+
+
+fuzzy_matcher = FuzzyMatcher()
@@ -0,0 +1,309 @@
+"""Ingest pipeline for uploaded training files.
+
+An upload is streamed through four phases, each recorded in a JSON report
+next to the file (``<upload>.report``) that the admin page polls:
+
+1. **parse** -- JSONL files are split into newline-aligned byte ranges that
+   worker processes parse in parallel. Every line is validated against the
+   chat ``messages`` schema, normalized (NFC, trimmed, unknown keys dropped)
+   and hashed on its normalized question and answer.
+2. **dedupe** -- exact duplicates (same hash) within the file or already in
+   the dataset are dropped, then near duplicates: questions whose
+   ``fuzz.ratio`` against an existing dataset question reaches
+   ``INGEST_NEAR_DUP_THRESHOLD``.
+3. **merge** -- the remaining rows are appended to the dataset in one
+   all-or-nothing write (``QAStore.extend``).
+4. **index** -- retrieval and fuzzy-match indexes pick up just the new rows.
+"""
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import threading
+import time
+import unicodedata
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+
+from chat_pipeline import run_background
+from fuzzy_match import fuzzy_matcher, key_text
+from qa_store import dataset_store
+from retrieval import qa_pair_from_messages, retrieval_engine
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_DIR = "uploads"
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", str(min(4, os.cpu_count() or 1))))
+INGEST_CHUNK_BYTES = int(os.getenv("INGEST_CHUNK_BYTES", str(4 * 1024 * 1024)))
+# fuzz.ratio (0-100) between normalized questions at which an upload row counts as a near duplicate
+INGEST_NEAR_DUP_THRESHOLD = int(os.getenv("INGEST_NEAR_DUP_THRESHOLD", "95"))
+# Example rows kept in the report per kind (invalid lines, near duplicates)
+INGEST_REPORT_EXAMPLES = int(os.getenv("INGEST_REPORT_EXAMPLES", "50"))
+
+ROLES = ("system", "user", "assistant")
+
+# Never fork the server itself: ingest runs next to request threads holding locks (DB pool, metrics,
+# logging) that a forked child would inherit held. A fork server forks workers from a clean,
+# single-threaded process with this module preloaded; spawn where that is not available.
+if "forkserver" in multiprocessing.get_all_start_methods():
+    _MP_CONTEXT = multiprocessing.get_context("forkserver")
+    _MP_CONTEXT.set_forkserver_preload([__name__])
+else:
+    _MP_CONTEXT = multiprocessing.get_context("spawn")
+_ingest_lock = threading.Lock()   # one ingest at a time per process: dedupe must see earlier merges
+
+
+# ✅ Validation and normalization
+def clean_record(item):
+    """``(messages, None)`` for a valid chat record, else ``(None, reason)``."""
+    if not isinstance(item, dict) or not isinstance(item.get("messages"), list) or not item["messages"]:
+        return None, 'missing "messages" list'
+    messages = []
+    for message in item["messages"]:
+        if not isinstance(message, dict):
+            return None, "message is not an object"
+        role, content = message.get("role"), message.get("content")
+        if role not in ROLES:
+            return None, "unknown role"
+        if not isinstance(content, str):
+            return None, "content is not text"
+        content = unicodedata.normalize("NFC", content).replace("\r\n", "\n").strip()
+        if not content:
+            return None, "empty content"
+        messages.append({"role": role, "content": content})
+    if qa_pair_from_messages(messages) is None:
+        return None, "needs a user and an assistant message"
+    return messages, None
+
+
+def pair_key(question, answer):
+    """Hash of the normalized pair: equal for rows that differ only in case, punctuation or spacing."""
+    text = key_text(question) + "\x1f" + key_text(answer)
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def _new_result():
+    return {"lines": 0, "records": [], "errors": [], "invalid": {}}
+
+
+def _check(result, number, item):
+    messages, reason = clean_record(item)
+    if reason:
+        _reject(result, number, reason)
+        return
+    question, answer = qa_pair_from_messages(messages)
+    result["records"].append((number, messages, pair_key(question, answer), question))
+
+
+def _reject(result, number, reason):
+    result["invalid"][reason] = result["invalid"].get(reason, 0) + 1
+    if len(result["errors"]) < INGEST_REPORT_EXAMPLES:
+        result["errors"].append((number, reason))
+
+
+def parse_chunk(path, start, end):
+    """Validate the lines in ``path[start:end]``; line numbers are relative to the chunk."""
+    with open(path, "rb") as f:
+        f.seek(start)
+        data = f.read(end - start)
+    lines = data.split(b"\n")
+    if data.endswith(b"\n"):
+        lines.pop()
+    result = _new_result()
+    result["lines"] = len(lines)
+    for number, raw in enumerate(lines, start=1):
+        if not raw.strip():
+            continue
+        try:
+            item = json.loads(raw)
+        except (ValueError, UnicodeDecodeError):
+            _reject(result, number, "invalid JSON")
+            continue
+        _check(result, number, item)
+    return result
+
+
+def chunk_ranges(path, chunk_bytes=INGEST_CHUNK_BYTES):
+    """``(start, end)`` byte ranges of about ``chunk_bytes`` that end on a line break."""
+    size = os.path.getsize(path)
+    ranges, start = [], 0
+    with open(path, "rb") as f:
+        while start < size:
+            f.seek(min(start + chunk_bytes, size))
+            f.readline()
+            end = min(f.tell(), size)
+            ranges.append((start, end))
+            start = end
+    return ranges
+
+
+# ✅ Reports
+def report_path(path):
+    return path + ".report"
+
+
+def read_report(path):
+    try:
+        with open(report_path(path), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+class IngestReport:
+    """The per-file report, rewritten atomically at most every ``interval`` seconds."""
+
+    def __init__(self, path, interval=0.5):
+        self.path = report_path(path)
+        self.interval = interval
+        self._written = 0.0
+        self.data = {
+            "file": os.path.basename(path),
+            "status": "queued",
+            "phase": None,
+            "progress": 0.0,
+            "queued_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "bytes": os.path.getsize(path),
+            "lines": 0,
+            "valid": 0,
+            "added": 0,
+            "duplicates": {"in_file": 0, "in_dataset": 0, "near_dataset": 0},
+            "invalid": {},
+            "errors": [],
+            "near": [],
+            "timings_ms": {},
+        }
+
+    def update(self, force=False, **fields):
+        self.data.update(fields)
+        now = time.monotonic()
+        if force or now - self._written >= self.interval:
+            self._written = now
+            tmp = self.path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(self.data, f, ensure_ascii=False)
+            os.replace(tmp, self.path)
+
+    def phase(self, name):
+        self.data["timings_ms"][name] = 0
+        self.update(force=True, phase=name, progress=0.0)
+        return time.perf_counter()
+
+    def phase_done(self, name, started):
+        self.data["timings_ms"][name] = round((time.perf_counter() - started) * 1000, 1)
+
+
+# ✅ Pipeline
+def start_ingest(path):
+    """Queue ``path`` for ingest in the background; returns the initial report."""
+    report = IngestReport(path)
+    report.update(force=True)
+    run_background(ingest_file, path, report)
+    return report.data
+
+
+def ingest_file(path, report=None, store=dataset_store, engine=retrieval_engine, matcher=fuzzy_matcher):
+    """Run every phase for one uploaded file; returns the final report."""
+    report = report or IngestReport(path)
+    with _ingest_lock:
+        report.update(force=True, status="running",
+                      started_at=datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+        try:
+            records = _parse(path, report)
+            rows = _dedupe(records, report, engine, matcher)
+
+            started = report.phase("merge")
+            ids = store.extend(rows)
+            report.phase_done("merge", started)
+
+            started = report.phase("index")
+            engine.refresh_if_changed()
+            report.phase_done("index", started)
+
+            report.update(force=True, status="done", phase=None, progress=1.0, added=len(ids),
+                          first_id=ids[0] if ids else None, last_id=ids[-1] if ids else None,
+                          finished_at=datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+        except Exception as e:
+            logger.exception("Ingest of %s failed", path)
+            report.update(force=True, status="failed", error=str(e),
+                          finished_at=datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+    return report.data
+
+
+def _parse(path, report):
+    """Validated records of the whole file, in file order, as ``(line, messages, key, question)``."""
+    started = report.phase("parse")
+    if path.endswith(".json"):
+        # A JSON document (array of records or one record) has to be read whole
+        with open(path, "r", encoding="utf-8") as f:
+            document = json.load(f)
+        items = document if isinstance(document, list) else [document]
+        result = _new_result()
+        result["lines"] = len(items)
+        for number, item in enumerate(items, start=1):
+            _check(result, number, item)
+        results = [result]
+    else:
+        ranges = chunk_ranges(path)
+        results = [None] * len(ranges)
+        done_bytes = 0
+        if len(ranges) > 1 and INGEST_WORKERS > 1:
+            with ProcessPoolExecutor(max_workers=min(INGEST_WORKERS, len(ranges)), mp_context=_MP_CONTEXT) as pool:
+                futures = {pool.submit(parse_chunk, path, start, end): i for i, (start, end) in enumerate(ranges)}
+                for future in as_completed(futures):
+                    i = futures[future]
+                    results[i] = future.result()
+                    done_bytes += ranges[i][1] - ranges[i][0]
+                    report.update(progress=done_bytes / (report.data["bytes"] or 1))
+        else:
+            for i, (start, end) in enumerate(ranges):
+                results[i] = parse_chunk(path, start, end)
+                done_bytes += end - start
+                report.update(progress=done_bytes / (report.data["bytes"] or 1))
+
+    # Chunk-relative line numbers -> file line numbers
+    records, errors, invalid, offset = [], [], {}, 0
+    for result in results:
+        records.extend((offset + n, messages, key, question) for n, messages, key, question in result["records"])
+        errors.extend({"line": offset + n, "reason": reason} for n, reason in result["errors"])
+        for reason, count in result["invalid"].items():
+            invalid[reason] = invalid.get(reason, 0) + count
+        offset += result["lines"]
+    report.phase_done("parse", started)
+    report.update(force=True, lines=offset, valid=len(records), invalid=invalid,
+                  errors=sorted(errors, key=lambda e: e["line"])[:INGEST_REPORT_EXAMPLES])
+    return records
+
+
+def _dedupe(records, report, engine, matcher, batch=500):
+    """The records' messages that are neither exact nor near duplicates."""
+    started = report.phase("dedupe")
+    engine.refresh_if_changed()
+    in_dataset = {pair_key(question, answer) for question, answer in engine.live_pairs()}
+    duplicates = report.data["duplicates"]
+    seen, fresh = set(), []
+    for record in records:
+        key = record[2]
+        if key in seen:
+            duplicates["in_file"] += 1
+        elif key in in_dataset:
+            duplicates["in_dataset"] += 1
+        else:
+            fresh.append(record)
+        seen.add(key)
+
+    rows, near = [], report.data["near"]
+    for start in range(0, len(fresh), batch):
+        part = fresh[start:start + batch]
+        for (number, messages, _, question), (pair, score) in zip(part, matcher.closest([r[3] for r in part], INGEST_NEAR_DUP_THRESHOLD)):
+            if pair is not None and score >= INGEST_NEAR_DUP_THRESHOLD:
+                duplicates["near_dataset"] += 1
+                if len(near) < INGEST_REPORT_EXAMPLES:
+                    near.append({"line": number, "question": question, "matched": pair[0], "score": score})
+            else:
+                rows.append(messages)
+        report.update(progress=min(start + batch, len(fresh)) / len(fresh))
+    report.phase_done("dedupe", started)
+    report.update(force=True, duplicates=duplicates, near=near)
+    return rows
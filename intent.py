@@ -0,0 +1,260 @@
+"""Local intent classifier used by app.detect_intent.
+
+Hashed word/character n-grams feed a softmax (multinomial logistic) model
+trained with NumPy, so classifying a message takes microseconds instead of a
+gpt-3.5-turbo round trip. Labels can be bootstrapped from the Q&A dataset
+with keyword rules (or with the LLM classifier) and edited by hand.
+
+    python intent.py bootstrap [--use-llm]   # write INTENT_LABELS_PATH from the dataset files
+    python intent.py train                   # fit and save INTENT_MODEL_PATH
+    python intent.py classify < messages.txt # batch predictions as JSONL
+
+app.py loads the model at import. Without a saved model it trains one
+(a couple of seconds) and saves it, so later workers and restarts only load.
+"""
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import zlib
+
+import numpy as np
+from scipy import sparse
+
+from retrieval import DATASET_PATH, load_qa_pairs
+
+logger = logging.getLogger(__name__)
+
+ALLOWED_INTENTS = [
+    "admission_info", "program_info", "fees", "hostel_info", "contact",
+    "general_query", "application_deadline", "course_structure",
+    "location", "scholarship", "registration_help", "unknown"
+]
+
+INTENT_LABELS_PATH = os.getenv("INTENT_LABELS_PATH", "data/intent_labels.jsonl")
+INTENT_MODEL_PATH = os.getenv("INTENT_MODEL_PATH", "data/intent_model.npz")
+N_FEATURES = 2 ** 16
+
+# Same examples the LLM prompt uses, so the local model agrees on the obvious cases
+SEED_EXAMPLES = [
+    ("What are the admission requirements?", "admission_info"),
+    ("Tell me about the Nautical Science program.", "program_info"),
+    ("How much is the tuition?", "fees"),
+    ("Do you offer accommodation?", "hostel_info"),
+    ("Where is the school located?", "location"),
+    ("What are the deadlines for applying?", "application_deadline"),
+    ("Do you offer any scholarships?", "scholarship"),
+    ("Can you help me register my courses?", "registration_help"),
+    ("Hello", "general_query"),
+    ("I want to speak to someone", "contact"),
+]
+
+# Keyword rules for bootstrapping labels, checked in order (most specific first)
+BOOTSTRAP_RULES = [
+    ("scholarship", r"scholarship|bursar|financial aid|sponsorship|grant"),
+    ("application_deadline", r"deadline|closing date|last day|when (do|does|will|can) .*(appl|admission)|applications? (close|open)"),
+    ("registration_help", r"regist|enrol|portal|sign up for courses"),
+    ("hostel_info", r"hostel|accommodation|hall of residence|residence|room"),
+    ("fees", r"fee|tuition|cost|pay|price|cedi|dollar|momo|charge"),
+    ("course_structure", r"semester|year [1-4]|level [1-4]00|curriculum|credit|modules?|courses (do|will) i"),
+    ("admission_info", r"admission|admitted|entry requirement|requirement|qualif|wassce|apply|application"),
+    ("location", r"where is|located|location|address|direction|how do i get to"),
+    ("contact", r"contact|phone|telephone|e-?mail|call|speak to|reach"),
+    ("program_info", r"program|programme|degree|bsc|b\.sc|msc|m\.sc|diploma|certificate|department|faculty|course"),
+    ("general_query", r"^(hello|hi|hey|good (morning|afternoon|evening))\b|thank|who are you|how are you|what can you do"),
+]
+_COMPILED_RULES = [(label, re.compile(rf"\b(?:{pattern})", re.IGNORECASE)) for label, pattern in BOOTSTRAP_RULES]
+_WORD_RE = re.compile(r"[a-z0-9]+")
+
+
+def rule_label(text):
+    for label, pattern in _COMPILED_RULES:
+        if pattern.search(text):
+            return label
+    return None
+
+
+def _features(text):
+    """Hashed word uni/bigrams and character trigrams, L2-normalised."""
+    text = (text or "").lower()
+    words = _WORD_RE.findall(text)
+    grams = [f"w:{w}" for w in words]
+    grams += [f"b:{a} {b}" for a, b in zip(words, words[1:])]
+    padded = f" {' '.join(words)} "
+    grams += [f"c:{padded[i:i + 3]}" for i in range(len(padded) - 2)]
+    counts = {}
+    for gram in grams:
+        idx = zlib.crc32(gram.encode("utf-8")) % N_FEATURES
+        counts[idx] = counts.get(idx, 0) + 1
+    idx = np.fromiter(counts.keys(), dtype=np.int64, count=len(counts))
+    val = np.fromiter(counts.values(), dtype=np.float32, count=len(counts))
+    if len(val):
+        val /= np.linalg.norm(val)
+    return idx, val
+
+
+def vectorize(texts):
+    indptr, indices, data = [0], [], []
+    for text in texts:
+        idx, val = _features(text)
+        indices.append(idx)
+        data.append(val)
+        indptr.append(indptr[-1] + len(idx))
+    return sparse.csr_matrix(
+        (np.concatenate(data) if data else np.zeros(0, np.float32),
+         np.concatenate(indices) if indices else np.zeros(0, np.int64),
+         np.array(indptr)),
+        shape=(len(texts), N_FEATURES),
+    )
+
+
+class IntentClassifier:
+    def __init__(self, labels, weights, bias):
+        self.labels = list(labels)
+        self.weights = weights      # (N_FEATURES, n_labels)
+        self.bias = bias            # (n_labels,)
+
+    @classmethod
+    def train(cls, texts, labels, epochs=300, lr=20.0, l2=1e-4):
+        classes = sorted(set(labels))
+        y = np.array([classes.index(label) for label in labels])
+        X = vectorize(texts)
+        Y = np.eye(len(classes), dtype=np.float32)[y]
+        W = np.zeros((N_FEATURES, len(classes)), dtype=np.float32)
+        b = np.zeros(len(classes), dtype=np.float32)
+        n = X.shape[0]
+        for _ in range(epochs):
+            probs = _softmax(X @ W + b)
+            grad = probs - Y
+            W -= lr * ((X.T @ grad) / n + l2 * W)
+            b -= lr * grad.mean(axis=0)
+        return cls(classes, W, b)
+
+    def predict(self, text):
+        """Return ``(label, confidence)`` for one message."""
+        idx, val = _features(text)
+        scores = val @ self.weights[idx] + self.bias
+        probs = _softmax(scores[None, :])[0]
+        best = int(probs.argmax())
+        return self.labels[best], float(probs[best])
+
+    def predict_batch(self, texts):
+        """Vectorised prediction for backfills; returns a list of ``(label, confidence)``."""
+        if not texts:
+            return []
+        probs = _softmax(vectorize(texts) @ self.weights + self.bias)
+        best = probs.argmax(axis=1)
+        return [(self.labels[i], float(p[i])) for i, p in zip(best, probs)]
+
+    def save(self, path=INTENT_MODEL_PATH):
+        # Only the rows that were ever touched by a feature are stored
+        rows = np.flatnonzero(np.abs(self.weights).sum(axis=1))
+        # Written aside and swapped in, so a worker loading it never reads half a file
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            np.savez_compressed(f, labels=np.array(self.labels), rows=rows,
+                                weights=self.weights[rows], bias=self.bias)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path=INTENT_MODEL_PATH):
+        data = np.load(path)
+        weights = np.zeros((N_FEATURES, len(data["labels"])), dtype=np.float32)
+        weights[data["rows"]] = data["weights"]
+        return cls([str(label) for label in data["labels"]], weights, data["bias"])
+
+
+def _softmax(scores):
+    scores = scores - scores.max(axis=1, keepdims=True)
+    exp = np.exp(scores)
+    return exp / exp.sum(axis=1, keepdims=True)
+
+
+# ✅ Labels
+def bootstrap_labels(paths, labeler=rule_label):
+    """Label every user question in ``paths``; questions no rule covers are skipped."""
+    examples = list(SEED_EXAMPLES)
+    seen = {text for text, _ in examples}
+    for path in paths:
+        if not os.path.exists(path):
+            continue
+        for question, _ in load_qa_pairs(path):
+            if question in seen:
+                continue
+            seen.add(question)
+            label = labeler(question)
+            if label and label != "unknown":
+                examples.append((question, label))
+    return examples
+
+
+def read_labels(path=INTENT_LABELS_PATH):
+    with open(path, "r", encoding="utf-8") as f:
+        rows = [json.loads(line) for line in f if line.strip()]
+    return [(row["text"], row["intent"]) for row in rows if row.get("intent") in ALLOWED_INTENTS]
+
+
+def write_labels(examples, path=INTENT_LABELS_PATH):
+    with open(path, "w", encoding="utf-8") as f:
+        for text, label in examples:
+            f.write(json.dumps({"text": text, "intent": label}) + "\n")
+
+
+def default_label_sources():
+    uploads = [os.path.join("uploads", f) for f in sorted(os.listdir("uploads"))] if os.path.isdir("uploads") else []
+    return [DATASET_PATH] + [p for p in uploads if p.endswith(".jsonl")]
+
+
+# ✅ Shared model
+_model = None
+_model_lock = threading.Lock()
+
+
+def get_classifier():
+    """Load the saved model, or train one from the labels file / bootstrap rules and save it."""
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                if os.path.exists(INTENT_MODEL_PATH):
+                    _model = IntentClassifier.load(INTENT_MODEL_PATH)
+                else:
+                    examples = read_labels() if os.path.exists(INTENT_LABELS_PATH) \
+                        else bootstrap_labels(default_label_sources())
+                    _model = IntentClassifier.train(*zip(*examples))
+                    try:
+                        _model.save(INTENT_MODEL_PATH)
+                    except OSError:
+                        logger.exception("Could not save the intent model to %s", INTENT_MODEL_PATH)
+    return _model
+
+
+def main(argv):
+    command = argv[1] if len(argv) > 1 else ""
+    if command == "bootstrap":
+        labeler = rule_label
+        if "--use-llm" in argv:
+            from app import detect_intent_llm
+            labeler = detect_intent_llm
+        examples = bootstrap_labels(default_label_sources(), labeler)
+        write_labels(examples)
+        print(f"Wrote {len(examples)} labelled examples to {INTENT_LABELS_PATH}")
+    elif command == "train":
+        examples = read_labels() if os.path.exists(INTENT_LABELS_PATH) else bootstrap_labels(default_label_sources())
+        model = IntentClassifier.train(*zip(*examples))
+        model.save(INTENT_MODEL_PATH)
+        print(f"Trained on {len(examples)} examples, saved to {INTENT_MODEL_PATH}")
+    elif command == "classify":
+        texts = [line.rstrip("\n") for line in sys.stdin if line.strip()]
+        for text, (label, confidence) in zip(texts, get_classifier().predict_batch(texts)):
+            print(json.dumps({"text": text, "intent": label, "confidence": round(confidence, 4)}))
+    else:
+        print(__doc__)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
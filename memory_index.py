@@ -0,0 +1,306 @@
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+from db import db_connection
+
+logger = logging.getLogger(__name__)
+
+# How often (seconds) a worker checks the shared version counter before a lookup
+VERSION_CHECK_INTERVAL = float(os.getenv("MEMORY_INDEX_CHECK_INTERVAL", "2"))
+VERSION_KEY = "memory_corrections"
+
+
+class _Node:
+    __slots__ = ("children", "fail", "out", "dict_link")
+
+    def __init__(self):
+        self.children = {}
+        self.fail = None
+        self.out = None         # ids of questions ending exactly at this node (most nodes have none)
+        self.dict_link = None   # nearest node on the fail chain with output
+
+
+class _Automaton:
+    """Aho-Corasick automaton over a fixed ``{id: key}`` snapshot; never changed once built."""
+
+    def __init__(self, keys):
+        self.keys = keys
+        self.root = root = _Node()
+        for entry_id, key in keys.items():
+            node = root
+            for ch in key:
+                child = node.children.get(ch)
+                if child is None:
+                    child = node.children[ch] = _Node()
+                node = child
+            if node.out is None:
+                node.out = []
+            node.out.append(entry_id)
+
+        queue = deque()
+        for child in root.children.values():
+            child.fail = root
+            queue.append(child)
+        while queue:
+            node = queue.popleft()
+            for ch, child in node.children.items():
+                fail = node.fail
+                while fail is not None and ch not in fail.children:
+                    fail = fail.fail
+                child.fail = fail.children[ch] if fail is not None else root
+                child.dict_link = child.fail if child.fail.out else child.fail.dict_link
+                queue.append(child)
+
+    def find_all(self, key):
+        root = self.root
+        node = root
+        found = set()
+        for ch in key:
+            while node is not root and ch not in node.children:
+                node = node.fail
+            node = node.children.get(ch, root)
+            hit = node if node.out else node.dict_link
+            while hit is not None:
+                found.update(hit.out)
+                hit = hit.dict_link
+        return found
+
+
+class MemoryIndex:
+    """Aho-Corasick automaton over all corrected questions.
+
+    A single pass over the (lower-cased) user input finds every stored
+    question it contains, which replaces the reverse ``LIKE`` scan on
+    ``memory_corrections``. The automaton is immutable: inserts land in a
+    small pending set that lookups scan directly, and a background thread
+    builds a new automaton from a snapshot and swaps it in. Lookups never
+    wait for a build, however large the table.
+    """
+
+    def __init__(self, background=True):
+        self._lock = threading.RLock()
+        self._background = background
+        self._entries = {}      # id -> (question, answer)
+        self._keys = {}         # id -> normalized question
+        self._automaton = _Automaton({})
+        self._pending = {}      # id -> key, not in the automaton yet
+        self._building = False
+        self._reloading = False
+        self.version = None
+        self._last_check = 0.0
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def items(self):
+        """Snapshot of stored ``(question, answer)`` pairs."""
+        with self._lock:
+            return list(self._entries.values())
+
+    def _after_fork(self):
+        # Build and reload threads are not copied into a forked worker
+        self._lock = threading.RLock()
+        self._building = self._reloading = False
+        self._schedule_build()
+
+    # ✅ Mutations
+    def add(self, entry_id, question, answer):
+        key = _normalize(question)
+        with self._lock:
+            self._pop(entry_id)
+            if not key:
+                return
+            self._entries[entry_id] = (question, answer)
+            self._keys[entry_id] = key
+            self._pending[entry_id] = key
+            self._schedule_build()
+
+    def update(self, entry_id, question, answer):
+        self.add(entry_id, question, answer)
+
+    def remove(self, entry_id):
+        with self._lock:
+            self._pop(entry_id)
+
+    def _pop(self, entry_id):
+        # The automaton may still hold the id; lookups drop ids whose key no longer matches
+        self._entries.pop(entry_id, None)
+        self._keys.pop(entry_id, None)
+        self._pending.pop(entry_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._keys.clear()
+            self._pending.clear()
+            self._automaton = _Automaton({})
+
+    def _schedule_build(self):
+        if self._building or not self._pending:
+            return
+        if not self._background:
+            self._build()
+            return
+        self._building = True
+        threading.Thread(target=self._build_loop, name="memory-index-build", daemon=True).start()
+
+    def _build_loop(self):
+        try:
+            while self._build():
+                pass
+        finally:
+            with self._lock:
+                self._building = False
+                self._schedule_build()   # anything added after the last pass
+
+    def _build(self):
+        """One build from a snapshot, off the lock; True if more changes arrived meanwhile."""
+        with self._lock:
+            keys = dict(self._keys)
+        automaton = _Automaton(keys)
+        with self._lock:
+            self._automaton = automaton
+            for entry_id, key in list(self._pending.items()):
+                if keys.get(entry_id) == key:
+                    del self._pending[entry_id]
+            return bool(self._pending) and self._background
+
+    # ✅ Lookup
+    def find_all(self, text):
+        """Return ids of every stored question contained in ``text``."""
+        key = _normalize(text)
+        with self._lock:
+            automaton = self._automaton
+        candidates = automaton.find_all(key)
+        with self._lock:
+            found = {i for i in candidates if self._keys.get(i) == automaton.keys[i]}
+            found.update(i for i, question in self._pending.items() if question in key)
+            return found
+
+    def best_match(self, text):
+        """Return the answer for the longest stored question found in ``text``."""
+        ids = self.find_all(text)
+        if not ids:
+            return None
+        with self._lock:
+            best = min(
+                (i for i in ids if i in self._entries),
+                key=lambda i: (-len(self._entries[i][0]), i),
+                default=None,
+            )
+            return self._entries[best][1] if best is not None else None
+
+    # ✅ Shared version (keeps several workers consistent)
+    def load(self, rows, version):
+        """Replace the contents with ``rows``; the automaton is built before the swap, off the lock."""
+        entries, keys = {}, {}
+        for row in rows:
+            key = _normalize(row["corrected_question"])
+            if key:
+                entries[row["id"]] = (row["corrected_question"], row["corrected_answer"])
+                keys[row["id"]] = key
+        automaton = _Automaton(keys)
+        with self._lock:
+            self._entries, self._keys, self._pending = entries, dict(keys), {}
+            self._automaton = automaton
+            self.version = version
+            self._last_check = time.monotonic()
+
+    def refresh_if_stale(self):
+        """Reload when another worker changed the table.
+
+        The version check is one indexed read. The first load happens inline;
+        later reloads run in the background, one at a time, while lookups
+        keep answering from the current contents.
+        """
+        now = time.monotonic()
+        if self.version is not None and (self._reloading or now - self._last_check < VERSION_CHECK_INTERVAL):
+            return
+        self._last_check = now
+        with db_connection() as conn:
+            cursor = conn.cursor(dictionary=True)
+            current = _read_version(cursor)
+            if current != self.version and (self.version is None or not self._background):
+                self._read_rows(cursor, current)
+                current = self.version
+            cursor.close()
+        if current == self.version:
+            return
+        with self._lock:
+            if self._reloading:
+                return
+            self._reloading = True
+        threading.Thread(target=self._reload, args=(current,), name="memory-index-reload", daemon=True).start()
+
+    def _reload(self, version):
+        try:
+            with db_connection() as conn:
+                cursor = conn.cursor(dictionary=True)
+                self._read_rows(cursor, version)
+                cursor.close()
+        except Exception:
+            logger.exception("Memory index reload failed; keeping the current contents")
+        finally:
+            self._reloading = False
+
+    def _read_rows(self, cursor, version):
+        cursor.execute("SELECT id, corrected_question, corrected_answer FROM memory_corrections")
+        self.load(cursor.fetchall(), version)
+
+
+def _normalize(text):
+    return (text or "").lower()
+
+
+def _read_version(cursor):
+    cursor.execute("SELECT version FROM cache_versions WHERE name = %s", (VERSION_KEY,))
+    row = cursor.fetchone()
+    return row["version"] if row else 0
+
+
+def bump_version(cursor):
+    """Increment the shared version; call inside the transaction that changes the table."""
+    cursor.execute(
+        "INSERT INTO cache_versions (name, version) VALUES (%s, 1) "
+        "ON DUPLICATE KEY UPDATE version = version + 1",
+        (VERSION_KEY,)
+    )
+
+
+memory_index = MemoryIndex()
+
+
+# Helpers used by the write paths in app.py / chatbot.py. Each bumps the version inside the
+# caller's transaction and returns the matching in-memory change, to be called after commit:
+#
+#     apply = on_memory_added(cursor, cursor.lastrowid, question, answer)
+#     conn.commit()
+#     apply()
+def on_memory_added(cursor, entry_id, question, answer):
+    bump_version(cursor)
+    return _local_change(lambda: memory_index.add(entry_id, question, answer))
+
+
+def on_memory_updated(cursor, entry_id, question, answer):
+    bump_version(cursor)
+    return _local_change(lambda: memory_index.update(entry_id, question, answer))
+
+
+def on_memory_deleted(cursor, entry_id):
+    bump_version(cursor)
+    return _local_change(lambda: memory_index.remove(entry_id))
+
+
+def _local_change(change):
+    def apply():
+        # Our own write already matches the new version, so skip the reload
+        if memory_index.version is None:
+            return
+        change()
+        memory_index.version += 1
+    return apply
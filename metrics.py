@@ -0,0 +1,320 @@
+"""Latency histograms and counters, exported in Prometheus text format.
+
+Recording is lock-free: each thread counts into its own shard of a metric
+(a dict of label values -> bucket counts), and shards are only summed when
+a snapshot is taken. A lock is taken once per thread and metric, when the
+thread first records into it, and again when the thread exits: its shard is
+then folded into the metric's base totals, so short-lived threads do not
+leave shards behind.
+
+Under gunicorn every worker process has its own totals. With ``METRICS_DIR``
+set, each worker writes a snapshot to ``METRICS_DIR/<pid>-<id>.json`` every
+``METRICS_WRITE_INTERVAL`` seconds and at exit, and ``render()`` sums the
+snapshots of all workers (using live totals for its own process), so
+whichever worker serves ``/metrics`` reports the whole app. Snapshots of
+exited workers are kept so counters never go down; empty the directory
+when the app is (re)started. Without ``METRICS_DIR`` only the serving
+process is reported.
+"""
+import atexit
+import glob
+import json
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+import weakref
+from bisect import bisect_left
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+METRICS_DIR = os.getenv("METRICS_DIR", "")
+METRICS_WRITE_INTERVAL = float(os.getenv("METRICS_WRITE_INTERVAL", "5"))
+
+# Seconds; one more bucket (+Inf) counts everything slower
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, registry, name, help_text, labelnames, size):
+        self.registry = registry
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._size = size
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._local = threading.local()
+        self._shards = []
+        self._base = {}   # folded shards of exited threads
+
+    def _series(self, labelvalues):
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = self._local.shard = {}
+            # The owner lives only in this thread's local storage, which is freed when the thread exits
+            self._local.owner = owner = _ShardOwner()
+            weakref.finalize(owner, self._retire, shard).atexit = False
+            with self._lock:
+                self._shards.append(shard)
+            self.registry._ensure_writer()
+        series = shard.get(labelvalues)
+        if series is None:
+            series = shard[labelvalues] = [0] * self._size
+        return series
+
+    def _retire(self, shard):
+        with self._lock:
+            for i, live in enumerate(self._shards):
+                if live is shard:
+                    del self._shards[i]
+                    break
+            else:
+                return   # a shard from before a fork reset
+            for labelvalues, series in shard.items():
+                total = self._base.get(labelvalues)
+                if total is None:
+                    self._base[labelvalues] = list(series)
+                else:
+                    for i, value in enumerate(series):
+                        total[i] += value
+
+    def collect(self):
+        """Label values -> summed series, over every thread's shard."""
+        with self._lock:
+            shards = list(self._shards)
+            totals = {labelvalues: list(series) for labelvalues, series in self._base.items()}
+        for shard in shards:
+            for labelvalues, series in shard.copy().items():
+                total = totals.get(labelvalues)
+                if total is None:
+                    totals[labelvalues] = list(series)
+                else:
+                    for i, value in enumerate(series):
+                        total[i] += value
+        return totals
+
+
+class _ShardOwner:
+    __slots__ = ("__weakref__",)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, registry, name, help_text, labelnames=()):
+        super().__init__(registry, name, help_text, labelnames, 1)
+
+    def inc(self, *labelvalues, amount=1):
+        self._series(labelvalues)[0] += amount
+
+
+class Histogram(_Metric):
+    """Fixed buckets; a series is the per-bucket counts (not cumulative) followed by the sum."""
+    kind = "histogram"
+
+    def __init__(self, registry, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        super().__init__(registry, name, help_text, labelnames, len(self.buckets) + 2)
+
+    def observe(self, value, *labelvalues):
+        series = self._series(labelvalues)
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    @contextmanager
+    def time(self, *labelvalues):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labelvalues)
+
+
+class MetricsRegistry:
+    def __init__(self, directory=METRICS_DIR, write_interval=METRICS_WRITE_INTERVAL):
+        self.directory = directory
+        self.write_interval = write_interval
+        self._metrics = {}
+        self._lock = threading.Lock()
+        self._writer = None
+        self._file = None
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def counter(self, name, help_text, labelnames=()):
+        return self._register(Counter(self, name, help_text, labelnames))
+
+    def histogram(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(self, name, help_text, labelnames, buckets))
+
+    def _register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"metric {metric.name} is already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def _after_fork(self):
+        # A forked worker starts from zero: the parent's totals are its own to report
+        self._lock = threading.Lock()
+        self._writer = None
+        self._file = None
+        for metric in self._metrics.values():
+            metric._lock = threading.Lock()
+            metric._reset()
+
+    # ✅ Snapshots shared between worker processes
+    def snapshot(self):
+        return {
+            name: {
+                "type": metric.kind,
+                "help": metric.help,
+                "labels": list(metric.labelnames),
+                "buckets": list(getattr(metric, "buckets", ())),
+                "series": [[list(labelvalues), values] for labelvalues, values in metric.collect().items()],
+            }
+            for name, metric in list(self._metrics.items())
+        }
+
+    def _ensure_writer(self):
+        if not self.directory or self._writer is not None:
+            return
+        with self._lock:
+            if self._writer is not None:
+                return
+            os.makedirs(self.directory, exist_ok=True)
+            self._file = os.path.join(self.directory, f"{os.getpid()}-{uuid.uuid4().hex[:8]}.json")
+            self._writer = threading.Thread(target=self._write_loop, name="metrics-writer", daemon=True)
+            self._writer.start()
+        atexit.register(self.write)
+
+    def _write_loop(self):
+        while True:
+            time.sleep(self.write_interval)
+            self.write()
+
+    def write(self):
+        if not self._file:
+            return
+        try:
+            tmp = self._file + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(self.snapshot(), f)
+            os.replace(tmp, self._file)
+        except OSError:
+            logger.exception("Could not write the metrics snapshot %s", self._file)
+
+    def _all_snapshots(self):
+        snapshots = [self.snapshot()]
+        if self.directory:
+            for path in glob.glob(os.path.join(self.directory, "*.json")):
+                if path == self._file:
+                    continue   # our live totals are already in
+                try:
+                    with open(path, "r", encoding="utf-8") as f:
+                        snapshots.append(json.load(f))
+                except (OSError, ValueError):
+                    continue   # being replaced right now
+        return snapshots
+
+    # ✅ Prometheus text format
+    def render(self):
+        merged = {}
+        for snapshot in self._all_snapshots():
+            for name, metric in snapshot.items():
+                target = merged.setdefault(name, dict(metric, series={}))
+                for labelvalues, values in metric["series"]:
+                    key = tuple(labelvalues)
+                    total = target["series"].get(key)
+                    if total is None:
+                        target["series"][key] = list(values)
+                    elif len(total) == len(values):
+                        for i, value in enumerate(values):
+                            total[i] += value
+
+        lines = []
+        for name in sorted(merged):
+            metric = merged[name]
+            lines.append(f"# HELP {name} {metric['help']}")
+            lines.append(f"# TYPE {name} {metric['type']}")
+            for labelvalues in sorted(metric["series"]):
+                values = metric["series"][labelvalues]
+                labels = list(zip(metric["labels"], labelvalues))
+                if metric["type"] == "counter":
+                    lines.append(f"{name}{_labels(labels)} {_number(values[0])}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(list(metric["buckets"]) + ["+Inf"], values):
+                    cumulative += count
+                    le = bound if bound == "+Inf" else _number(bound)
+                    lines.append(f"{name}_bucket{_labels(labels + [('le', le)])} {cumulative}")
+                lines.append(f"{name}_sum{_labels(labels)} {_number(values[-1])}")
+                lines.append(f"{name}_count{_labels(labels)} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+
+def _labels(pairs):
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+metrics = MetricsRegistry()
+
+# ✅ The app's metrics
+REQUEST_SECONDS = metrics.histogram(
+    "chatbot_request_duration_seconds", "Time to the response headers per Flask route.",
+    ("route", "method", "status"))
+STAGE_SECONDS = metrics.histogram(
+    "chatbot_stage_duration_seconds",
+    "Time spent in one stage of a request (memory_lookup, retrieval, fuzzy_match, intent_detection, "
+    "openai_reply, openai_intent, chat_log_write, db_checkout).",
+    ("stage",))
+STAGE_ERRORS = metrics.counter(
+    "chatbot_stage_errors_total", "Stages that raised instead of finishing.", ("stage",))
+DB_QUERY_SECONDS = metrics.histogram(
+    "chatbot_db_query_duration_seconds", "Database statement time, by statement kind and first table.",
+    ("query",))
+
+
+@contextmanager
+def time_stage(stage):
+    """Record the block's duration under ``stage``, and count it as an error if it raises."""
+    started = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        STAGE_ERRORS.inc(stage)
+        raise
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - started, stage)
+
+
+_TABLE_RE = re.compile(r"\b(?:FROM|INTO|UPDATE|JOIN)\s+`?(\w+)", re.IGNORECASE)
+_query_labels = {}
+
+
+def query_label(sql):
+    """``"<verb> <table>"`` for a statement, e.g. ``"select chat_sessions"``; bounded label set."""
+    label = _query_labels.get(sql)
+    if label is None:
+        words = sql.split(None, 1)
+        verb = words[0].lower() if words else "?"
+        match = _TABLE_RE.search(sql)
+        label = f"{verb} {match.group(1)}" if match else verb
+        if len(_query_labels) < 1000:
+            _query_labels[sql] = label
+    return label
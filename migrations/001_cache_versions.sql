@@ -0,0 +1,8 @@
+-- Shared version counters used by per-process caches (memory index, response cache)
+-- so every worker notices when the underlying table changes.
+CREATE TABLE IF NOT EXISTS cache_versions (
+    name VARCHAR(64) PRIMARY KEY,
+    version BIGINT NOT NULL DEFAULT 0
+);
+
+INSERT IGNORE INTO cache_versions (name, version) VALUES ('memory_corrections', 0);
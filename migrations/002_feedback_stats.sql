@@ -0,0 +1,11 @@
+-- Running feedback totals for the admin dashboard, updated in the same
+-- transaction as every INSERT INTO feedbacks (see feedback_stats.py).
+CREATE TABLE IF NOT EXISTS feedback_stats (
+    id TINYINT PRIMARY KEY,
+    total BIGINT NOT NULL DEFAULT 0,
+    rated BIGINT NOT NULL DEFAULT 0,
+    rating_sum BIGINT NOT NULL DEFAULT 0
+);
+
+INSERT IGNORE INTO feedback_stats (id, total, rated, rating_sum)
+SELECT 1, COUNT(*), COUNT(rating), COALESCE(SUM(rating), 0) FROM feedbacks;
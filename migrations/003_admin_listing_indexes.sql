@@ -0,0 +1,9 @@
+-- Composite indexes behind the keyset-paginated admin listings (admin_queries.py).
+-- Each one matches a filter prefix followed by the (created_at, id) sort key,
+-- so every page is a single index range scan. Run once.
+CREATE INDEX idx_chat_sessions_archived_created ON chat_sessions (is_archived, created_at, id);
+CREATE INDEX idx_chat_sessions_type_archived_created ON chat_sessions (user_type, is_archived, created_at, id);
+CREATE INDEX idx_chat_sessions_student_archived_created ON chat_sessions (student_id, is_archived, created_at, id);
+
+CREATE INDEX idx_feedbacks_submitted ON feedbacks (submitted_at, id);
+CREATE INDEX idx_feedbacks_rating_submitted ON feedbacks (rating, submitted_at, id);
@@ -0,0 +1,44 @@
+-- Append-only chat session storage (session_store.py): one row per message with a
+-- per-session sequence number, and a per-owner counter for "Chat N" names.
+-- Run once; existing sessions are backfilled from their messages blob.
+CREATE TABLE IF NOT EXISTS chat_session_messages (
+    session_id INT NOT NULL,
+    seq INT NOT NULL,
+    role VARCHAR(16) NOT NULL,
+    content LONGTEXT NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (session_id, seq)
+);
+
+CREATE TABLE IF NOT EXISTS chat_session_counters (
+    owner VARCHAR(96) PRIMARY KEY,
+    last_number INT NOT NULL DEFAULT 0
+);
+
+ALTER TABLE chat_sessions
+    ADD COLUMN message_count INT NOT NULL DEFAULT 0,
+    MODIFY messages LONGTEXT NULL;
+
+INSERT INTO chat_session_messages (session_id, seq, role, content, created_at)
+SELECT cs.id, m.seq, COALESCE(m.role, 'user'), COALESCE(m.content, ''), cs.created_at
+FROM chat_sessions cs,
+     JSON_TABLE(cs.messages, '$[*]' COLUMNS (
+         seq FOR ORDINALITY,
+         role VARCHAR(16) PATH '$.role',
+         content LONGTEXT PATH '$.content'
+     )) AS m
+WHERE JSON_VALID(cs.messages);
+
+UPDATE chat_sessions cs
+JOIN (SELECT session_id, MAX(seq) AS n FROM chat_session_messages GROUP BY session_id) m
+    ON m.session_id = cs.id
+SET cs.message_count = m.n, cs.messages = NULL;
+
+INSERT INTO chat_session_counters (owner, last_number)
+SELECT CASE WHEN guest_id IS NOT NULL THEN CONCAT('guest:', guest_id)
+            ELSE CONCAT('student:', student_id) END AS owner,
+       MAX(CAST(SUBSTRING(session_name, 6) AS UNSIGNED))
+FROM chat_sessions
+WHERE session_name LIKE 'Chat %'
+GROUP BY owner
+ON DUPLICATE KEY UPDATE last_number = GREATEST(last_number, VALUES(last_number));
@@ -0,0 +1,30 @@
+-- Hourly token and cost totals per user type, intent and purpose (token_usage.py).
+-- Every worker adds its in-memory totals with INSERT ... ON DUPLICATE KEY UPDATE x = x + n,
+-- so rows from all workers sum up. Token histograms are one row per non-empty bucket
+-- (bucket i counts calls with at most token_usage.TOKEN_BUCKETS[i] tokens).
+CREATE TABLE IF NOT EXISTS token_usage_hourly (
+    hour DATETIME NOT NULL,
+    user_type VARCHAR(16) NOT NULL,
+    intent VARCHAR(32) NOT NULL,
+    purpose VARCHAR(16) NOT NULL,
+    calls BIGINT NOT NULL DEFAULT 0,
+    errors BIGINT NOT NULL DEFAULT 0,
+    estimated_calls BIGINT NOT NULL DEFAULT 0,
+    prompt_tokens BIGINT NOT NULL DEFAULT 0,
+    completion_tokens BIGINT NOT NULL DEFAULT 0,
+    estimated_prompt_tokens BIGINT NOT NULL DEFAULT 0,
+    cost_micro_usd BIGINT NOT NULL DEFAULT 0,
+    latency_ms BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (hour, user_type, intent, purpose)
+);
+
+CREATE TABLE IF NOT EXISTS token_usage_buckets (
+    hour DATETIME NOT NULL,
+    user_type VARCHAR(16) NOT NULL,
+    intent VARCHAR(32) NOT NULL,
+    purpose VARCHAR(16) NOT NULL,
+    metric VARCHAR(16) NOT NULL,
+    bucket TINYINT NOT NULL,
+    count BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (hour, user_type, intent, purpose, metric, bucket)
+);
@@ -0,0 +1,131 @@
+"""Named model IDs shared by every worker on the host.
+
+The fine-tune orchestrator publishes a succeeded model here and the chat
+path reads it per request, so a new model goes live without a redeploy.
+The registry is a small JSON file rewritten atomically; readers stat it at
+most every ``MODEL_REGISTRY_CHECK_SECONDS`` and re-read it only when it
+changed. To roll back, publish the previous ID again::
+
+    python model_registry.py set chat ft:gpt-3.5-turbo-0125:personal:rmu-v2:Be3kCokl
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+try:
+    import fcntl
+except ImportError:   # Windows: only in-process locking
+    fcntl = None
+
+MODEL_REGISTRY_PATH = os.getenv("MODEL_REGISTRY_PATH", "data/model_registry.json")
+MODEL_REGISTRY_CHECK_SECONDS = float(os.getenv("MODEL_REGISTRY_CHECK_SECONDS", "2"))
+MODEL_REGISTRY_HISTORY = int(os.getenv("MODEL_REGISTRY_HISTORY", "50"))
+
+
+def _signature(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size, st.st_ino
+
+
+class ModelRegistry:
+    def __init__(self, path=MODEL_REGISTRY_PATH, check_seconds=MODEL_REGISTRY_CHECK_SECONDS):
+        self.path = path
+        self.check_seconds = check_seconds
+        self._lock = threading.Lock()
+        self._data = {"models": {}, "history": []}
+        self._signature = None
+        self._checked = 0.0
+
+    def get(self, name, default=None):
+        """The model ID published as ``name``, or ``default``."""
+        entry = self.entry(name)
+        return entry["model"] if entry else default
+
+    def entry(self, name):
+        self._refresh()
+        return self._data["models"].get(name)
+
+    def history(self):
+        self._refresh()
+        return list(self._data["history"])
+
+    def publish(self, name, model, **details):
+        """Make ``model`` the current ``name``; ``details`` (job ids, ...) are kept with it."""
+        entry = dict(details, model=model, published_at=datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._locked_file():
+            data = self._read() or {"models": {}, "history": []}
+            data["models"][name] = entry
+            data["history"] = (data["history"] + [dict(entry, name=name)])[-MODEL_REGISTRY_HISTORY:]
+            tmp = self.path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(data, f, indent=2)
+            os.replace(tmp, self.path)
+        with self._lock:
+            self._data, self._signature, self._checked = data, _signature(self.path), time.monotonic()
+        return entry
+
+    def _refresh(self):
+        now = time.monotonic()
+        if now - self._checked < self.check_seconds:
+            return
+        with self._lock:
+            self._checked = now
+            signature = _signature(self.path)
+            if signature == self._signature:
+                return
+            data = self._read()
+            if data is not None or signature is None:
+                self._data = data or {"models": {}, "history": []}
+                self._signature = signature
+
+    def _read(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):   # missing or half-written: keep serving the last good copy
+            return None
+
+    @contextmanager
+    def _locked_file(self):
+        if not fcntl:
+            with self._lock:
+                yield
+            return
+        with open(self.path + ".lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+model_registry = ModelRegistry()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Show or set published model IDs")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("show")
+    setter = commands.add_parser("set")
+    setter.add_argument("name")
+    setter.add_argument("model")
+    args = parser.parse_args(argv)
+    if args.command == "set":
+        model_registry.publish(args.name, args.model, source="manual")
+    json.dump((model_registry._read() or {}).get("models", {}), sys.stdout, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,563 @@
+import json
+import logging
+import mmap
+import os
+import re
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+
+from chat_pipeline import run_background
+
+try:
+    import fcntl
+except ImportError:   # Windows: only in-process locking
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+DATASET_PATH = "data/rmu_openai_chatbot_dataset.jsonl"
+
+# Journal entries kept before they are folded back into the dataset file
+QA_JOURNAL_COMPACT_AFTER = int(os.getenv("QA_JOURNAL_COMPACT_AFTER", "500"))
+QA_PAGE_SIZE = int(os.getenv("QA_PAGE_SIZE", "50"))
+# Changed ids remembered for incremental index refreshes before consumers must rebuild
+QA_CHANGE_LOG_LIMIT = int(os.getenv("QA_CHANGE_LOG_LIMIT", "200000"))
+
+_CHUNK = 8 * 1024 * 1024
+
+
+def file_signature(path):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+def _line_spans(path, start=0):
+    """(offsets, lengths) of the non-blank lines from byte ``start`` on, found with numpy."""
+    offsets, ends = [], []
+    with open(path, "rb") as f:
+        f.seek(start)
+        pos = start
+        while True:
+            chunk = f.read(_CHUNK)
+            if not chunk:
+                break
+            newlines = np.flatnonzero(np.frombuffer(chunk, dtype=np.uint8) == 10) + pos
+            ends.append(newlines)
+            pos += len(chunk)
+        if pos > start and (not ends or not len(ends[-1]) or ends[-1][-1] != pos - 1):
+            ends.append(np.array([pos], dtype=np.int64))   # last line without a newline
+    ends = np.concatenate(ends) if ends else np.zeros(0, dtype=np.int64)
+    starts = np.concatenate(([start], ends[:-1] + 1)) if len(ends) else ends
+    lengths = ends - starts
+    keep = lengths > 0
+    # Whitespace-only lines are rare; check just the short ones
+    for i in np.flatnonzero(keep & (lengths < 8)):
+        with open(path, "rb") as f:
+            f.seek(starts[i])
+            keep[i] = bool(f.read(lengths[i]).strip())
+    return starts[keep].astype(np.int64), lengths[keep].astype(np.int64)
+
+
+class QAStore:
+    """The Q&A dataset with stable row IDs, random access and cheap edits.
+
+    The JSONL file stays the canonical chat-format dataset. Next to it live:
+
+    * ``<path>.idx``     -- row id, byte offset and length of every line, so a
+      row is one seek away and a page never reads the rest of the file;
+    * ``<path>.journal`` -- append-only ``put``/``delete`` records keyed by id.
+      Edits only append here; reads overlay the journal on the file.
+
+    Once the journal holds ``compact_after`` records it is folded into a new
+    dataset file written beside the old one and swapped in with ``os.replace``,
+    so readers never see a half-written file. Journal records are idempotent,
+    so replaying one that was already compacted is harmless. Other processes
+    notice changes through the files' mtime/size and catch up on their next call.
+
+    Bulk imports skip the journal: ``extend`` appends their lines to the file
+    and indexes just the new bytes. Indexes built over the dataset follow
+    ``changes_since``, which lists the ids touched since a cursor so they can
+    update those rows instead of rereading everything.
+    """
+
+    def __init__(self, path=DATASET_PATH, compact_after=QA_JOURNAL_COMPACT_AFTER):
+        self.path = path
+        self.index_path = path + ".idx"
+        self.journal_path = path + ".journal"
+        self.lock_path = path + ".lock"
+        self.compact_after = compact_after
+        self._lock = threading.RLock()
+        self._base_signature = None
+        self._ids = np.zeros(0, dtype=np.int64)
+        self._offsets = np.zeros(0, dtype=np.int64)
+        self._lengths = np.zeros(0, dtype=np.int64)
+        self._position = {}          # id -> row number in the dataset file
+        self._next_id = 1
+        self._overlay = {}           # id -> messages, or None when deleted
+        self._journal_offset = 0
+        self._journal_entries = 0
+        self._live = None            # cached ordered array of live ids
+        self._compacting = False
+        self._file_lock_depth = 0
+        self._file_lock = None
+        self._journal_inode = None
+        self._epoch = 0              # bumped when changed ids can no longer be listed
+        self._changes = []           # ids touched during this epoch, oldest first
+
+    # ✅ Reads
+    def __len__(self):
+        # Arithmetic over the journal only, so it costs the same at any dataset size
+        with self._lock:
+            self._sync()
+            deleted = sum(1 for i, m in self._overlay.items() if m is None and i in self._position)
+            added = sum(1 for i, m in self._overlay.items() if m is not None and i not in self._position)
+            return len(self._ids) - deleted + added
+
+    def get(self, qa_id):
+        """The ``messages`` list of one row; KeyError if there is no such row."""
+        with self._lock:
+            self._sync()
+            rows = self._read([qa_id])
+        if not rows:
+            raise KeyError(qa_id)
+        return rows[0]["messages"]
+
+    def page(self, page=1, per_page=QA_PAGE_SIZE, query=None):
+        """One page of ``{"id", "messages"}`` rows plus the total number of matches."""
+        with self._lock:
+            self._sync()
+            ids = self._matching_ids(query) if query else self._live_ids()
+            start = max(page - 1, 0) * per_page
+            return self._read(ids[start:start + per_page].tolist()), len(ids)
+
+    def iter_messages(self):
+        """Every live row's ``messages`` in dataset order (file order, then new rows)."""
+        for _, messages in self.iter_rows():
+            yield messages
+
+    def iter_rows(self):
+        """``(id, messages)`` for every live row, in dataset order."""
+        with self._lock:
+            self._sync()
+            overlay = dict(self._overlay)
+            ids, offsets, lengths = self._ids, self._offsets, self._lengths
+            new_ids = sorted(i for i, m in overlay.items() if m is not None and i not in self._position)
+            # Keep this file open: a compaction replaces the path, not the data we are reading
+            f = open(self.path, "rb") if len(ids) else None
+        if f:
+            with f:
+                for qa_id, offset, length in zip(ids.tolist(), offsets.tolist(), lengths.tolist()):
+                    if qa_id in overlay:
+                        if overlay[qa_id] is not None:
+                            yield qa_id, overlay[qa_id]
+                        continue
+                    f.seek(offset)
+                    messages = _messages(f.read(length))
+                    if messages:
+                        yield qa_id, messages
+        for qa_id in new_ids:
+            yield qa_id, overlay[qa_id]
+
+    def signature(self):
+        """Changes whenever the dataset or its journal does; None if neither exists."""
+        base, journal = file_signature(self.path), file_signature(self.journal_path)
+        return (base, journal) if base or journal else None
+
+    def change_cursor(self):
+        """Opaque position in the change log; take it *before* reading rows with ``iter_rows``."""
+        with self._lock:
+            self._sync()
+            return self._epoch, len(self._changes)
+
+    def changes_since(self, cursor):
+        """``(cursor, [(id, messages or None), ...])`` for the rows touched after ``cursor``.
+
+        The list is None when the changes cannot be listed (first call, the
+        dataset was rewritten by another worker, or the log overflowed); the
+        caller then rereads everything with ``iter_rows``.
+        """
+        with self._lock:
+            self._sync()
+            current = (self._epoch, len(self._changes))
+            if cursor is None or cursor[0] != self._epoch:
+                return current, None
+            ids = list(dict.fromkeys(self._changes[cursor[1]:]))
+            found = {row["id"]: row["messages"] for row in self._read(ids)}
+        return current, [(qa_id, found.get(qa_id)) for qa_id in ids]
+
+    # ✅ Writes
+    def add(self, messages):
+        with self._writing():
+            qa_id = self._next_id
+            self._append_journal({"op": "put", "id": qa_id, "messages": messages})
+        self._maybe_compact()
+        return qa_id
+
+    def update(self, qa_id, messages):
+        with self._writing():
+            self._require(qa_id)
+            self._append_journal({"op": "put", "id": qa_id, "messages": messages})
+        self._maybe_compact()
+
+    def delete(self, qa_id):
+        with self._writing():
+            self._require(qa_id)
+            self._append_journal({"op": "delete", "id": qa_id})
+        self._maybe_compact()
+
+    def extend(self, rows):
+        """Append many rows to the dataset file in one write; returns their new ids.
+
+        Either every row lands or none does: a failed write is truncated away
+        before the index is touched, and other workers wait on the file lock.
+        """
+        if not rows:
+            return []
+        lines = [_encode(messages) for messages in rows]
+        with self._writing():
+            start = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+            prefix = b"" if self._ends_with_newline(start) else b"\n"
+            data = prefix + b"".join(lines)
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                view = memoryview(data)
+                while view:
+                    view = view[os.write(fd, view):]
+                os.fsync(fd)
+            except BaseException:
+                os.ftruncate(fd, start)
+                raise
+            finally:
+                os.close(fd)
+            lengths = np.array([len(line) - 1 for line in lines], dtype=np.int64)
+            offsets = start + len(prefix) + np.concatenate(([0], np.cumsum(lengths + 1)[:-1])).astype(np.int64)
+            ids = np.arange(self._next_id, self._next_id + len(lines), dtype=np.int64)
+            self._set_index(np.concatenate((self._ids, ids)), np.concatenate((self._offsets, offsets)),
+                            np.concatenate((self._lengths, lengths)), self._next_id + len(lines))
+            self._save_index_for(file_signature(self.path))
+            self._log_changes(ids.tolist())
+        return ids.tolist()
+
+    def compact(self):
+        """Fold the journal into a fresh dataset file and index, swapped in atomically.
+
+        The new file is written from a snapshot without holding the lock, so
+        reads and edits carry on meanwhile; edits made during the rewrite stay
+        in the journal.
+        """
+        with self._writing():
+            if not self._journal_entries:
+                return
+            signature, journal_offset = self._base_signature, self._journal_offset
+            base_ids, base_offsets, base_lengths = self._ids, self._offsets, self._lengths
+            overlay, position, next_id = dict(self._overlay), self._position, self._next_id
+
+        tmp_data, tmp_index, tmp_journal = self.path + ".tmp", self.index_path + ".tmp", self.journal_path + ".tmp"
+        ids, offsets, lengths = [], [], []
+        pos = 0
+        # Nothing to copy when the dataset file does not exist yet
+        with open(self.path if len(base_ids) else os.devnull, "rb") as src, open(tmp_data, "wb") as dst:
+            new_ids = sorted(i for i, m in overlay.items() if m is not None and i not in position)
+            rows = zip(base_ids.tolist(), base_offsets.tolist(), base_lengths.tolist())
+            for qa_id, offset, length in list(rows) + [(i, None, None) for i in new_ids]:
+                if qa_id in overlay:
+                    if overlay[qa_id] is None:
+                        continue
+                    line = _encode(overlay[qa_id])
+                else:
+                    src.seek(offset)
+                    line = src.read(length) + b"\n"
+                dst.write(line)
+                ids.append(qa_id)
+                offsets.append(pos)
+                lengths.append(len(line) - 1)
+                pos += len(line)
+            dst.flush()
+            os.fsync(dst.fileno())
+        ids, offsets, lengths = (np.array(a, dtype=np.int64) for a in (ids, offsets, lengths))
+
+        with self._writing():
+            if self._base_signature != signature:
+                os.remove(tmp_data)   # another worker compacted first
+                return
+            with open(self.journal_path, "rb") as f:
+                f.seek(journal_offset)
+                tail = f.read()
+            with open(tmp_journal, "wb") as f:
+                f.write(tail)
+            new_signature = file_signature(tmp_data)   # os.replace keeps mtime and size
+            _write_index(tmp_index, ids, offsets, lengths, new_signature, next_id)
+            # Index first: anyone who sees the new file also finds its index
+            os.replace(tmp_index, self.index_path)
+            os.replace(tmp_data, self.path)
+            os.replace(tmp_journal, self.journal_path)
+            self._set_index(ids, offsets, lengths, next_id)
+            self._base_signature = new_signature
+            self._reset_overlay()
+            self._read_journal()
+            self._journal_inode = _inode(self.journal_path)
+
+    def _require(self, qa_id):
+        if self._overlay.get(qa_id, 0) is None or (qa_id not in self._overlay and qa_id not in self._position):
+            raise KeyError(qa_id)
+
+    def _maybe_compact(self):
+        with self._lock:
+            if self._journal_entries < self.compact_after or self._compacting:
+                return
+            self._compacting = True
+
+        def compact():
+            try:
+                self.compact()
+            finally:
+                self._compacting = False
+        # Off the request thread: rewriting a large dataset takes a while
+        run_background(compact)
+
+    @contextmanager
+    def _writing(self):
+        with self._lock, self._locked_files():
+            self._sync()
+            yield
+
+    @contextmanager
+    def _locked_files(self):
+        """Advisory lock shared with other workers; re-entrant within this store."""
+        with self._lock:
+            if self._file_lock_depth == 0 and fcntl:
+                self._file_lock = open(self.lock_path, "a")
+                fcntl.flock(self._file_lock, fcntl.LOCK_EX)
+            self._file_lock_depth += 1
+            try:
+                yield
+            finally:
+                self._file_lock_depth -= 1
+                if self._file_lock_depth == 0 and self._file_lock:
+                    fcntl.flock(self._file_lock, fcntl.LOCK_UN)
+                    self._file_lock.close()
+                    self._file_lock = None
+
+    def _append_journal(self, record):
+        line = (json.dumps(record) + "\n").encode("utf-8")
+        fd = os.open(self.journal_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, line)
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        self._apply(record)
+        self._journal_offset += len(line)
+
+    # ✅ Keeping up with the files
+    def _sync(self):
+        if file_signature(self.path) != self._base_signature:
+            # Under the file lock so we never pair a new dataset with an old index mid-compaction
+            with self._locked_files():
+                base = file_signature(self.path)
+                if base != self._base_signature:
+                    self._load_base(base)
+        size = os.path.getsize(self.journal_path) if os.path.exists(self.journal_path) else 0
+        if size < self._journal_offset:
+            self._reset_overlay()   # compacted by another worker
+        if size > self._journal_offset:
+            self._read_journal()
+        self._journal_inode = _inode(self.journal_path)
+
+    def _load_base(self, signature):
+        old_ids, old_offsets, had_base = self._ids, self._offsets, self._base_signature is not None
+        if signature is None:
+            self._set_index(np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), 1)
+        elif not self._load_index(signature):
+            self._rebuild_index(signature)
+        self._base_signature = signature
+        self._reset_overlay()
+        # Lines appended by another worker (same journal, old rows untouched) are plain
+        # additions; anything else, e.g. a compaction elsewhere, may hide edits we never read
+        n = len(old_ids)
+        if (had_base and _inode(self.journal_path) == self._journal_inode and len(self._ids) >= n
+                and np.array_equal(self._ids[:n], old_ids) and np.array_equal(self._offsets[:n], old_offsets)):
+            self._log_changes(self._ids[n:].tolist())
+        else:
+            self._new_epoch()
+
+    def _log_changes(self, ids):
+        self._changes.extend(ids)
+        if len(self._changes) > QA_CHANGE_LOG_LIMIT:
+            self._new_epoch()
+
+    def _new_epoch(self):
+        self._epoch += 1
+        self._changes = []
+
+    def _load_index(self, signature):
+        if not os.path.exists(self.index_path):
+            return False
+        try:
+            data = np.load(self.index_path)
+            meta = data["meta"]
+        except (OSError, ValueError, KeyError):
+            return False
+        indexed = (int(meta[0]), int(meta[1]))
+        if indexed == signature:
+            self._set_index(data["ids"], data["offsets"], data["lengths"], int(meta[2]))
+            return True
+        if signature[1] > indexed[1] and self._ends_with_newline(indexed[1]):
+            # Plain appends (another tool added lines): index just the new bytes
+            offsets, lengths = _line_spans(self.path, indexed[1])
+            next_id = int(meta[2])
+            ids = np.arange(next_id, next_id + len(offsets), dtype=np.int64)
+            self._set_index(np.concatenate((data["ids"], ids)), np.concatenate((data["offsets"], offsets)),
+                            np.concatenate((data["lengths"], lengths)), next_id + len(offsets))
+            self._save_index_for(signature)
+            return True
+        return False
+
+    def _rebuild_index(self, signature):
+        offsets, lengths = _line_spans(self.path)
+        ids = np.arange(1, len(offsets) + 1, dtype=np.int64)
+        self._set_index(ids, offsets, lengths, len(offsets) + 1)
+        if os.path.exists(self.journal_path) and os.path.getsize(self.journal_path):
+            # Ids were renumbered, so the old journal no longer refers to the right rows
+            logger.warning("Dataset %s was rewritten outside the Q&A store; setting its journal aside", self.path)
+            os.replace(self.journal_path, self.journal_path + ".stale")
+        self._save_index_for(signature)
+
+    def _ends_with_newline(self, size):
+        if size == 0:
+            return True
+        with open(self.path, "rb") as f:
+            f.seek(size - 1)
+            return f.read(1) == b"\n"
+
+    def _set_index(self, ids, offsets, lengths, next_id):
+        self._ids, self._offsets, self._lengths = ids, offsets, lengths
+        self._position = {qa_id: row for row, qa_id in enumerate(ids.tolist())}
+        self._next_id = next_id
+        self._live = None
+
+    def _save_index_for(self, signature):
+        self._base_signature = signature
+        tmp = self.index_path + ".tmp"
+        self._save_index(tmp)
+        os.replace(tmp, self.index_path)
+
+    def _save_index(self, path):
+        _write_index(path, self._ids, self._offsets, self._lengths, self._base_signature, self._next_id)
+
+    def _reset_overlay(self):
+        self._overlay = {}
+        self._journal_offset = 0
+        self._journal_entries = 0
+        self._next_id = max(self._next_id, int(self._ids.max()) + 1 if len(self._ids) else 1)
+        self._live = None
+
+    def _read_journal(self):
+        with open(self.journal_path, "rb") as f:
+            f.seek(self._journal_offset)
+            data = f.read()
+        # A torn last line (writer died mid-append) stays unread until it is completed
+        complete = data[:data.rfind(b"\n") + 1]
+        for line in complete.splitlines():
+            try:
+                self._apply(json.loads(line))
+            except (json.JSONDecodeError, KeyError, TypeError):
+                logger.warning("Skipping unreadable Q&A journal record")
+        self._journal_offset += len(complete)
+
+    def _apply(self, record):
+        qa_id = int(record["id"])
+        self._overlay[qa_id] = record["messages"] if record["op"] == "put" else None
+        self._next_id = max(self._next_id, qa_id + 1)
+        self._journal_entries += 1
+        self._live = None
+        self._log_changes([qa_id])
+
+    # ✅ Listing and search
+    def _read(self, ids):
+        """``{"id", "messages"}`` for the given ids that exist, in the given order."""
+        rows, wanted = [], []
+        for qa_id in ids:
+            if qa_id in self._overlay:
+                if self._overlay[qa_id] is not None:
+                    rows.append({"id": qa_id, "messages": self._overlay[qa_id]})
+            elif qa_id in self._position:
+                rows.append({"id": qa_id, "messages": None})
+                wanted.append((len(rows) - 1, self._position[qa_id]))
+        if wanted:
+            with open(self.path, "rb") as f:
+                for i, row in wanted:
+                    f.seek(int(self._offsets[row]))
+                    rows[i]["messages"] = _messages(f.read(int(self._lengths[row])))
+        return rows
+
+    def _live_ids(self):
+        if self._live is None:
+            deleted = [i for i, m in self._overlay.items() if m is None]
+            ids = self._ids[~np.isin(self._ids, deleted)] if deleted else self._ids
+            new_ids = sorted(i for i, m in self._overlay.items() if m is not None and i not in self._position)
+            self._live = np.concatenate((ids, np.array(new_ids, dtype=np.int64)))
+        return self._live
+
+    def _matching_ids(self, query):
+        """Live ids whose question or answer contains ``query`` (case-insensitive)."""
+        needle = query.lower()
+        # Scan the raw file with one regex for candidate lines, then confirm on the parsed row
+        pattern = re.compile(re.escape(json.dumps(query)[1:-1].encode("utf-8")), re.IGNORECASE)
+        hits = set()
+        if len(self._offsets):
+            with open(self.path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                starts = self._offsets
+                candidates = set()
+                for match in pattern.finditer(data):
+                    row = int(np.searchsorted(starts, match.start(), side="right")) - 1
+                    if row >= 0 and match.start() < starts[row] + self._lengths[row]:
+                        candidates.add(row)
+                for row in candidates:
+                    qa_id = int(self._ids[row])
+                    if qa_id in self._overlay:
+                        continue
+                    line = data[int(starts[row]):int(starts[row] + self._lengths[row])]
+                    if _contains(_messages(line), needle):
+                        hits.add(qa_id)
+        hits.update(i for i, m in self._overlay.items() if m is not None and _contains(m, needle))
+        live = self._live_ids()
+        return live[np.isin(live, list(hits))] if hits else live[:0]
+
+
+def _inode(path):
+    try:
+        return os.stat(path).st_ino or None
+    except FileNotFoundError:
+        return None
+
+
+def _write_index(path, ids, offsets, lengths, signature, next_id):
+    meta = np.array([signature[0], signature[1], next_id], dtype=np.int64)
+    with open(path, "wb") as f:
+        np.savez(f, ids=ids, offsets=offsets, lengths=lengths, meta=meta)
+
+
+def _messages(raw):
+    try:
+        item = json.loads(raw)
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        return []
+    return item.get("messages", []) if isinstance(item, dict) else []
+
+
+def _encode(messages):
+    return (json.dumps({"messages": messages}) + "\n").encode("utf-8")
+
+
+def _contains(messages, needle):
+    return any(needle in (m.get("content") or "").lower()
+               for m in messages if m.get("role") in ("user", "assistant"))
+
+
+dataset_store = QAStore()
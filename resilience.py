@@ -0,0 +1,382 @@
+"""Deadlines, retries, hedging and a circuit breaker around OpenAI calls.
+
+``openai_guard.call(purpose, fn, kwargs)`` runs one logical call (``fn`` is
+a single attempt, e.g. ``openai.ChatCompletion.create``):
+
+- Deadline: the whole call, retries included, must finish within
+  ``deadline(purpose)`` seconds (``OPENAI_DEADLINE_<PURPOSE>``, else
+  ``OPENAI_DEADLINE``). Each attempt gets the time left as
+  ``request_timeout``; coroutine attempts are cancelled at the deadline.
+- Retries: rate limits, timeouts, connection errors and 5xx are retried up
+  to ``OPENAI_MAX_RETRIES`` times with jittered exponential backoff
+  (honouring ``Retry-After``), while the deadline allows. Other errors
+  (bad request, auth) are raised at once.
+- Hedging (``OPENAI_HEDGE=1``, off by default): when an attempt is still
+  running after the p95 latency of recent calls for its purpose, an
+  identical second request is sent and the first answer wins. This costs
+  tokens; it trims the slow tail. Streams are never hedged.
+- Circuit breaker: after ``OPENAI_BREAKER_FAILURES`` upstream failures in a
+  row, calls fail fast with ``CircuitOpen`` for ``OPENAI_BREAKER_COOLDOWN``
+  seconds; then one probe call is let through and its outcome closes or
+  re-opens the circuit. Callers answer from local data meanwhile (see
+  chatbot.degraded_reply).
+
+The breaker is per process. Every outcome is counted in the
+``chatbot_openai_*`` metrics; ``stats()`` feeds the admin dashboard.
+"""
+import asyncio
+import contextvars
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import openai
+
+from backoff import backoff
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+OPENAI_DEADLINE = float(os.getenv("OPENAI_DEADLINE", "30"))
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "2"))
+OPENAI_BACKOFF_BASE = float(os.getenv("OPENAI_BACKOFF_BASE", "0.5"))
+OPENAI_BACKOFF_CAP = float(os.getenv("OPENAI_BACKOFF_CAP", "8"))
+OPENAI_HEDGE = os.getenv("OPENAI_HEDGE", "0") == "1"
+OPENAI_HEDGE_MIN_DELAY = float(os.getenv("OPENAI_HEDGE_MIN_DELAY", "0.5"))   # never hedge sooner (s)
+OPENAI_HEDGE_MIN_SAMPLES = int(os.getenv("OPENAI_HEDGE_MIN_SAMPLES", "20"))  # latencies needed for a p95
+OPENAI_HEDGE_WORKERS = int(os.getenv("OPENAI_HEDGE_WORKERS", "32"))
+OPENAI_BREAKER_FAILURES = int(os.getenv("OPENAI_BREAKER_FAILURES", "5"))
+OPENAI_BREAKER_COOLDOWN = float(os.getenv("OPENAI_BREAKER_COOLDOWN", "30"))
+
+ATTEMPTS = metrics.counter(
+    "chatbot_openai_attempts_total",
+    "OpenAI requests by outcome: ok, retryable (rate limit, timeout, 5xx...) or error (not retried).",
+    ("purpose", "outcome"))
+RETRIES = metrics.counter("chatbot_openai_retries_total", "OpenAI requests repeated after a retryable error.",
+                          ("purpose",))
+HEDGES = metrics.counter(
+    "chatbot_openai_hedges_total", "Hedged second requests: sent, and which request answered first.",
+    ("purpose", "outcome"))
+REJECTED = metrics.counter(
+    "chatbot_openai_rejected_total", "Calls failed fast because the circuit breaker was open.", ("purpose",))
+BREAKER_TRANSITIONS = metrics.counter(
+    "chatbot_openai_breaker_transitions_total", "Circuit breaker state changes, by new state.", ("state",))
+DEGRADED = metrics.counter(
+    "chatbot_degraded_answers_total", "Answers given from local data because OpenAI failed.", ("purpose",))
+
+
+class CircuitOpen(Exception):
+    """OpenAI is considered down; the call was not made."""
+
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+
+def retryable(error):
+    if isinstance(error, (openai.error.RateLimitError, openai.error.Timeout, openai.error.APIConnectionError,
+                          openai.error.ServiceUnavailableError, openai.error.TryAgain,
+                          TimeoutError, ConnectionError)):
+        return True
+    if isinstance(error, openai.error.APIError):
+        return error.http_status is None or error.http_status >= 500
+    return False
+
+
+def retry_after(error):
+    try:
+        return float((getattr(error, "headers", None) or {}).get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+# ✅ Circuit breaker
+class CircuitBreaker:
+    """closed -> open after ``failures`` upstream failures in a row -> half_open after ``cooldown`` s.
+
+    In half_open a single probe is allowed; its success closes the circuit,
+    its failure opens it again for another cooldown. A probe that ends
+    without an outcome (cancelled, interrupted) must ``release`` its slot.
+    """
+
+    def __init__(self, failures=OPENAI_BREAKER_FAILURES, cooldown=OPENAI_BREAKER_COOLDOWN, clock=time.monotonic):
+        self.failures = failures
+        self.cooldown = cooldown
+        self.clock = clock
+        self._lock = threading.Lock()
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.opened = 0
+        self._probing = False
+
+    def allow(self):
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and self.clock() - self.opened_at >= self.cooldown:
+                self._set("half_open")
+            if self.state == "half_open" and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.consecutive_failures = 0
+            self._probing = False
+            if self.state != "closed":
+                self._set("closed")
+
+    def release(self):
+        """The attempt ended without an outcome: let the next call probe instead."""
+        with self._lock:
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            self._probing = False
+            if self.state == "half_open" or (self.state == "closed" and self.consecutive_failures >= self.failures):
+                self.opened_at = self.clock()
+                self.opened += 1
+                self._set("open")
+
+    def _set(self, state):
+        logger.warning("OpenAI circuit %s -> %s", self.state, state)
+        self.state = state
+        BREAKER_TRANSITIONS.inc(state)
+
+
+class LatencyWindow:
+    """Latencies of the last ``size`` successful requests, per purpose."""
+
+    def __init__(self, size=200):
+        self.size = size
+        self._lock = threading.Lock()
+        self._samples = {}
+
+    def add(self, purpose, seconds):
+        with self._lock:
+            self._samples.setdefault(purpose, deque(maxlen=self.size)).append(seconds)
+
+    def p95(self, purpose, min_samples=OPENAI_HEDGE_MIN_SAMPLES):
+        with self._lock:
+            samples = sorted(self._samples.get(purpose, ()))
+        if len(samples) < min_samples:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+
+
+# ✅ The guarded call
+class ResilientCaller:
+    def __init__(self, breaker=None, max_retries=OPENAI_MAX_RETRIES, backoff_base=OPENAI_BACKOFF_BASE,
+                 backoff_cap=OPENAI_BACKOFF_CAP, hedge=OPENAI_HEDGE, hedge_min_delay=OPENAI_HEDGE_MIN_DELAY,
+                 clock=time.monotonic, sleep=time.sleep, rng=random):
+        self.breaker = breaker or CircuitBreaker(clock=clock)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.hedge = hedge
+        self.hedge_min_delay = hedge_min_delay
+        self.clock = clock
+        self.sleep = sleep
+        self.rng = rng
+        self.latency = LatencyWindow()
+        self._executor = None
+        self._lock = threading.Lock()
+        self.counts = {"attempts": 0, "retries": 0, "hedges": 0, "hedges_won": 0, "rejected": 0, "failed": 0,
+                       "degraded": 0}
+
+    @staticmethod
+    def deadline(purpose):
+        return float(os.getenv(f"OPENAI_DEADLINE_{purpose.upper()}", OPENAI_DEADLINE))
+
+    def call(self, purpose, fn, kwargs, hedge=True):
+        """``fn(**kwargs)`` with deadline, retries, optional hedging and the breaker."""
+        deadline = self.clock() + self.deadline(purpose)
+        attempt = 0
+        while True:
+            remaining = self._admit(purpose, deadline)
+            started = self.clock()
+            try:
+                if hedge and self.hedge:
+                    result = self._hedged(purpose, fn, dict(kwargs, request_timeout=remaining), remaining)
+                else:
+                    result = fn(**dict(kwargs, request_timeout=remaining))
+            except Exception as e:
+                delay = self._failed(purpose, e, attempt, deadline)
+                self.sleep(delay)
+                attempt += 1
+                continue
+            except BaseException:
+                self.breaker.release()
+                raise
+            self._succeeded(purpose, self.clock() - started)
+            return result
+
+    async def acall(self, purpose, fn, kwargs, hedge=True):
+        """``call`` for a coroutine function ``fn``; attempts are cancelled at the deadline."""
+        deadline = self.clock() + self.deadline(purpose)
+        attempt = 0
+        while True:
+            remaining = self._admit(purpose, deadline)
+            started = self.clock()
+            try:
+                if hedge and self.hedge:
+                    result = await self._ahedged(purpose, fn, dict(kwargs, request_timeout=remaining), remaining)
+                else:
+                    result = await asyncio.wait_for(fn(**dict(kwargs, request_timeout=remaining)), remaining)
+            except Exception as e:
+                if isinstance(e, asyncio.TimeoutError) and not isinstance(e, DeadlineExceeded):
+                    e = DeadlineExceeded(f"OpenAI {purpose} call passed its {self.deadline(purpose):.0f}s deadline")
+                delay = self._failed(purpose, e, attempt, deadline)
+                await asyncio.sleep(delay)
+                attempt += 1
+                continue
+            except BaseException:
+                # Cancelled by the caller (stage deadline, client gone) before any outcome
+                self.breaker.release()
+                raise
+            self._succeeded(purpose, self.clock() - started)
+            return result
+
+    def _admit(self, purpose, deadline):
+        """Seconds left for the next attempt; raises if the deadline or the breaker says no."""
+        remaining = deadline - self.clock()
+        if remaining <= 0:
+            raise DeadlineExceeded(f"OpenAI {purpose} call passed its {self.deadline(purpose):.0f}s deadline")
+        if not self.breaker.allow():
+            self._count("rejected")
+            REJECTED.inc(purpose)
+            raise CircuitOpen(f"OpenAI is unavailable (circuit open); {purpose} call not made")
+        self._count("attempts")
+        return remaining
+
+    def _succeeded(self, purpose, seconds):
+        self.breaker.record_success()
+        self.latency.add(purpose, seconds)
+        ATTEMPTS.inc(purpose, "ok")
+
+    def _failed(self, purpose, error, attempt, deadline):
+        """Back-off delay before the retry, or re-raise ``error`` when it must not be retried."""
+        if not retryable(error):
+            # OpenAI answered, so it is up; the request itself was wrong
+            self.breaker.record_success()
+            ATTEMPTS.inc(purpose, "error")
+            self._count("failed")
+            raise error
+        self.breaker.record_failure()
+        ATTEMPTS.inc(purpose, "retryable")
+        delay = max(backoff(attempt, self.backoff_base, self.backoff_cap, self.rng), retry_after(error) or 0)
+        if attempt >= self.max_retries or self.clock() + delay >= deadline:
+            self._count("failed")
+            raise error
+        logger.info("Retrying OpenAI %s call in %.2fs after %s", purpose, delay, type(error).__name__)
+        self._count("retries")
+        RETRIES.inc(purpose)
+        return delay
+
+    # ✅ Hedging
+    def hedge_delay(self, purpose):
+        p95 = self.latency.p95(purpose)
+        return None if p95 is None else max(p95, self.hedge_min_delay)
+
+    def _hedged(self, purpose, fn, kwargs, remaining):
+        delay = self.hedge_delay(purpose)
+        if delay is None or delay >= remaining:
+            return fn(**kwargs)
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=OPENAI_HEDGE_WORKERS,
+                                                        thread_name_prefix="openai-hedge")
+        started = self.clock()
+        sent = [self._executor.submit(contextvars.copy_context().run, lambda: fn(**kwargs))]
+        pending = set(sent)
+        done, _ = wait(pending, timeout=delay)
+        if not done:
+            self._count("hedges")
+            HEDGES.inc(purpose, "sent")
+            sent.append(self._executor.submit(contextvars.copy_context().run, lambda: fn(**kwargs)))
+            pending.add(sent[-1])
+        error = None
+        while pending:
+            # A request that loses the race still runs to completion (and is accounted) on its thread
+            done, pending = wait(pending, timeout=max(remaining - (self.clock() - started), 0),
+                                 return_when=FIRST_COMPLETED)
+            if not done:
+                raise DeadlineExceeded(f"OpenAI {purpose} call passed its {self.deadline(purpose):.0f}s deadline")
+            for future in done:
+                if future.exception() is None:
+                    self._hedge_outcome(purpose, hedged=len(sent) > 1, won=future is not sent[0])
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    async def _ahedged(self, purpose, fn, kwargs, remaining):
+        delay = self.hedge_delay(purpose)
+        if delay is None or delay >= remaining:
+            return await asyncio.wait_for(fn(**kwargs), remaining)
+        started = self.clock()
+        sent = [asyncio.ensure_future(fn(**kwargs))]
+        pending = set(sent)
+        done, _ = await asyncio.wait(pending, timeout=delay)
+        if not done:
+            self._count("hedges")
+            HEDGES.inc(purpose, "sent")
+            sent.append(asyncio.ensure_future(fn(**kwargs)))
+            pending.add(sent[-1])
+        error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, timeout=max(remaining - (self.clock() - started), 0),
+                                                   return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    raise DeadlineExceeded(
+                        f"OpenAI {purpose} call passed its {self.deadline(purpose):.0f}s deadline")
+                for task in done:
+                    if task.exception() is None:
+                        self._hedge_outcome(purpose, hedged=len(sent) > 1, won=task is not sent[0])
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def _hedge_outcome(self, purpose, hedged, won):
+        if not hedged:
+            return
+        if won:
+            self._count("hedges_won")
+        HEDGES.inc(purpose, "hedge_won" if won else "primary_won")
+
+    # ✅ Reporting
+    def degraded(self, purpose):
+        """Count an answer given from local data instead of OpenAI."""
+        self._count("degraded")
+        DEGRADED.inc(purpose)
+
+    def _count(self, name):
+        with self._lock:
+            self.counts[name] += 1
+
+    def stats(self):
+        with self._lock:
+            counts = dict(self.counts)
+        return {
+            **counts,
+            "state": self.breaker.state,
+            "consecutive_failures": self.breaker.consecutive_failures,
+            "opened": self.breaker.opened,
+            "hedging": self.hedge,
+            "reply_p95_ms": round((self.latency.p95("reply", 1) or 0) * 1000),
+        }
+
+
+openai_guard = ResilientCaller()
@@ -0,0 +1,219 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from fuzzy_match import key_text
+from model_registry import model_registry
+from qa_store import dataset_store
+
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "2000"))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", str(24 * 3600)))
+# Optional SQLite file shared by all workers on the host (disabled when unset)
+RESPONSE_CACHE_DB = os.getenv("RESPONSE_CACHE_DB", "")
+RESPONSE_CACHE_DB_SIZE = int(os.getenv("RESPONSE_CACHE_DB_SIZE", "50000"))
+# Number of previous (non-system) messages that count as context for the key
+RESPONSE_CACHE_CONTEXT = int(os.getenv("RESPONSE_CACHE_CONTEXT", "2"))
+
+
+def cache_key(question, history):
+    """Key on the normalized question plus a hash of the last few turns before it."""
+    context = [
+        (m["role"], m["content"]) for m in history if m["role"] != "system"
+    ][-RESPONSE_CACHE_CONTEXT:] if RESPONSE_CACHE_CONTEXT else []
+    context_hash = hashlib.sha1(json.dumps(context).encode("utf-8")).hexdigest()
+    return hashlib.sha256(f"{key_text(question)}|{context_hash}".encode("utf-8")).hexdigest()
+
+
+def current_generation():
+    """Changes whenever the Q&A dataset or the published chat model changes.
+
+    Memory corrections are not part of it: memory and fuzzy matches (which
+    include corrections) are checked before the cache, so a new correction
+    takes over its questions without flushing anyone else's replies.
+    """
+    return json.dumps([dataset_store.signature(), model_registry.get("chat")])
+
+
+class _SqliteTier:
+    def __init__(self, path, max_entries):
+        self.path = path
+        self.max_entries = max_entries
+        self._local = threading.local()
+        conn = self._conn()
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                reply TEXT NOT NULL,
+                cost_ms REAL NOT NULL,
+                expires_at REAL NOT NULL,
+                last_used REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_responses_last_used ON responses (last_used);
+            CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT NOT NULL);
+        """)
+        for name in ("hits", "misses", "saved_ms"):
+            conn.execute("INSERT OR IGNORE INTO meta (name, value) VALUES (?, '0')", (name,))
+        conn.commit()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key, now):
+        row = self._conn().execute(
+            "SELECT reply, cost_ms, expires_at FROM responses WHERE key = ?", (key,)
+        ).fetchone()
+        if not row:
+            return None
+        if row[2] <= now:
+            self._conn().execute("DELETE FROM responses WHERE key = ?", (key,))
+            return None
+        self._conn().execute("UPDATE responses SET last_used = ? WHERE key = ?", (now, key))
+        return row[0], row[1], row[2]
+
+    def put(self, key, reply, cost_ms, expires_at, now):
+        conn = self._conn()
+        conn.execute(
+            "INSERT OR REPLACE INTO responses (key, reply, cost_ms, expires_at, last_used) VALUES (?, ?, ?, ?, ?)",
+            (key, reply, cost_ms, expires_at, now)
+        )
+        conn.execute("DELETE FROM responses WHERE expires_at <= ?", (now,))
+        conn.execute(
+            "DELETE FROM responses WHERE key IN ("
+            " SELECT key FROM responses ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,)
+        )
+
+    def sync_generation(self, generation):
+        """Clear the shared tier if another worker has not already done so for this generation."""
+        conn = self._conn()
+        row = conn.execute("SELECT value FROM meta WHERE name = 'generation'").fetchone()
+        if row and row[0] == generation:
+            return
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM responses")
+            conn.execute("INSERT OR REPLACE INTO meta (name, value) VALUES ('generation', ?)", (generation,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def record(self, hits=0, misses=0, saved_ms=0.0):
+        conn = self._conn()
+        for name, delta in (("hits", hits), ("misses", misses), ("saved_ms", saved_ms)):
+            if delta:
+                conn.execute("UPDATE meta SET value = value + ? WHERE name = ?", (delta, name))
+
+    def totals(self):
+        rows = dict(self._conn().execute(
+            "SELECT name, value FROM meta WHERE name IN ('hits', 'misses', 'saved_ms')"
+        ).fetchall())
+        return int(float(rows.get("hits", 0))), int(float(rows.get("misses", 0))), float(rows.get("saved_ms", 0))
+
+
+class ResponseCache:
+    """Two-tier cache for model replies.
+
+    An in-process LRU (size-bounded, per-entry TTL) sits in front of an
+    optional SQLite file shared by every worker on the host. Both tiers are
+    dropped automatically when the dataset file or the chat model changes,
+    since either can change what the right answer is.
+    """
+
+    def __init__(self, max_entries=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL,
+                 db_path=RESPONSE_CACHE_DB, db_max_entries=RESPONSE_CACHE_DB_SIZE):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()   # key -> (reply, cost_ms, expires_at)
+        self._generation = None
+        self._shared = _SqliteTier(db_path, db_max_entries) if db_path else None
+        self.hits = 0
+        self.misses = 0
+        self.saved_ms = 0.0
+
+    def _check_generation(self):
+        generation = current_generation()
+        if generation == self._generation:
+            return
+        with self._lock:
+            self._entries.clear()
+        if self._shared:
+            self._shared.sync_generation(generation)
+        self._generation = generation
+
+    def get(self, key):
+        self._check_generation()
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[2] <= now:
+                del self._entries[key]
+                entry = None
+            if entry:
+                self._entries.move_to_end(key)
+        if entry is None and self._shared:
+            entry = self._shared.get(key, now)
+            if entry:
+                self._store_local(key, entry)
+        self._record(entry)
+        return entry[0] if entry else None
+
+    def put(self, key, reply, cost_ms):
+        now = time.time()
+        entry = (reply, cost_ms, now + self.ttl)
+        self._store_local(key, entry)
+        if self._shared:
+            self._shared.put(key, reply, cost_ms, entry[2], now)
+
+    def _store_local(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _record(self, entry):
+        with self._lock:
+            if entry:
+                self.hits += 1
+                self.saved_ms += entry[1]
+            else:
+                self.misses += 1
+        if self._shared:
+            if entry:
+                self._shared.record(hits=1, saved_ms=entry[1])
+            else:
+                self._shared.record(misses=1)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+        self._generation = None
+
+    def stats(self):
+        """Hit ratio and time saved; summed over all workers when the shared tier is on."""
+        if self._shared:
+            hits, misses, saved_ms = self._shared.totals()
+        else:
+            hits, misses, saved_ms = self.hits, self.misses, self.saved_ms
+        total = hits + misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_ratio": round(hits / total * 100, 1) if total else 0,
+            "saved_seconds": round(saved_ms / 1000, 1),
+            "entries": len(self._entries),
+        }
+
+
+response_cache = ResponseCache()
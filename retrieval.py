@@ -0,0 +1,195 @@
+import json
+import re
+import threading
+
+import numpy as np
+from scipy import sparse
+
+from qa_store import DATASET_PATH, dataset_store, file_signature  # noqa: F401  (re-exported)
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text):
+    return _TOKEN_RE.findall((text or "").lower())
+
+
+def load_qa_pairs(path=DATASET_PATH):
+    """Read (question, answer) pairs from a chat-format JSONL file."""
+    pairs = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                item = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            pair = qa_pair_from_messages(item.get("messages", []))
+            if pair:
+                pairs.append(pair)
+    return pairs
+
+
+def qa_pair_from_messages(messages):
+    question = next((m.get("content", "") for m in messages if m.get("role") == "user"), "")
+    answer = next((m.get("content", "") for m in messages if m.get("role") == "assistant"), "")
+    return (question, answer) if question and answer else None
+
+
+class RetrievalEngine:
+    """BM25-weighted sparse retrieval over the Q&A dataset.
+
+    Each question becomes a row of BM25 term weights in a sparse matrix; rows are
+    L2-normalised so a query's dot product is a cosine score in [0, 1] that can
+    be compared against a fixed confidence threshold.
+
+    Rows are kept per distinct (question, answer) pair and only ever appended:
+    when the dataset store reports changed ids, new pairs are tokenized into new
+    rows and pairs that no longer exist are switched off, then the BM25 weights
+    are recomputed from the stored term counts with a few array operations. The
+    whole dataset is reread only when the store cannot list its changes.
+    """
+
+    def __init__(self, store=dataset_store, k1=1.5, b=0.75):
+        self.store = store
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.Lock()
+        self._signature = None
+        self._cursor = None
+        self._generation = 0
+        self._reset()
+        # (generation, pairs, vocab, idf, matrix, alive) swapped as one tuple so readers never mix builds
+        self._state = (0, [], {}, np.zeros(0), sparse.csc_matrix((0, 0)), np.zeros(0, dtype=bool))
+
+    @property
+    def pairs(self):
+        return self._state[1]
+
+    def live_pairs(self):
+        _, pairs, _, _, _, alive = self._state
+        return [pair for pair, live in zip(pairs, alive.tolist()) if live]
+
+    def dataset_view(self):
+        """``(generation, pairs, alive)``: rows are append-only within one generation."""
+        generation, pairs, _, _, _, alive = self._state
+        return generation, pairs, alive
+
+    def refresh_if_changed(self):
+        signature = self.store.signature()
+        if signature == self._signature:
+            return
+        with self._lock:
+            if signature == self._signature:
+                return
+            cursor, changes = self.store.changes_since(self._cursor)
+            if changes is None:
+                self._reset()
+                self._generation += 1
+                changes = self.store.iter_rows() if signature else []
+            for qa_id, messages in changes:
+                self._apply(qa_id, messages)
+            self._build()
+            self._signature = signature
+            self._cursor = cursor
+
+    def _reset(self):
+        self._pair_of_id = {}       # dataset row id -> its (question, answer)
+        self._ids_of_pair = {}      # pair -> ids holding it (exact duplicates share one row)
+        self._row_of_pair = {}      # pair -> matrix row
+        self._pairs = []
+        self._alive = []
+        self._vocab = {}
+        self._tf = sparse.csr_matrix((0, 0))
+        self._doc_lens = np.zeros(0)
+        self._pending = []          # pairs waiting to be tokenized into new rows
+
+    def _apply(self, qa_id, messages):
+        pair = qa_pair_from_messages(messages) if messages else None
+        old = self._pair_of_id.pop(qa_id, None)
+        if old is not None:
+            ids = self._ids_of_pair[old]
+            ids.discard(qa_id)
+            if not ids:
+                del self._ids_of_pair[old]
+                self._alive[self._row_of_pair.pop(old)] = False
+        if pair is None:
+            return
+        self._pair_of_id[qa_id] = pair
+        self._ids_of_pair.setdefault(pair, set()).add(qa_id)
+        if pair not in self._row_of_pair:
+            self._row_of_pair[pair] = len(self._pairs)
+            self._pairs.append(pair)
+            self._alive.append(True)
+            self._pending.append(pair)
+
+    def _build(self):
+        # Term counts for the new rows only
+        vocab = self._vocab
+        rows, cols, tfs = [], [], []
+        doc_lens = np.zeros(len(self._pending))
+        for row, (question, _) in enumerate(self._pending):
+            counts = {}
+            for tok in tokenize(question):
+                col = vocab.setdefault(tok, len(vocab))
+                counts[col] = counts.get(col, 0) + 1
+            doc_lens[row] = sum(counts.values())
+            for col, tf in counts.items():
+                rows.append(row)
+                cols.append(col)
+                tfs.append(tf)
+        n_terms = len(vocab)
+        new_tf = sparse.csr_matrix((np.array(tfs, dtype=float), (rows, cols)), shape=(len(self._pending), n_terms))
+        old_tf = self._tf
+        old_tf.resize((old_tf.shape[0], n_terms))
+        self._tf = tf = sparse.vstack([old_tf, new_tf], format="csr")
+        self._doc_lens = doc_lens = np.concatenate((self._doc_lens, doc_lens))
+        self._pending = []
+
+        # BM25 over the live rows; switched-off rows keep their counts but weigh nothing
+        alive = np.array(self._alive, dtype=bool)
+        row_of_nz = np.repeat(np.arange(tf.shape[0]), np.diff(tf.indptr))
+        live_nz = alive[row_of_nz]
+        n_docs = int(alive.sum())
+        df = np.bincount(tf.indices[live_nz], minlength=n_terms)
+        idf = np.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+        idf[df == 0] = 0.0   # terms only dead rows had
+
+        # BM25 saturation + length normalisation, applied to the stored non-zeros only
+        avgdl = doc_lens[alive].mean() if n_docs else 0.0
+        norm = self.k1 * (1 - self.b + self.b * doc_lens / (avgdl or 1.0))
+        data = tf.data * (self.k1 + 1) / (tf.data + norm[row_of_nz]) * idf[tf.indices] * live_nz
+        weighted = sparse.csr_matrix((data, tf.indices, tf.indptr), shape=tf.shape)
+
+        row_norms = np.sqrt(np.asarray(weighted.multiply(weighted).sum(axis=1)).ravel())
+        row_norms[row_norms == 0] = 1.0
+        # Stored column-major: queries only touch the columns of their terms
+        matrix = (sparse.diags(1 / row_norms) @ weighted).tocsc()
+        self._state = (self._generation, list(self._pairs), dict(vocab), idf, matrix, alive)
+
+    def search(self, query, k=3):
+        """Return up to ``k`` hits as dicts with question, answer and score."""
+        self.refresh_if_changed()
+        _, pairs, vocab, idf, matrix, alive = self._state
+        terms = set(tokenize(query))
+        cols = sorted({vocab[t] for t in terms if t in vocab and idf[vocab[t]] > 0})
+        if not cols:
+            return []
+        # Words no live question uses still count in the query's norm, at the idf of an unseen term:
+        # otherwise "fees at KNUST" scores like "fees" and gets RMU's answer
+        unseen = sum(1 for t in terms if t not in vocab or idf[vocab[t]] == 0)
+        unseen_idf = np.log(1 + (int(alive.sum()) + 0.5) / 0.5)
+        weights = idf[cols]
+        weights = weights / np.sqrt(weights @ weights + unseen * unseen_idf ** 2)
+        scores = matrix[:, cols] @ weights
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [
+            {"question": pairs[i][0], "answer": pairs[i][1], "score": float(scores[i])}
+            for i in top if scores[i] > 0
+        ]
+
+
+retrieval_engine = RetrievalEngine()
@@ -0,0 +1,135 @@
+"""Saved chat sessions: append-only messages with server-side sequence numbers.
+
+Each save sends only the messages added since the last sequence number the
+server acknowledged; they are inserted into ``chat_session_messages`` and the
+session's ``message_count`` moves forward. "Chat N" names come from a
+per-owner counter row instead of searching the owner's earlier sessions.
+Schema: migrations/004_session_messages.sql.
+"""
+import json
+import os
+
+SESSION_PAGE_SIZE = int(os.getenv("SESSION_PAGE_SIZE", "50"))
+SESSION_MAX_APPEND = int(os.getenv("SESSION_MAX_APPEND", "500"))
+
+
+class SequenceConflict(Exception):
+    """The client's base sequence is not the session's current one (e.g. another tab saved)."""
+
+    def __init__(self, current_seq):
+        super().__init__(f"Session is at sequence {current_seq}")
+        self.current_seq = current_seq
+
+
+def owner_key(student_id=None, guest_id=None):
+    return f"guest:{guest_id}" if guest_id else f"student:{student_id}"
+
+
+def next_session_name(cursor, owner):
+    """Bump and read the owner's counter; call inside the transaction that creates the session."""
+    cursor.execute(
+        "INSERT INTO chat_session_counters (owner, last_number) VALUES (%s, 1) "
+        "ON DUPLICATE KEY UPDATE last_number = last_number + 1",
+        (owner,)
+    )
+    cursor.execute("SELECT last_number FROM chat_session_counters WHERE owner = %s", (owner,))
+    return f"Chat {cursor.fetchone()[0]}"
+
+
+def create_session(cursor, student_id, guest_id, user_type):
+    """Insert an empty session; returns ``(session_id, session_name)``."""
+    session_name = next_session_name(cursor, owner_key(student_id, guest_id))
+    cursor.execute(
+        """
+        INSERT INTO chat_sessions (session_name, student_id, user_type, guest_id, message_count, created_at)
+        VALUES (%s, %s, %s, %s, 0, NOW())
+        """,
+        (session_name, student_id, user_type, guest_id)
+    )
+    return cursor.lastrowid, session_name
+
+
+def _owned(sql, session_id, student_id=None, guest_id=None):
+    """``sql`` restricted to one session of the given owner (no owner: admin access)."""
+    sql += " WHERE id = %s"
+    params = [session_id]
+    if guest_id:
+        sql += " AND guest_id = %s"
+        params.append(guest_id)
+    elif student_id:
+        sql += " AND student_id = %s"
+        params.append(student_id)
+    return sql, params
+
+
+def find_session(cursor, session_id, student_id=None, guest_id=None):
+    """``(session_name, message_count)`` if the session exists (and belongs to the given owner).
+
+    Sessions saved as one ``messages`` blob before per-message storage are
+    moved into ``chat_session_messages`` here, on first touch; the caller commits.
+    """
+    cursor.execute(*_owned("SELECT session_name, message_count, messages FROM chat_sessions",
+                           session_id, student_id, guest_id))
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    session_name, message_count, legacy = row
+    if not message_count and legacy:
+        try:
+            old = json.loads(legacy)
+        except (TypeError, ValueError):
+            old = []
+        if isinstance(old, list) and old:
+            message_count = append_messages(cursor, session_id, 0, old)
+            cursor.execute("UPDATE chat_sessions SET messages = NULL WHERE id = %s", (session_id,))
+    return session_name, message_count
+
+
+def append_messages(cursor, session_id, base_seq, messages):
+    """Append ``messages`` after ``base_seq``; returns the new last sequence number.
+
+    The conditional UPDATE is the concurrency check: it only matches while the
+    session is still at ``base_seq``, so two racing saves cannot interleave.
+    """
+    if not messages:
+        cursor.execute("SELECT message_count FROM chat_sessions WHERE id = %s", (session_id,))
+        return cursor.fetchone()[0]
+    new_seq = base_seq + len(messages)
+    cursor.execute(
+        "UPDATE chat_sessions SET message_count = %s WHERE id = %s AND message_count = %s",
+        (new_seq, session_id, base_seq)
+    )
+    if cursor.rowcount != 1:
+        cursor.execute("SELECT message_count FROM chat_sessions WHERE id = %s", (session_id,))
+        row = cursor.fetchone()
+        raise SequenceConflict(row[0] if row else 0)
+    cursor.executemany(
+        "INSERT INTO chat_session_messages (session_id, seq, role, content) VALUES (%s, %s, %s, %s)",
+        [(session_id, base_seq + i, m.get("role", "user"), m.get("content", ""))
+         for i, m in enumerate(messages, start=1)]
+    )
+    return new_seq
+
+
+def load_messages(cursor, session_id, before=None, limit=SESSION_PAGE_SIZE):
+    """The newest ``limit`` messages before sequence ``before``, oldest first, plus whether more exist."""
+    sql = "SELECT seq, role, content FROM chat_session_messages WHERE session_id = %s"
+    params = [session_id]
+    if before:
+        sql += " AND seq < %s"
+        params.append(before)
+    cursor.execute(sql + " ORDER BY seq DESC LIMIT %s", params + [limit + 1])
+    rows = cursor.fetchall()
+    more = len(rows) > limit
+    page = [{"seq": seq, "role": role, "content": content} for seq, role, content in rows[:limit]]
+    page.reverse()
+    return page, more
+
+
+def delete_session(cursor, session_id, student_id=None, guest_id=None):
+    """Delete an owned session and its messages; returns whether anything was deleted."""
+    cursor.execute(*_owned("DELETE FROM chat_sessions", session_id, student_id, guest_id))
+    if cursor.rowcount != 1:
+        return False
+    cursor.execute("DELETE FROM chat_session_messages WHERE session_id = %s", (session_id,))
+    return True
@@ -0,0 +1,170 @@
+"""Coalesce identical upstream calls that are in flight at the same time.
+
+The first caller for a key (the leader) makes the call; callers arriving
+with the same key before it finishes (followers) wait for the leader's
+result instead of making their own. Followers get the leader's exception
+if it fails, and ``FlightTimeout`` if it takes longer than ``timeout``;
+a timed-out follower does not cancel the leader. Nothing is kept once a
+flight lands: the next caller starts a new flight (reuse across time is
+the response cache's job).
+
+Flights are per process, so under gunicorn identical questions can still
+reach OpenAI once per worker. ``ado`` / ``await_flight`` are the asyncio
+versions used by async_app; both kinds of caller share the same flights.
+"""
+import asyncio
+import os
+import threading
+
+from metrics import metrics
+
+SINGLE_FLIGHT_TIMEOUT = float(os.getenv("SINGLE_FLIGHT_TIMEOUT", "60"))   # max wait for a leader (s)
+
+FLIGHT_CALLS = metrics.counter(
+    "chatbot_single_flight_calls_total",
+    "Coalescable upstream calls by outcome: leader (made the call), shared (got the leader's reply), "
+    "shared_error (got the leader's error), timeout (gave up waiting).",
+    ("flight", "outcome"))
+
+
+class FlightTimeout(TimeoutError):
+    pass
+
+
+class FlightAbandoned(Exception):
+    """The leader stopped without a result, e.g. its client disconnected mid-stream."""
+
+
+class Flight:
+    __slots__ = ("done", "value", "error", "followers", "callbacks")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+        self.followers = 0
+        self.callbacks = []   # called once landed (async followers)
+
+
+class SingleFlight:
+    def __init__(self, name, timeout=SINGLE_FLIGHT_TIMEOUT):
+        self.name = name
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._flights = {}
+        self.leaders = 0
+        self.shared = 0
+        self.shared_errors = 0
+        self.timeouts = 0
+
+    def join(self, key):
+        """Return ``(flight, True)`` for the leader, who must ``land`` it, or ``(flight, False)``."""
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                flight.followers += 1
+                return flight, False
+            flight = self._flights[key] = Flight()
+            self.leaders += 1
+        FLIGHT_CALLS.inc(self.name, "leader")
+        return flight, True
+
+    def land(self, key, flight, value=None, error=None):
+        """Publish the leader's result (or error) to every follower and free the key."""
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+            flight.value, flight.error = value, error
+            flight.done.set()
+            callbacks, flight.callbacks = flight.callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def wait(self, flight, timeout=None):
+        """The leader's value; raises its error, or ``FlightTimeout``."""
+        if not flight.done.wait(self.timeout if timeout is None else timeout):
+            self._timed_out()
+        return self._result(flight)
+
+    async def await_flight(self, flight, timeout=None):
+        """``wait`` for coroutines: the event loop is not blocked while the leader works."""
+        loop = asyncio.get_running_loop()
+        landed = loop.create_future()
+
+        def wake():
+            loop.call_soon_threadsafe(lambda: landed.done() or landed.set_result(None))
+
+        with self._lock:
+            if flight.done.is_set():
+                landed.set_result(None)
+            else:
+                flight.callbacks.append(wake)
+        try:
+            await asyncio.wait_for(landed, self.timeout if timeout is None else timeout)
+        except asyncio.TimeoutError:
+            self._timed_out()
+        return self._result(flight)
+
+    def _timed_out(self):
+        with self._lock:
+            self.timeouts += 1
+        FLIGHT_CALLS.inc(self.name, "timeout")
+        raise FlightTimeout(f"{self.name}: gave up waiting for the identical request in flight")
+
+    def _result(self, flight):
+        if flight.error is not None:
+            with self._lock:
+                self.shared_errors += 1
+            FLIGHT_CALLS.inc(self.name, "shared_error")
+            raise flight.error
+        with self._lock:
+            self.shared += 1
+        FLIGHT_CALLS.inc(self.name, "shared")
+        return flight.value
+
+    def do(self, key, fn, *args, **kwargs):
+        """``fn(*args, **kwargs)``, unless the same key is in flight: then its result."""
+        flight, leader = self.join(key)
+        if not leader:
+            return self.wait(flight)
+        try:
+            value = fn(*args, **kwargs)
+        except BaseException as e:
+            # KeyboardInterrupt and friends belong to the leader's thread only
+            self.land(key, flight, error=e if isinstance(e, Exception) else FlightAbandoned(self.name))
+            raise
+        self.land(key, flight, value)
+        return value
+
+    async def ado(self, key, fn, *args, **kwargs):
+        """``await fn(*args, **kwargs)``, unless the same key is in flight: then its result."""
+        flight, leader = self.join(key)
+        if not leader:
+            return await self.await_flight(flight)
+        try:
+            value = await fn(*args, **kwargs)
+        except BaseException as e:
+            # Includes cancellation, e.g. the leader's deadline passed
+            self.land(key, flight, error=e if isinstance(e, Exception) else FlightAbandoned(self.name))
+            raise
+        self.land(key, flight, value)
+        return value
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._flights)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "leaders": self.leaders,
+                "saved": self.shared + self.shared_errors,
+                "shared": self.shared,
+                "shared_errors": self.shared_errors,
+                "timeouts": self.timeouts,
+                "in_flight": len(self._flights),
+            }
+
+
+reply_flights = SingleFlight("reply")
+intent_flights = SingleFlight("intent")
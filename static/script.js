@@ -1,5 +1,8 @@
 let conversation = [];
 let chatCounter = 1;
+// Server copy of the open chat: session id, last acknowledged sequence number, how many
+// entries of `conversation` it already holds, and the oldest loaded seq (for paging back).
+let savedSession = { id: null, seq: 0, saved: 0, firstSeq: null, hasMore: false };
 
 document.addEventListener("DOMContentLoaded", () => {
   const studentId = sessionStorage.getItem("student_id");
@@ -11,9 +14,13 @@ document.addEventListener("DOMContentLoaded", () => {
   if (savedChat) {
     conversation = JSON.parse(savedChat);
     conversation.forEach(msg => {
-      appendMessage(msg.content, msg.role);
+      renderMessage(msg.content, msg.role);
     });
   }
+  const savedState = localStorage.getItem(`${storageKey}_session`);
+  if (savedState) {
+    savedSession = JSON.parse(savedState);
+  }
 
   document.getElementById('send-btn').addEventListener('click', sendMessage);
   document.getElementById('user-input').addEventListener('keypress', function (e) {
@@ -26,19 +33,14 @@ document.addEventListener("DOMContentLoaded", () => {
   document.getElementById("history-btn").addEventListener("click", toggleSidebar);
 
   document.getElementById("new-chat").addEventListener("click", async () => {
-    if (conversation.length) {
-      try {
-        const res = await fetch("/save-session", {
-          method: "POST",
-          headers: { "Content-Type": "application/json" },
-          body: JSON.stringify({ messages: conversation })
-        });
-        const result = await res.json();
+    try {
+      const result = await saveConversation();
+      if (result) {
         alert(`${result.message}`);
         loadSessionList();
-      } catch (err) {
-        alert("⚠️ Failed to save chat.");
       }
+    } catch (err) {
+      alert("⚠️ Failed to save chat.");
     }
 
     try {
@@ -50,6 +52,7 @@ document.addEventListener("DOMContentLoaded", () => {
       document.getElementById("chat-messages").innerHTML = "";
       conversation = [];
       localStorage.removeItem(storageKey); // clear only this user's chat
+      resetSavedSession();
     } catch (err) {
       alert("Something went wrong while resetting the chat.");
     }
@@ -116,6 +119,7 @@ document.addEventListener("DOMContentLoaded", () => {
 
   // Save storageKey to window for reuse in other functions
   window.currentStorageKey = storageKey;
+  renderLoadEarlier();
 });
 
 function showLimitModal() {
@@ -131,12 +135,17 @@ function linkify(text) {
   return text.replace(urlRegex, url => `<a href="${url}" target="_blank" style="color:#0047ab; text-decoration: underline;">${url}</a>`);
 }
 
-function appendMessage(content, role) {
+function renderMessage(content, role, before = null) {
   const container = document.getElementById('chat-messages');
   const msg = document.createElement('div');
   msg.className = role === 'user' ? 'user-message' : 'bot-message';
   msg.innerHTML = linkify(content);
-  container.appendChild(msg);
+  container.insertBefore(msg, before);
+  return msg;
+}
+
+function appendMessage(content, role) {
+  renderMessage(content, role);
   scrollToBottom();
   conversation.push({ role, content });
   updateLocalChatStorage();
@@ -167,12 +176,127 @@ function typeBotResponse(content) {
   type();
 }
 
+// Render Server-Sent Events from /chat/stream as the tokens arrive
+async function streamBotResponse(response, typingDiv) {
+  const container = document.getElementById('chat-messages');
+  const msg = document.createElement('div');
+  msg.className = 'bot-message';
+
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+  let content = '';
+
+  while (true) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+
+    let boundary;
+    while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+      const rawEvent = buffer.slice(0, boundary);
+      buffer = buffer.slice(boundary + 2);
+
+      let eventName = 'message';
+      let dataLine = '';
+      rawEvent.split('\n').forEach(line => {
+        if (line.startsWith('event: ')) eventName = line.slice(7);
+        if (line.startsWith('data: ')) dataLine += line.slice(6);
+      });
+      if (!dataLine) continue;
+      const payload = JSON.parse(dataLine);
+
+      if (eventName === 'done') {
+        content = payload.response;
+      } else if (payload.delta) {
+        if (!msg.parentNode) {
+          typingDiv.remove();
+          container.appendChild(msg);
+        }
+        content += payload.delta;
+      }
+      msg.innerHTML = linkify(content);
+      scrollToBottom();
+    }
+  }
+
+  typingDiv.remove();
+  if (!msg.parentNode) container.appendChild(msg);
+  msg.innerHTML = linkify(content);
+  conversation.push({ role: 'assistant', content });
+  updateLocalChatStorage();
+  scrollToBottom();
+}
+
 function updateLocalChatStorage() {
   if (window.currentStorageKey) {
     localStorage.setItem(window.currentStorageKey, JSON.stringify(conversation));
   }
 }
 
+function updateSavedSessionStorage() {
+  if (window.currentStorageKey) {
+    localStorage.setItem(`${window.currentStorageKey}_session`, JSON.stringify(savedSession));
+  }
+}
+
+function resetSavedSession() {
+  savedSession = { id: null, seq: 0, saved: 0, firstSeq: null, hasMore: false };
+  if (window.currentStorageKey) localStorage.removeItem(`${window.currentStorageKey}_session`);
+}
+
+function postSave(messages) {
+  return fetch("/save-session", {
+    method: "POST",
+    headers: { "Content-Type": "application/json" },
+    body: JSON.stringify({ session_id: savedSession.id, base_seq: savedSession.seq, messages })
+  });
+}
+
+// Send only the messages the server has not acknowledged yet; null if there are none
+async function saveConversation() {
+  let pending = conversation.slice(savedSession.saved);
+  if (!pending.length) return null;
+
+  let res = await postSave(pending);
+  let result = await res.json();
+  if (res.status === 409) {
+    // Saved from another tab in the meantime: skip what it already saved, append the rest
+    const already = await savedAfter(savedSession.seq, pending.length);
+    pending = pending.slice(matchingPrefix(already, pending));
+    savedSession.seq = result.seq;
+    if (!pending.length) {
+      result = { message: "Chat already saved.", session_id: savedSession.id, seq: result.seq };
+    } else {
+      res = await postSave(pending);
+      result = await res.json();
+    }
+  }
+  if (!res.ok && pending.length) throw new Error(result.message);
+
+  savedSession.id = result.session_id;
+  savedSession.seq = result.seq;
+  savedSession.saved = conversation.length;
+  if (savedSession.firstSeq === null) savedSession.firstSeq = 1;
+  updateSavedSessionStorage();
+  return result;
+}
+
+// The saved messages right after sequence `seq`, at most `count` of them
+async function savedAfter(seq, count) {
+  const res = await fetch(`/load-session/${savedSession.id}?before=${seq + count + 1}&limit=${count}`);
+  if (!res.ok) return [];
+  return (await res.json()).messages.filter(m => m.seq > seq);
+}
+
+// How many leading messages of `pending` the server already has, in the same order
+function matchingPrefix(saved, pending) {
+  let n = 0;
+  while (n < saved.length && n < pending.length &&
+         saved[n].role === pending[n].role && saved[n].content === pending[n].content) n++;
+  return n;
+}
+
 function scrollToBottom() {
   const chatWindow = document.getElementById('chat-window');
   chatWindow.scrollTop = chatWindow.scrollHeight;
@@ -218,16 +342,33 @@ async function deleteSession(id) {
 }
 
 async function loadSession(id) {
+  try {
+    await saveConversation();
+  } catch (err) {
+    alert("⚠️ Failed to save chat.");
+    return;
+  }
+
   try {
     const res = await fetch(`/load-session/${id}`);
-    const messages = await res.json();
+    if (!res.ok) throw new Error(res.statusText);
+    const page = await res.json();
     const container = document.getElementById("chat-messages");
     container.innerHTML = "";
     conversation = [];
 
-    messages.forEach(msg => {
+    page.messages.forEach(msg => {
       appendMessage(msg.content, msg.role);
     });
+    savedSession = {
+      id: page.session_id,
+      seq: page.seq,
+      saved: conversation.length,
+      firstSeq: page.messages.length ? page.messages[0].seq : page.seq + 1,
+      hasMore: page.has_more
+    };
+    updateSavedSessionStorage();
+    renderLoadEarlier();
 
     scrollToBottom();
   } catch (err) {
@@ -235,6 +376,50 @@ async function loadSession(id) {
   }
 }
 
+// Long chats load their newest page first; older pages are fetched on demand
+function renderLoadEarlier() {
+  const container = document.getElementById("chat-messages");
+  let button = document.getElementById("load-earlier");
+  if (!savedSession.hasMore) {
+    if (button) button.remove();
+    return;
+  }
+  if (!button) {
+    button = document.createElement("button");
+    button.id = "load-earlier";
+    button.className = "load-earlier";
+    button.textContent = "Load earlier messages";
+    button.addEventListener("click", loadEarlierMessages);
+  }
+  container.insertBefore(button, container.firstChild);
+}
+
+async function loadEarlierMessages() {
+  try {
+    const res = await fetch(`/load-session/${savedSession.id}?before=${savedSession.firstSeq}`);
+    if (!res.ok) throw new Error(res.statusText);
+    const page = await res.json();
+    const container = document.getElementById("chat-messages");
+    const button = document.getElementById("load-earlier");
+    const anchor = button ? button.nextSibling : container.firstChild;
+    const oldHeight = container.scrollHeight;
+
+    page.messages.forEach(msg => renderMessage(msg.content, msg.role, anchor));
+    conversation = page.messages.map(({ role, content }) => ({ role, content })).concat(conversation);
+    savedSession.saved += page.messages.length;
+    if (page.messages.length) savedSession.firstSeq = page.messages[0].seq;
+    savedSession.hasMore = page.has_more;
+    updateLocalChatStorage();
+    updateSavedSessionStorage();
+    renderLoadEarlier();
+
+    const chatWindow = document.getElementById('chat-window');
+    chatWindow.scrollTop += container.scrollHeight - oldHeight;
+  } catch (err) {
+    alert("Failed to load earlier messages.");
+  }
+}
+
 async function sendMessage() {
   const input = document.getElementById('user-input');
   const message = input.value.trim();
@@ -250,12 +435,27 @@ async function sendMessage() {
   scrollToBottom();
 
   try {
-    const response = await fetch('/chat', {
+    // Prefer the streaming endpoint; errors come back as the usual JSON
+    let response = await fetch('/chat/stream', {
       method: 'POST',
       headers: { 'Content-Type': 'application/json' },
       body: JSON.stringify({ message })
     });
 
+    const contentType = response.headers.get('Content-Type') || '';
+    if (response.ok && response.body && contentType.startsWith('text/event-stream')) {
+      await streamBotResponse(response, typingDiv);
+      return;
+    }
+
+    if (response.status === 404) {
+      response = await fetch('/chat', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ message })
+      });
+    }
+
     const data = await response.json();
     typingDiv.remove();
 
@@ -0,0 +1,413 @@
+"""Token and cost accounting for every ChatCompletion call.
+
+``create_completion(purpose, **kwargs)`` stands in for
+``openai.ChatCompletion.create``. Before sending, it estimates the prompt
+with the local tokenizer; afterwards it records the prompt and completion
+tokens reported in the response ``usage``. Streamed replies carry no usage,
+so their completion is counted locally and the call is marked as estimated.
+
+Calls belong to the request they run in, opened with
+``RequestUsage(user_type).active()`` (the chat pipeline carries it into its
+worker threads). The intent is known only once the request has been
+classified, so ``RequestUsage.finish(intent)`` is what adds the request's
+calls to the totals.
+
+Totals are kept in memory per (hour, user type, intent, purpose): a few
+counters plus fixed-bucket histograms of prompt and completion tokens, which
+stay additive, so percentiles can be read back after summing the rows of
+every worker. A background thread adds them to ``token_usage_hourly`` and
+``token_usage_buckets`` every ``USAGE_FLUSH_INTERVAL`` seconds
+(migrations/005_token_usage.sql).
+"""
+import atexit
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import openai
+
+from db import db_connection
+from metrics import STAGE_ERRORS, STAGE_SECONDS
+from resilience import openai_guard
+
+try:
+    import tiktoken
+except ImportError:   # token counts fall back to an estimate
+    tiktoken = None
+
+logger = logging.getLogger(__name__)
+
+USAGE_FLUSH_INTERVAL = float(os.getenv("USAGE_FLUSH_INTERVAL", "60"))
+USAGE_TOKENIZER_MODEL = os.getenv("USAGE_TOKENIZER_MODEL", "gpt-3.5-turbo")
+# USD per million (prompt, completion) tokens, matched on the longest model-name prefix
+USAGE_PRICES = json.loads(os.getenv("USAGE_PRICES", json.dumps({
+    "ft:gpt-3.5-turbo": [3.0, 6.0],
+    "gpt-3.5-turbo": [0.5, 1.5],
+})))
+
+# Upper bounds of the token histogram buckets; one more bucket counts everything above
+TOKEN_BUCKETS = (16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384)
+COUNTERS = ("calls", "errors", "estimated_calls", "prompt_tokens", "completion_tokens",
+            "estimated_prompt_tokens", "cost_micro_usd", "latency_ms")
+METRICS = ("prompt", "completion")
+
+
+# ✅ Tokens
+class TokenCounter:
+    """Chat-format token counts as the API bills them (or an estimate without tiktoken)."""
+
+    def __init__(self, model=USAGE_TOKENIZER_MODEL):
+        self._encoding = None
+        if tiktoken:
+            try:
+                self._encoding = tiktoken.encoding_for_model(model)
+            except KeyError:
+                self._encoding = tiktoken.get_encoding("cl100k_base")
+        self.name = f"tiktoken:{self._encoding.name}" if self._encoding else "estimate:chars/4"
+
+    def text(self, text):
+        if self._encoding:
+            return len(self._encoding.encode(text))
+        return (len(text) + 3) // 4
+
+    def messages(self, messages):
+        # 3 tokens of framing per message, 3 to prime the reply
+        return sum(3 + self.text(m["role"]) + self.text(m["content"]) for m in messages) + 3
+
+
+token_counter = TokenCounter()
+
+
+def price(model):
+    """``(prompt, completion)`` USD per million tokens for ``model``."""
+    match = max((prefix for prefix in USAGE_PRICES if (model or "").startswith(prefix)), key=len, default=None)
+    return USAGE_PRICES[match] if match else (0.0, 0.0)
+
+
+def bucket_index(tokens):
+    for i, bound in enumerate(TOKEN_BUCKETS):
+        if tokens <= bound:
+            return i
+    return len(TOKEN_BUCKETS)
+
+
+def percentile(histogram, pct):
+    """Upper bound of the bucket holding the ``pct`` percentile (None when empty)."""
+    total = sum(histogram)
+    if not total:
+        return None
+    rank, seen = total * pct / 100, 0
+    for i, count in enumerate(histogram):
+        seen += count
+        if seen >= rank and count:
+            return TOKEN_BUCKETS[i] if i < len(TOKEN_BUCKETS) else f">{TOKEN_BUCKETS[-1]}"
+    return f">{TOKEN_BUCKETS[-1]}"
+
+
+# ✅ Per-request attribution
+_current = contextvars.ContextVar("request_usage", default=None)
+
+
+class RequestUsage:
+    def __init__(self, user_type):
+        self.user_type = user_type
+        self.intent = None
+        self.calls = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def active(self):
+        """Attribute ChatCompletion calls made inside the block (and stages it starts) to this request."""
+        token = _current.set(self)
+        try:
+            yield self
+        finally:
+            _current.reset(token)
+
+    def add(self, call):
+        with self._lock:
+            if self.intent is None:
+                self.calls.append(call)
+                return
+        token_usage.add(self.user_type, self.intent, call)   # a call that outlived classification
+
+    def finish(self, intent):
+        with self._lock:
+            self.intent, calls, self.calls = intent or "unknown", self.calls, []
+        for call in calls:
+            token_usage.add(self.user_type, self.intent, call)
+
+
+# ✅ ChatCompletion wrapper
+def create_completion(purpose, **kwargs):
+    """``openai.ChatCompletion.create(**kwargs)``, accounted under ``purpose`` (reply, intent, ...).
+
+    Runs under ``openai_guard`` (deadline, retries, hedging, circuit
+    breaker); every attempt is accounted, including failed and hedged ones.
+    """
+    return openai_guard.call(purpose, lambda **attempt: _create_once(purpose, **attempt), kwargs,
+                             hedge=not kwargs.get("stream"))
+
+
+async def acreate_completion(purpose, **kwargs):
+    """``create_completion`` for coroutines, via ``openai.ChatCompletion.acreate`` (no streaming)."""
+    return await openai_guard.acall(purpose, lambda **attempt: _acreate_once(purpose, **attempt), kwargs)
+
+
+def _create_once(purpose, **kwargs):
+    estimate = token_counter.messages(kwargs.get("messages") or [])
+    started = time.perf_counter()
+    try:
+        response = openai.ChatCompletion.create(**kwargs)
+    except Exception:
+        _record(purpose, kwargs.get("model"), estimate, None, 0, started, error=True)
+        raise
+    if kwargs.get("stream"):
+        return _counted_stream(response, purpose, kwargs.get("model"), estimate, started)
+    usage = response.get("usage") or {}
+    _record(purpose, kwargs.get("model"), estimate, usage.get("prompt_tokens"),
+            usage.get("completion_tokens", 0), started)
+    return response
+
+
+async def _acreate_once(purpose, **kwargs):
+    estimate = token_counter.messages(kwargs.get("messages") or [])
+    started = time.perf_counter()
+    try:
+        response = await openai.ChatCompletion.acreate(**kwargs)
+    except BaseException:   # also cancellation at a deadline
+        _record(purpose, kwargs.get("model"), estimate, None, 0, started, error=True)
+        raise
+    usage = response.get("usage") or {}
+    _record(purpose, kwargs.get("model"), estimate, usage.get("prompt_tokens"),
+            usage.get("completion_tokens", 0), started)
+    return response
+
+
+def _counted_stream(chunks, purpose, model, estimate, started):
+    parts, error = [], False
+    try:
+        for chunk in chunks:
+            delta = chunk.choices[0].get("delta", {}).get("content")
+            if delta:
+                parts.append(delta)
+            yield chunk
+    except Exception:
+        error = True
+        raise
+    finally:
+        # Also runs when the client goes away mid-stream: the tokens were still generated
+        _record(purpose, model, estimate, None, token_counter.text("".join(parts)), started, error=error)
+
+
+def _record(purpose, model, estimate, prompt_tokens, completion_tokens, started, error=False):
+    latency = time.perf_counter() - started
+    STAGE_SECONDS.observe(latency, f"openai_{purpose}")
+    if error:
+        STAGE_ERRORS.inc(f"openai_{purpose}")
+    prompt_price, completion_price = price(model)
+    prompt = estimate if prompt_tokens is None else prompt_tokens
+    call = {
+        "at": datetime.now(),
+        "purpose": purpose,
+        "estimated": prompt_tokens is None,
+        "error": error,
+        "prompt_tokens": prompt,
+        "completion_tokens": completion_tokens or 0,
+        "estimated_prompt_tokens": estimate,
+        "cost_micro_usd": round(prompt * prompt_price + (completion_tokens or 0) * completion_price),
+        "latency_ms": latency * 1000,
+    }
+    request = _current.get()
+    if request is not None:
+        request.add(call)
+    else:
+        token_usage.add("system", "-", call)
+
+
+# ✅ Aggregation
+def _new_entry():
+    return {"counters": [0] * len(COUNTERS), "prompt": [0] * (len(TOKEN_BUCKETS) + 1),
+            "completion": [0] * (len(TOKEN_BUCKETS) + 1)}
+
+
+def _merge(target, entry):
+    target["counters"] = [a + b for a, b in zip(target["counters"], entry["counters"])]
+    for metric in METRICS:
+        target[metric] = [a + b for a, b in zip(target[metric], entry[metric])]
+
+
+class TokenUsage:
+    """Per-hour totals in memory, added to the database by a background thread."""
+
+    def __init__(self, flush_interval=USAGE_FLUSH_INTERVAL):
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._pending = {}   # (hour, user_type, intent, purpose) -> entry
+        self._thread = None
+        self._stop = threading.Event()
+        self.flushes = 0
+        self.failed_flushes = 0
+
+    def add(self, user_type, intent, call):
+        key = (call["at"].replace(minute=0, second=0, microsecond=0), user_type or "anonymous", intent, call["purpose"])
+        with self._lock:
+            entry = self._pending.get(key)
+            if entry is None:
+                entry = self._pending[key] = _new_entry()
+            counters = entry["counters"]
+            counters[0] += 1
+            counters[1] += call["error"]
+            counters[2] += call["estimated"]
+            counters[3] += call["prompt_tokens"]
+            counters[4] += call["completion_tokens"]
+            counters[5] += call["estimated_prompt_tokens"]
+            counters[6] += call["cost_micro_usd"]
+            counters[7] += round(call["latency_ms"])
+            entry["prompt"][bucket_index(call["prompt_tokens"])] += 1
+            entry["completion"][bucket_index(call["completion_tokens"])] += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="token-usage-flush", daemon=True)
+                self._thread.start()
+                atexit.register(self.close)
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def close(self):
+        self._stop.set()
+        self.flush()
+
+    def flush(self):
+        """Add the pending totals to the database; on failure they are kept for the next try."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return True
+        try:
+            with db_connection() as conn:
+                cursor = conn.cursor()
+                write_usage(cursor, pending)
+                conn.commit()
+        except Exception:
+            logger.exception("Token usage flush failed; keeping %d rows for the next one", len(pending))
+            with self._lock:
+                for key, entry in pending.items():
+                    _merge(self._pending.setdefault(key, _new_entry()), entry)
+                self.failed_flushes += 1
+            return False
+        self.flushes += 1
+        return True
+
+    def pending(self):
+        with self._lock:
+            return {key: {"counters": list(e["counters"]), "prompt": list(e["prompt"]),
+                          "completion": list(e["completion"])} for key, e in self._pending.items()}
+
+    def summary(self, cursor, hours=24):
+        """Dashboard views over the last ``hours``: stored rows plus this worker's unflushed totals."""
+        since = datetime.now().replace(minute=0, second=0, microsecond=0) - timedelta(hours=hours - 1)
+        rows = read_usage(cursor, since)
+        for key, entry in self.pending().items():
+            if key[0] >= since:
+                _merge(rows.setdefault(key, _new_entry()), entry)
+        return summarize(rows, since, hours)
+
+
+def write_usage(cursor, entries):
+    totals, buckets = [], []
+    for (hour, user_type, intent, purpose), entry in entries.items():
+        totals.append((hour, user_type, intent, purpose, *entry["counters"], *entry["counters"]))
+        for metric in METRICS:
+            buckets.extend((hour, user_type, intent, purpose, metric, i, count, count)
+                           for i, count in enumerate(entry[metric]) if count)
+    cursor.executemany(
+        f"INSERT INTO token_usage_hourly (hour, user_type, intent, purpose, {', '.join(COUNTERS)}) "
+        f"VALUES (%s, %s, %s, %s, {', '.join(['%s'] * len(COUNTERS))}) "
+        f"ON DUPLICATE KEY UPDATE {', '.join(f'{c} = {c} + %s' for c in COUNTERS)}",
+        totals
+    )
+    if buckets:
+        cursor.executemany(
+            "INSERT INTO token_usage_buckets (hour, user_type, intent, purpose, metric, bucket, count) "
+            "VALUES (%s, %s, %s, %s, %s, %s, %s) ON DUPLICATE KEY UPDATE count = count + %s",
+            buckets
+        )
+
+
+def read_usage(cursor, since):
+    rows = {}
+    cursor.execute(
+        f"SELECT hour, user_type, intent, purpose, {', '.join(COUNTERS)} FROM token_usage_hourly WHERE hour >= %s",
+        (since,)
+    )
+    for row in cursor.fetchall():
+        rows.setdefault(_key(row[:4]), _new_entry())["counters"] = [int(v) for v in row[4:]]
+    cursor.execute(
+        "SELECT hour, user_type, intent, purpose, metric, bucket, count FROM token_usage_buckets WHERE hour >= %s",
+        (since,)
+    )
+    for row in cursor.fetchall():
+        entry = rows.setdefault(_key(row[:4]), _new_entry())
+        if row[4] in METRICS and 0 <= row[5] <= len(TOKEN_BUCKETS):
+            entry[row[4]][row[5]] += int(row[6])
+    return rows
+
+
+def _key(row):
+    hour = row[0] if isinstance(row[0], datetime) else datetime.fromisoformat(str(row[0]))
+    return hour, row[1], row[2], row[3]
+
+
+def summarize(rows, since, hours):
+    """Hourly rates, a per user type and intent breakdown and token percentiles."""
+    def view(entry):
+        counters = dict(zip(COUNTERS, entry["counters"]))
+        calls = counters["calls"] or 1
+        return {
+            "calls": counters["calls"],
+            "errors": counters["errors"],
+            "prompt_tokens": counters["prompt_tokens"],
+            "completion_tokens": counters["completion_tokens"],
+            "avg_prompt_tokens": round(counters["prompt_tokens"] / calls),
+            "avg_latency_ms": round(counters["latency_ms"] / calls),
+            "cost_usd": round(counters["cost_micro_usd"] / 1e6, 4),
+            "prompt_p50": percentile(entry["prompt"], 50),
+            "prompt_p95": percentile(entry["prompt"], 95),
+            "completion_p50": percentile(entry["completion"], 50),
+            "completion_p95": percentile(entry["completion"], 95),
+        }
+
+    total, by_hour, by_segment = _new_entry(), {}, {}
+    for (hour, user_type, intent, purpose), entry in rows.items():
+        _merge(total, entry)
+        _merge(by_hour.setdefault(hour, _new_entry()), entry)
+        _merge(by_segment.setdefault((user_type, intent, purpose), _new_entry()), entry)
+
+    overall = view(total)
+    overall["tokens_per_hour"] = round((overall["prompt_tokens"] + overall["completion_tokens"]) / hours)
+    overall["cost_per_hour_usd"] = round(overall["cost_usd"] / hours, 4)
+    counters = dict(zip(COUNTERS, total["counters"]))
+    overall["estimated_calls"] = counters["estimated_calls"]
+    # How far the pre-send estimate is from what was billed (estimated calls count as exact)
+    overall["estimate_error_pct"] = round((counters["estimated_prompt_tokens"] - counters["prompt_tokens"])
+                                          / counters["prompt_tokens"] * 100, 1) if counters["prompt_tokens"] else 0
+    overall["tokenizer"] = token_counter.name
+    hourly = []
+    for i in range(hours):
+        hour = since + timedelta(hours=i)
+        entry = by_hour.get(hour)
+        if entry:
+            hourly.append(dict(view(entry), hour=hour.strftime("%d %b %H:00")))
+    segments = [dict(view(entry), user_type=key[0], intent=key[1], purpose=key[2])
+                for key, entry in sorted(by_segment.items(), key=lambda item: -item[1]["counters"][3])]
+    return {"hours": hours, "overall": overall, "hourly": hourly, "segments": segments}
+
+
+token_usage = TokenUsage()
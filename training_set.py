@@ -0,0 +1,370 @@
+"""Compile the fine-tuning training set.
+
+Merges the Q&A dataset, the extra datasets (``TRAINING_EXTRA_DATASETS``,
+``dataset2.jsonl`` by default), uploaded files and memory corrections into train and
+validation JSONL shards plus a ``manifest.json``::
+
+    python training_set.py --out data/training
+
+Two streaming passes keep memory flat:
+
+1. Every example is validated and normalized (``ingest.clean_record``),
+   token-counted and fingerprinted, then spilled to a scratch directory:
+   the example itself, a 64-bit content hash, its token count and a MinHash
+   signature of its word bigrams, as fixed-width arrays on disk.
+2. Decisions are made on those arrays: over-long examples, exact duplicates
+   (same hash) and near duplicates (MinHash LSH bands, confirmed by the
+   estimated Jaccard similarity) are dropped, keeping the first occurrence;
+   the total token budget is applied in hash order, a uniform sample across
+   sources; and the split is taken from the hash, so an example stays on
+   the same side of it from run to run. The spilled examples are then
+   streamed into shards.
+
+The same inputs always produce byte-identical shards and manifest.
+"""
+import argparse
+import glob
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import zlib
+
+import numpy as np
+
+from fuzzy_match import normalize
+from ingest import UPLOAD_DIR, clean_record
+from qa_store import dataset_store
+from token_usage import TokenCounter
+
+logger = logging.getLogger(__name__)
+
+TRAINING_DIR = os.getenv("TRAINING_DIR", "data/training")
+TRAINING_MODEL = os.getenv("TRAINING_MODEL", "gpt-3.5-turbo")
+TRAINING_MAX_EXAMPLE_TOKENS = int(os.getenv("TRAINING_MAX_EXAMPLE_TOKENS", "4096"))
+TRAINING_MAX_TOTAL_TOKENS = int(os.getenv("TRAINING_MAX_TOTAL_TOKENS", "5000000"))   # 0 = no limit
+TRAINING_VALIDATION_FRACTION = float(os.getenv("TRAINING_VALIDATION_FRACTION", "0.1"))
+TRAINING_SHARD_EXAMPLES = int(os.getenv("TRAINING_SHARD_EXAMPLES", "50000"))
+# Comma-separated JSONL files of {"messages": [...]} records; missing files are skipped
+TRAINING_EXTRA_DATASETS = [p for p in os.getenv("TRAINING_EXTRA_DATASETS", "dataset2.jsonl").split(",") if p.strip()]
+# MinHash LSH: BANDS x ROWS hash functions; candidates sharing a band are dropped when
+# their estimated Jaccard similarity reaches TRAINING_NEAR_DUP_JACCARD
+TRAINING_MINHASH_BANDS = int(os.getenv("TRAINING_MINHASH_BANDS", "16"))
+TRAINING_MINHASH_ROWS = int(os.getenv("TRAINING_MINHASH_ROWS", "4"))
+TRAINING_NEAR_DUP_JACCARD = float(os.getenv("TRAINING_NEAR_DUP_JACCARD", "0.7"))
+
+_BLOCK = 10_000                 # examples buffered before their arrays are spilled
+_PRIME = (1 << 31) - 1
+_SPLIT_BUCKETS = 10_000
+
+# Why an example was left out (``reason`` array codes)
+KEPT, TOO_LONG, EXACT_DUPLICATE, NEAR_DUPLICATE, OVER_BUDGET = range(5)
+_DROP_NAMES = {TOO_LONG: "too_long", EXACT_DUPLICATE: "exact_duplicate",
+               NEAR_DUPLICATE: "near_duplicate", OVER_BUDGET: "over_budget"}
+
+
+# ✅ Fingerprints
+def content_hash(messages):
+    """64-bit hash of the normalized conversation (roles and text)."""
+    text = "\x1e".join(f"{m['role']}\x1f{normalize(m['content'])}" for m in messages)
+    return int.from_bytes(hashlib.sha1(text.encode("utf-8")).digest()[:8], "little")
+
+
+class MinHasher:
+    """MinHash signatures over word bigrams (single words for one-word texts)."""
+
+    def __init__(self, bands=TRAINING_MINHASH_BANDS, rows=TRAINING_MINHASH_ROWS, seed=1):
+        self.bands, self.rows = bands, rows
+        rng = np.random.RandomState(seed)
+        size = bands * rows
+        # (a*x + b) mod p with a, b, x < p = 2**31 - 1 stays inside uint64
+        self._a = rng.randint(1, _PRIME, size=size, dtype=np.uint64)[:, None]
+        self._b = rng.randint(0, _PRIME, size=size, dtype=np.uint64)[:, None]
+        self._mix = rng.randint(1, 1 << 62, size=rows, dtype=np.uint64)
+
+    def signature(self, messages):
+        words = normalize(" ".join(m["content"] for m in messages)).split()
+        shingles = [" ".join(words[i:i + 2]) for i in range(max(len(words) - 1, 1))] or [""]
+        x = np.array([zlib.crc32(s.encode("utf-8")) % _PRIME for s in set(shingles)], dtype=np.uint64)[None, :]
+        return ((self._a * x + self._b) % np.uint64(_PRIME)).min(axis=1).astype(np.uint32)
+
+    def band_hashes(self, signatures, band):
+        """One uint64 per signature row for ``band``; equal rows in the band give equal hashes."""
+        part = signatures[:, band * self.rows:(band + 1) * self.rows].astype(np.uint64)
+        return (part * self._mix).sum(axis=1)   # wraps around; fine for a hash
+
+
+# ✅ Sources
+def iter_sources(include_memory=True, extra_datasets=TRAINING_EXTRA_DATASETS):
+    """``(source name, record)`` for every candidate example, in a fixed order."""
+    for messages in dataset_store.iter_messages():
+        yield "dataset", {"messages": messages}
+    for path in extra_datasets:
+        path = path.strip()
+        if not os.path.exists(path):
+            logger.warning("Extra dataset %s not found, skipped", path)
+            continue
+        for record in _iter_file(path):
+            yield path.replace(os.sep, "/"), record
+    for path in sorted(glob.glob(os.path.join(UPLOAD_DIR, "*.jsonl")) + glob.glob(os.path.join(UPLOAD_DIR, "*.json"))):
+        for record in _iter_file(path):
+            yield path.replace(os.sep, "/"), record
+    if include_memory:
+        from exports import iter_rows
+        for rows in iter_rows("memory_corrections"):
+            for row in rows:
+                yield "memory_corrections", {"messages": [
+                    {"role": "user", "content": row["corrected_question"] or ""},
+                    {"role": "assistant", "content": row["corrected_answer"] or ""},
+                ]}
+
+
+def _iter_file(path):
+    if path.endswith(".json"):
+        # A JSON document (array of records or one record) has to be read whole
+        with open(path, "r", encoding="utf-8") as f:
+            try:
+                document = json.load(f)
+            except ValueError:
+                yield None
+                return
+        yield from document if isinstance(document, list) else [document]
+        return
+    with open(path, "rb") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except (ValueError, UnicodeDecodeError):
+                yield None
+
+
+# ✅ Compiler
+class _Spill:
+    """Scratch files for pass one: examples as JSONL, per-example arrays as raw binary."""
+
+    def __init__(self, directory, width):
+        self.directory = directory
+        self.width = width
+        self.count = 0
+        self.examples = open(os.path.join(directory, "examples.jsonl"), "wb")
+        self._arrays = {name: open(os.path.join(directory, name + ".bin"), "wb")
+                        for name in ("hashes", "tokens", "sources", "signatures")}
+        self._block = {name: [] for name in self._arrays}
+
+    def add(self, source, messages, content, tokens, signature):
+        self.examples.write(json.dumps({"messages": messages}, ensure_ascii=False).encode("utf-8") + b"\n")
+        for name, value in (("sources", source), ("hashes", content), ("tokens", tokens), ("signatures", signature)):
+            self._block[name].append(value)
+        self.count += 1
+        if len(self._block["hashes"]) >= _BLOCK:
+            self.flush()
+
+    def flush(self):
+        if not self._block["hashes"]:
+            return
+        np.array(self._block["hashes"], dtype=np.uint64).tofile(self._arrays["hashes"])
+        np.array(self._block["tokens"], dtype=np.int32).tofile(self._arrays["tokens"])
+        np.array(self._block["sources"], dtype=np.int32).tofile(self._arrays["sources"])
+        np.vstack(self._block["signatures"]).tofile(self._arrays["signatures"])
+        self._block = {name: [] for name in self._arrays}
+
+    def close(self):
+        self.flush()
+        self.examples.close()
+        for f in self._arrays.values():
+            f.close()
+
+    def array(self, name, dtype):
+        return np.fromfile(os.path.join(self.directory, name + ".bin"), dtype=dtype)
+
+    def signatures(self):
+        if not self.count:
+            return np.zeros((0, self.width), dtype=np.uint32)
+        return np.memmap(os.path.join(self.directory, "signatures.bin"), dtype=np.uint32, mode="r",
+                         shape=(self.count, self.width))
+
+
+def compile_training_set(out_dir=TRAINING_DIR, include_memory=True, max_example_tokens=TRAINING_MAX_EXAMPLE_TOKENS,
+                         max_total_tokens=TRAINING_MAX_TOTAL_TOKENS, validation_fraction=TRAINING_VALIDATION_FRACTION,
+                         shard_examples=TRAINING_SHARD_EXAMPLES, sources=None):
+    """Write the shards and manifest into ``out_dir`` (replaced as a whole); returns the manifest."""
+    counter, hasher = TokenCounter(TRAINING_MODEL), MinHasher()
+    source_names, source_stats = [], {}
+    invalid = 0
+    scratch = tempfile.mkdtemp(prefix="training-set-")
+    try:
+        # Pass one: validate, fingerprint and spill
+        spill = _Spill(scratch, hasher.bands * hasher.rows)
+        for name, record in (sources if sources is not None else iter_sources(include_memory)):
+            stats = source_stats.setdefault(name, {"examples": 0, "invalid": 0, "kept": 0, "tokens": 0})
+            stats["examples"] += 1
+            messages, reason = clean_record(record)
+            if reason:
+                stats["invalid"] += 1
+                invalid += 1
+                continue
+            if name not in source_names:
+                source_names.append(name)
+            spill.add(source_names.index(name), messages, content_hash(messages), counter.messages(messages),
+                      hasher.signature(messages))
+        spill.close()
+
+        hashes, tokens = spill.array("hashes", np.uint64), spill.array("tokens", np.int32)
+        source_ids = spill.array("sources", np.int32)
+        reason = _select(hashes, tokens, spill.signatures(), hasher, max_example_tokens, max_total_tokens)
+        validation = (hashes % np.uint64(_SPLIT_BUCKETS)) < int(validation_fraction * _SPLIT_BUCKETS)
+
+        # Pass two: stream the kept examples into shards
+        tmp_out = out_dir.rstrip("/") + ".tmp"
+        shutil.rmtree(tmp_out, ignore_errors=True)
+        os.makedirs(tmp_out)
+        writers = {split: _ShardWriter(tmp_out, split, shard_examples) for split in ("train", "validation")}
+        with open(os.path.join(scratch, "examples.jsonl"), "rb") as examples:
+            for i, line in enumerate(examples):
+                if reason[i] != KEPT:
+                    continue
+                writers["validation" if validation[i] else "train"].write(line, int(tokens[i]))
+                stats = source_stats[source_names[source_ids[i]]]
+                stats["kept"] += 1
+                stats["tokens"] += int(tokens[i])
+
+        kept = reason == KEPT
+        manifest = {
+            "format": 1,
+            "model": TRAINING_MODEL,
+            "tokenizer": counter.name,
+            "params": {
+                "max_example_tokens": max_example_tokens,
+                "max_total_tokens": max_total_tokens,
+                "validation_fraction": validation_fraction,
+                "shard_examples": shard_examples,
+                "minhash": {"bands": hasher.bands, "rows": hasher.rows, "jaccard": TRAINING_NEAR_DUP_JACCARD},
+            },
+            "totals": {"read": sum(s["examples"] for s in source_stats.values()), "kept": int(kept.sum()),
+                       "tokens": int(tokens[kept].sum())},
+            "dropped": dict({"invalid": invalid},
+                            **{name: int((reason == code).sum()) for code, name in _DROP_NAMES.items()}),
+            "sources": source_stats,
+            "splits": {split: writer.close() for split, writer in writers.items()},
+        }
+        with open(os.path.join(tmp_out, "manifest.json"), "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2, ensure_ascii=False)
+            f.write("\n")
+        _swap_dir(tmp_out, out_dir)
+        return manifest
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+def _select(hashes, tokens, signatures, hasher, max_example_tokens, max_total_tokens):
+    """Reason code per example; the earliest example of each duplicate group is kept."""
+    reason = np.full(len(hashes), KEPT, dtype=np.uint8)
+    if max_example_tokens:
+        reason[tokens > max_example_tokens] = TOO_LONG
+
+    # Exact duplicates: stable sort by hash, so the first of each run is the earliest
+    live = np.flatnonzero(reason == KEPT)
+    by_hash = live[np.argsort(hashes[live], kind="stable")]
+    repeats = np.flatnonzero(hashes[by_hash][1:] == hashes[by_hash][:-1]) + 1
+    reason[by_hash[repeats]] = EXACT_DUPLICATE
+
+    # Near duplicates: per band, compare every later member of a bucket with its first member
+    for band in range(hasher.bands):
+        live = np.flatnonzero(reason == KEPT)
+        if len(live) < 2:
+            break
+        keys = np.concatenate([hasher.band_hashes(np.asarray(signatures[live[i:i + _BLOCK * 10]]), band)
+                               for i in range(0, len(live), _BLOCK * 10)])
+        order = np.argsort(keys, kind="stable")
+        sorted_keys = keys[order]
+        starts = np.concatenate(([True], sorted_keys[1:] != sorted_keys[:-1]))
+        leader = order[np.maximum.accumulate(np.where(starts, np.arange(len(order)), 0))]
+        followers = np.flatnonzero(~starts)
+        if not len(followers):
+            continue
+        members, leaders = live[order[followers]], live[leader[followers]]
+        for i in range(0, len(members), _BLOCK):
+            m, l = members[i:i + _BLOCK], leaders[i:i + _BLOCK]
+            similarity = (np.asarray(signatures[m]) == np.asarray(signatures[l])).mean(axis=1)
+            reason[m[similarity >= TRAINING_NEAR_DUP_JACCARD]] = NEAR_DUPLICATE
+
+    # Total budget: keep a hash-ordered (uniform) sample that fits
+    if max_total_tokens:
+        live = np.flatnonzero(reason == KEPT)
+        ranked = live[np.argsort(hashes[live], kind="stable")]
+        over = np.cumsum(tokens[ranked].astype(np.int64)) > max_total_tokens
+        reason[ranked[over]] = OVER_BUDGET
+    return reason
+
+
+class _ShardWriter:
+    def __init__(self, directory, split, shard_examples):
+        self.directory, self.split, self.shard_examples = directory, split, shard_examples
+        self.shards = []
+        self._file = None
+
+    def write(self, line, tokens):
+        if self._file is None or self.shards[-1]["examples"] >= self.shard_examples:
+            self._finish()
+            name = f"{self.split}-{len(self.shards):05d}.jsonl"
+            self._file = open(os.path.join(self.directory, name), "wb")
+            self._digest = hashlib.sha256()
+            self.shards.append({"file": name, "examples": 0, "tokens": 0})
+        self._file.write(line)
+        self._digest.update(line)
+        self.shards[-1]["examples"] += 1
+        self.shards[-1]["tokens"] += tokens
+
+    def _finish(self):
+        if self._file:
+            self._file.close()
+            self.shards[-1]["sha256"] = self._digest.hexdigest()
+            self._file = None
+
+    def close(self):
+        self._finish()
+        return {"examples": sum(s["examples"] for s in self.shards),
+                "tokens": sum(s["tokens"] for s in self.shards), "shards": self.shards}
+
+
+def _swap_dir(new, target):
+    old = target.rstrip("/") + ".old"
+    shutil.rmtree(old, ignore_errors=True)
+    if os.path.exists(target):
+        os.replace(target, old)
+    os.replace(new, target)
+    shutil.rmtree(old, ignore_errors=True)
+
+
+def shard_paths(out_dir, split, manifest=None):
+    """Paths of one split's shards, in order, from the manifest in ``out_dir``."""
+    if manifest is None:
+        with open(os.path.join(out_dir, "manifest.json"), "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    return [os.path.join(out_dir, s["file"]) for s in manifest["splits"][split]["shards"]]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compile the fine-tuning training set")
+    parser.add_argument("--out", default=TRAINING_DIR)
+    parser.add_argument("--no-memory", action="store_true", help="leave out memory corrections (no database)")
+    parser.add_argument("--max-example-tokens", type=int, default=TRAINING_MAX_EXAMPLE_TOKENS)
+    parser.add_argument("--max-total-tokens", type=int, default=TRAINING_MAX_TOTAL_TOKENS, help="0 = no limit")
+    parser.add_argument("--validation-fraction", type=float, default=TRAINING_VALIDATION_FRACTION)
+    parser.add_argument("--shard-examples", type=int, default=TRAINING_SHARD_EXAMPLES)
+    args = parser.parse_args(argv)
+    manifest = compile_training_set(args.out, not args.no_memory, args.max_example_tokens, args.max_total_tokens,
+                                    args.validation_fraction, args.shard_examples)
+    json.dump({k: manifest[k] for k in ("totals", "dropped", "tokenizer")}, sys.stdout, indent=2)
+    print()
+    for split, info in manifest["splits"].items():
+        print(f"{split}: {info['examples']} examples, {info['tokens']} tokens, {len(info['shards'])} shard(s)")
+
+
+if __name__ == "__main__":
+    main()